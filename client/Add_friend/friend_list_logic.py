@@ -10,43 +10,77 @@ class FriendListLogic:
         self.user_id = user_id
         self.friend_client = FriendClient(self.client)
 
-    async def get_conversations(self):
-        """Lấy danh sách bạn bè từ server, trả về list dict cho UI (chuẩn async, không bị trả về rỗng do callback)"""
+    async def get_conversations(self, snapshot=None):
+        """
+        Lấy danh sách bạn bè từ server, trả về list dict cho UI (chuẩn async, không bị trả về rỗng do callback).
+        snapshot: dữ liệu "bootstrap" sau đăng nhập - có thì dựng luôn, không gửi request nào.
+        """
+        if snapshot and snapshot.get("friends") is not None:
+            inbox_response = snapshot.get("inbox") or {}
+            return self._build_conversations(snapshot["friends"], inbox_response.get("data") or [])
+
         import asyncio
         future = asyncio.get_event_loop().create_future()
 
         async def friends_callback(response):
-            conversations = []
-            # Handle both old and new response formats
-            if response and isinstance(response, dict):
-                # New format: {'status': 'ok', 'data': [...]}
-                if response.get("status") == "ok":
-                    friends = response.get("data", [])
-                # Old format: {'success': True, 'data': [...]}
-                elif response.get("success"):
-                    friends = response.get("data", [])
-                else:
-                    friends = []
+            future.set_result(response)
+
+        await self.friend_client.get_friends(friends_callback)
+        response = await future
+
+        # Tin cuối + badge tin chưa đọc: một request get_inbox cho mọi cuộc trò chuyện
+        return self._build_conversations(response, await self.get_inbox())
+
+    @staticmethod
+    def _build_conversations(response, inbox_entries):
+        """Ghép response get_friends với inbox thành list dict cho UI"""
+        conversations = []
+        # Handle both old and new response formats
+        if response and isinstance(response, dict):
+            # New format: {'status': 'ok', 'data': [...]}
+            if response.get("status") == "ok":
+                friends = response.get("data", [])
+            # Old format: {'success': True, 'data': [...]}
+            elif response.get("success"):
+                friends = response.get("data", [])
             else:
                 friends = []
-                
-            for friend in friends:
-                if isinstance(friend, dict):
-                    friend_id = friend.get('id') or friend.get('friend_id')
-                    friend_display_name = friend.get('name') or friend.get('friend_name') or str(friend_id)
-                else:
-                    continue
-                if not friend_id:
-                    continue
-                conversations.append({
-                    'friend_id': friend_id,
-                    'friend_name': friend_display_name,
-                    'last_message': '',
-                    'last_message_time': '',
-                    'unread_count': 0
-                })
-            future.set_result(conversations)
+        else:
+            friends = []
 
-        await self.friend_client.get_friends(friends_callback)
-        conversations = await future
+        for friend in friends:
+            if isinstance(friend, dict):
+                friend_id = friend.get('id') or friend.get('friend_id')
+                friend_display_name = friend.get('name') or friend.get('friend_name') or str(friend_id)
+            else:
+                continue
+            if not friend_id:
+                continue
+            conversations.append({
+                'friend_id': friend_id,
+                'friend_name': friend_display_name,
+                'last_message': '',
+                'last_message_time': '',
+                'unread_count': 0
+            })
+
+        inbox = {str(entry["peer_id"]): entry for entry in inbox_entries if entry.get("type") == "user"}
+        for conversation in conversations:
+            entry = inbox.get(str(conversation['friend_id']))
+            if entry:
+                conversation['last_message'] = entry.get('last_message') or ''
+                conversation['last_message_time'] = entry.get('last_message_time') or ''
+                conversation['unread_count'] = entry.get('unread_count', 0)
+        # Cuộc trò chuyện mới hoạt động nhất lên đầu, bạn chưa nhắn tin ở cuối
+        conversations.sort(key=lambda c: c['last_message_time'], reverse=True)
         return conversations
+
+    async def get_inbox(self):
+        """[{type, peer_id, peer_name, last_message, last_message_time, unread_count}] từ server"""
+        try:
+            response = await self.client.send_json({"action": "get_inbox", "data": {}})
+            if response and response.get("success"):
+                return response.get("data") or []
+        except Exception as e:
+            print(f"[ERROR][FriendListLogic] get_inbox: {e}")
+        return []
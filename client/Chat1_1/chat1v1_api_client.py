@@ -3,12 +3,13 @@ class Chat1v1APIClient:
     def __init__(self, pyctalk_client):
         self.client = pyctalk_client
 
-    async def get_chat_history(self, user_id, friend_id, limit=50, offset=0):
+    async def get_chat_history(self, user_id, friend_id, limit=50, before=None):
+        """before: next_cursor của trang trước (None = trang mới nhất)"""
         return await self.client.send_request("get_chat_history", {
             "user1": user_id,
             "user2": friend_id,
             "limit": limit,
-            "offset": offset
+            "before": before
         })
 
     async def send_message(self, user_id, friend_id, content):
@@ -53,8 +54,8 @@ class Chat1v1APIClient:
             traceback.print_exc()
             return None
 
-    async def mark_message_as_read(self, friend_id, current_user_id=None):
-        """Mark messages from friend as read"""
+    async def mark_message_as_read(self, friend_id, current_user_id=None, last_message_id=None):
+        """Mark messages from friend as read (tới last_message_id; None = tin mới nhất)"""
         try:
             # Use provided current_user_id or try to get from client
             user_id = current_user_id or getattr(self.client, 'current_user_id', None)
@@ -64,7 +65,8 @@ class Chat1v1APIClient:
                 
             response = await self.client.send_request("mark_as_read", {
                 "user_id": user_id,      # Who is reading the messages
-                "sender_id": friend_id   # Who sent the messages
+                "sender_id": friend_id,  # Who sent the messages
+                "last_message_id": last_message_id
             })
             print(f"[DEBUG][Chat1v1APIClient] mark_message_as_read response: {response}")
             return response
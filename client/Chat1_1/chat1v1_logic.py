@@ -1,6 +1,8 @@
 import asyncio
 import os
 from PyQt6.QtCore import QObject, pyqtSignal
+from Request.read_receipts import ReadReceiptDebouncer
+from Request.file_upload import FileUploader
 
 class Chat1v1Logic(QObject):
     """Logic xử lý tin nhắn, kết nối API với UI"""
@@ -20,10 +22,16 @@ class Chat1v1Logic(QObject):
         # Lazy loading settings
         self.messages_per_load = 15  # Load 15 messages at a time
         self.total_messages_loaded = 0
+        self.history_cursor = None  # next_cursor từ server để tải tin cũ hơn
         self.has_more_messages = True
         self.is_loading_more = False
         self.loading_lock = asyncio.Lock()
 
+        # Receipt "đã đọc": tối đa một request mark_as_read mỗi giây cho cuộc trò chuyện này
+        self.read_receipts = ReadReceiptDebouncer(
+            lambda last_id: self.api_client.mark_message_as_read(self.friend_id, self.current_user_id, last_id)
+        )
+
         # kết nối signal UI → logic
         self._connect_signals()
         
@@ -89,10 +97,8 @@ class Chat1v1Logic(QObject):
                 # Correct parameter order: (message, is_sent, timestamp, sender_name)
                 self.ui.add_message(content, False, timestamp, sender_name)
                 
-                # Mark this new message as read since user has chat window open
-                # Use asyncio to run the async function
-                import asyncio
-                asyncio.create_task(self.api_client.mark_message_as_read(self.friend_id, self.current_user_id))
+                # Mark this new message as read since user has chat window open (debounced)
+                self.read_receipts.schedule(message_data.get('message_id'))
                 print(f"[DEBUG][Chat1v1Logic] Scheduled mark as read for friend {self.friend_id}")
                 
             elif is_relevant and not is_from_other:
@@ -148,31 +154,12 @@ class Chat1v1Logic(QObject):
             print(f"[DEBUG][Chat1v1Logic] Response lịch sử: {resp}")
             
             # Parse messages
-            messages = []
-            total_count = 0
-            if resp:
-                if 'messages' in resp:
-                    messages = resp['messages']
-                    total_count = resp.get('total_count', len(messages))
-                elif 'data' in resp and 'messages' in resp['data']:
-                    messages = resp['data']['messages']
-                    total_count = resp['data'].get('total_count', len(messages))
+            messages, self.history_cursor, self.has_more_messages = self._parse_history_page(resp)
             
             # Update lazy loading state
             self.total_messages_loaded = len(messages)
             
-            # Determine if there are more messages
-            # If we got fewer messages than requested, there are no more
-            # If total_count is available and accurate, use it
-            if len(messages) < self.messages_per_load:
-                self.has_more_messages = False
-            elif total_count > 0:
-                self.has_more_messages = self.total_messages_loaded < total_count
-            else:
-                # Fallback: assume there might be more if we got exactly the requested amount
-                self.has_more_messages = len(messages) == self.messages_per_load
-            
-            print(f"[DEBUG][Chat1v1Logic] Initial load: loaded={len(messages)}, total_loaded={self.total_messages_loaded}, total_count={total_count}, has_more={self.has_more_messages}")
+            print(f"[DEBUG][Chat1v1Logic] Initial load: loaded={len(messages)}, has_more={self.has_more_messages}")
             
             # Clear UI and show messages with batch animation
             self.ui.clear_messages()
@@ -193,12 +180,12 @@ class Chat1v1Logic(QObject):
                 self.ui.setup_scroll_loading(self._load_more_messages)
             
             # Only mark messages as read if there are unread messages from friend
-            has_unread_from_friend = any(
-                not m.get("is_read", False) and int(m.get("user_id") or m.get("from")) == self.friend_id 
-                for m in messages
-            )
-            if has_unread_from_friend:
-                await self.api_client.mark_message_as_read(self.friend_id, self.current_user_id)
+            unread_from_friend = [
+                m.get("message_id") for m in messages
+                if not m.get("is_read", False) and int(m.get("user_id") or m.get("from")) == self.friend_id
+            ]
+            if unread_from_friend:
+                self.read_receipts.schedule(max((mid for mid in unread_from_friend if mid), default=None))
                 print(f"[DEBUG][Chat1v1Logic] Marked unread messages from friend {self.friend_id} as read")
                     
         except Exception as e:
@@ -207,6 +194,16 @@ class Chat1v1Logic(QObject):
                 self.ui.hide_loading_spinner()
             print("[ERROR] load_message_history:", e)
 
+    @staticmethod
+    def _parse_history_page(resp):
+        """Tách (messages, next_cursor, has_more) từ response get_chat_history"""
+        if not resp:
+            return [], None, False
+        page = resp.get('data', resp) if isinstance(resp.get('data'), dict) else resp
+        messages = page.get('messages', [])
+        next_cursor = page.get('next_cursor')
+        return messages, next_cursor, bool(page.get('has_more')) and next_cursor is not None
+
     async def _animate_initial_messages(self, messages):
         """Animate loading of initial messages"""
         batch_size = 3  # Load 3 messages at a time
@@ -261,36 +258,27 @@ class Chat1v1Logic(QObject):
                 return
                 
             self.is_loading_more = True
-            print(f"[DEBUG][Chat1v1Logic] Loading more messages, offset={self.total_messages_loaded}")
+            print(f"[DEBUG][Chat1v1Logic] Loading more messages, cursor={self.history_cursor}")
             
             try:
                 # Show loading indicator
                 if hasattr(self.ui, 'show_loading_bar'):
                     self.ui.show_loading_bar()
                 
-                print(f"[DEBUG][Chat1v1Logic] Calling get_chat_history with user1={self.current_user_id}, user2={self.friend_id}, limit={self.messages_per_load}, offset={self.total_messages_loaded}")
-                
-                # Load more messages with offset
+                # Load older messages from the last cursor
                 resp = await self.api_client.get_chat_history(
                     self.current_user_id,
                     self.friend_id,
                     limit=self.messages_per_load,
-                    offset=self.total_messages_loaded
+                    before=self.history_cursor
                 )
                 
                 print(f"[DEBUG][Chat1v1Logic] Server response: {resp}")
                 
                 if resp:
-                    messages = []
-                    total_count = 0
-                    if 'messages' in resp:
-                        messages = resp['messages']
-                        total_count = resp.get('total_count', 0)
-                    elif 'data' in resp and 'messages' in resp['data']:
-                        messages = resp['data']['messages']
-                        total_count = resp['data'].get('total_count', 0)
+                    messages, next_cursor, has_more = self._parse_history_page(resp)
                     
-                    print(f"[DEBUG][Chat1v1Logic] Extracted {len(messages)} messages from response, total_count={total_count}")
+                    print(f"[DEBUG][Chat1v1Logic] Extracted {len(messages)} messages from response, has_more={has_more}")
                     
                     if messages:
                         # Prepend older messages to UI
@@ -299,17 +287,10 @@ class Chat1v1Logic(QObject):
                             self.ui.prepend_messages(messages)
                         
                         self.total_messages_loaded += len(messages)
+                        self.history_cursor = next_cursor
+                        self.has_more_messages = has_more
                         
-                        # Determine if there are more messages
-                        if len(messages) < self.messages_per_load:
-                            self.has_more_messages = False
-                        elif total_count > 0:
-                            self.has_more_messages = self.total_messages_loaded < total_count
-                        else:
-                            # Fallback: assume there might be more if we got exactly the requested amount
-                            self.has_more_messages = len(messages) == self.messages_per_load
-                        
-                        print(f"[DEBUG][Chat1v1Logic] Loaded {len(messages)} more messages, total={self.total_messages_loaded}, total_count={total_count}, has_more={self.has_more_messages}")
+                        print(f"[DEBUG][Chat1v1Logic] Loaded {len(messages)} more messages, total={self.total_messages_loaded}, has_more={self.has_more_messages}")
                     else:
                         self.has_more_messages = False
                         print(f"[DEBUG][Chat1v1Logic] No more messages to load")
@@ -367,15 +348,10 @@ class Chat1v1Logic(QObject):
                 print(f"[ERROR][Chat1v1Logic] File not found: {file_path}")
                 return
                 
-            # Upload file and get metadata
+            # Upload file lên server theo chunk, nhận metadata file server đã lưu
             try:
-                # Import media handler
-                import sys
-                sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'server'))
-                from media_handler import MediaHandler
-                
-                media_handler = MediaHandler()
-                file_metadata = media_handler.save_uploaded_file(file_path, os.path.basename(file_path))
+                uploader = FileUploader(self.api_client.client)
+                file_metadata = await uploader.upload(file_path)
                 print(f"[DEBUG][Chat1v1Logic] File uploaded successfully: {file_metadata}")
                 
                 # Send file message via API
@@ -406,7 +382,7 @@ class Chat1v1Logic(QObject):
                     message_data = {
                         'message_type': file_metadata['message_type'],
                         'content': caption,
-                        'file_path': file_metadata['file_path'],
+                        'file_path': file_path,  # người gửi đã có file trên máy
                         'file_name': file_metadata['file_name'],
                         'file_size': file_metadata['file_size'],
                         'mime_type': file_metadata['mime_type'],
@@ -31,6 +31,13 @@ class ChatWindow(QtWidgets.QWidget):
         if chat_data and 'current_user_id' in chat_data:
             self.current_user_id = chat_data['current_user_id']
         
+        # Tải media (ảnh, file) chưa có trên máy qua socket chat
+        self.pyctalk_client = kwargs.get('pyctalk_client')
+        self.media_downloader = None
+        if self.pyctalk_client is not None:
+            from Request.media_download import MediaDownloader
+            self.media_downloader = MediaDownloader(self.pyctalk_client)
+        
         # Track previous message for timestamp logic
         self.last_message_time = None
         self.last_message_sender = None
@@ -432,6 +439,9 @@ class ChatWindow(QtWidgets.QWidget):
                     subprocess.call(['open', file_path])
                 else:  # Linux
                     subprocess.call(['xdg-open', file_path])
+            elif self.media_downloader:
+                # File nằm trên server: tải về cache rồi mở
+                asyncio.ensure_future(self._download_and_open(file_path))
             else:
                 print(f"[ERROR][ChatWindow] File not found: {file_path}")
                 
@@ -440,6 +450,16 @@ class ChatWindow(QtWidgets.QWidget):
             from PyQt6.QtWidgets import QMessageBox
             QMessageBox.warning(self, "Error", f"Could not open file: {str(e)}")
 
+    async def _download_and_open(self, server_path):
+        try:
+            local_path = await self.media_downloader.fetch(server_path)
+        except Exception as e:
+            print(f"[ERROR][ChatWindow] Failed to download file: {e}")
+            from PyQt6.QtWidgets import QMessageBox
+            QMessageBox.warning(self, "Error", f"Could not download file: {str(e)}")
+            return
+        self._on_file_clicked(local_path)
+
     def add_message(self, message, is_sent, timestamp=None, sender_name=None, is_read=None):
         """Add text message to chat"""
         self._add_message_internal(message, 'text', is_sent, timestamp, sender_name, is_read)
@@ -485,7 +505,8 @@ class ChatWindow(QtWidgets.QWidget):
                         sender_name=current_sender,
                         show_sender_name=False,  # For 1-1 chat, don't show sender name
                         show_timestamp=show_timestamp,
-                        is_read=is_read if is_sent else None
+                        is_read=is_read if is_sent else None,
+                        downloader=self.media_downloader
                     )
                     # Connect media bubble signals
                     bubble.file_clicked.connect(self._on_file_clicked)
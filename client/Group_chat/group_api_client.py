@@ -33,14 +33,29 @@ class GroupAPIClient:
             "user_id": user_id
         })
 
-    async def get_group_messages(self, group_id: str, user_id: str, limit: int = 50, offset: int = 0):
+    async def get_group_messages(self, group_id: str, user_id: str, limit: int = 50, before: str = None):
+        """before: next_cursor của trang trước (None = trang mới nhất)"""
         return await self._send("get_group_messages", {
             "group_id": group_id,
             "user_id": user_id,
             "limit": limit,
-            "offset": offset
+            "before": before
         })
 
+    async def mark_group_as_read(self, group_id: str, user_id: str):
+        return await self._send("mark_group_as_read", {
+            "group_id": group_id,
+            "user_id": user_id
+        })
+
+    async def get_unread_counts(self):
+        """Badge tin chưa đọc của mọi cuộc trò chuyện (1-1 và nhóm)"""
+        return await self._send("get_unread_counts", {})
+
+    async def get_inbox(self):
+        """Mọi cuộc trò chuyện (1-1 và nhóm) kèm tin cuối + số tin chưa đọc, mới nhất trước"""
+        return await self._send("get_inbox", {})
+
     async def send_group_message(self, sender_id: str, group_id: str, content: str):
         return await self._send("send_group_message", {
             "sender_id": sender_id,  # Server expects sender_id
@@ -4,6 +4,7 @@ from PyQt6 import QtCore
 import re
 import asyncio
 import os
+from Request.read_receipts import ReadReceiptDebouncer
 
 
 class GroupChatLogic:
@@ -18,10 +19,12 @@ class GroupChatLogic:
         self.message_offset = 0
         self.loading_lock = asyncio.Lock()  # Prevent concurrent loading
         self._realtime_connected = False
+        self._read_receipts = {}  # {group_id: ReadReceiptDebouncer}
         
         # Lazy loading settings
         self.messages_per_load = 20  # Tải 20 tin nhắn mỗi lần thay vì 50
         self.total_messages_loaded = 0
+        self.history_cursor = None  # next_cursor từ server để tải tin cũ hơn
         self.has_more_messages = True
         self.is_loading_more = False
 
@@ -63,19 +66,22 @@ class GroupChatLogic:
             
             if group_id == current_group_id:
                 # Check if message is from another user (not current user)
-                sender_id = str(message_data.get('user_id', ''))
+                sender_id = str(message_data.get('sender_id', message_data.get('user_id', '')))
                 current_user_id = str(self.user_id)
+                content = message_data.get('content', message_data.get('message', ''))
                 
                 if sender_id != current_user_id:
                     # Add message to UI immediately
-                    content = message_data.get('message', '')
-                    timestamp = message_data.get('timestamp', '')
-                    sender_name = message_data.get('username', 'Unknown')
+                    timestamp = message_data.get('time_send', message_data.get('timestamp', ''))
+                    sender_name = message_data.get('sender_name', message_data.get('username', 'Unknown'))
                     
                     print(f"[DEBUG][GroupChatLogic] Adding real-time group message to UI: {content}")
                     
                     # Add to UI as message from another user (show sender name in group)
                     self.ui.add_message(content, False, timestamp, sender_name, show_sender_name=True)
+                    self.total_messages_loaded += 1
+                    # Đang mở nhóm này -> tin đã được xem, badge nhóm về 0 (debounce theo nhóm)
+                    self._group_read_receipts(group_id).schedule()
                 else:
                     print(f"[DEBUG][GroupChatLogic] Ignoring own message from real-time: {content}")
             else:
@@ -86,6 +92,13 @@ class GroupChatLogic:
             import traceback
             traceback.print_exc()
 
+    def _group_read_receipts(self, group_id):
+        if group_id not in self._read_receipts:
+            self._read_receipts[group_id] = ReadReceiptDebouncer(
+                lambda _: self.api_client.mark_group_as_read(group_id, self.user_id)
+            )
+        return self._read_receipts[group_id]
+
     # ---------------------------
     # Load danh sách nhóm
     # ---------------------------
@@ -146,25 +159,21 @@ class GroupChatLogic:
             return
             
         print(f"[DEBUG] Loading initial {self.messages_per_load} messages...")
-        await self.load_group_messages(offset=0, limit=self.messages_per_load, is_initial=True)
+        await self.load_group_messages(limit=self.messages_per_load, is_initial=True)
 
     async def load_more_messages(self):
         """Load thêm tin nhắn cũ hơn khi user cuộn lên"""
         if not self.has_more_messages or self.is_loading_more:
             return
             
-        print(f"[DEBUG] Loading more messages, offset={self.total_messages_loaded}")
-        await self.load_group_messages(
-            offset=self.total_messages_loaded, 
-            limit=self.messages_per_load, 
-            is_initial=False
-        )
+        print(f"[DEBUG] Loading more messages, cursor={self.history_cursor}")
+        await self.load_group_messages(limit=self.messages_per_load, is_initial=False)
 
     # ---------------------------
     # Tải tin nhắn nhóm
     # ---------------------------
-    async def load_group_messages(self, offset=0, limit=20, is_initial=True):
-        """Load tin nhắn với lazy loading support"""
+    async def load_group_messages(self, limit=20, is_initial=True):
+        """Load tin nhắn với lazy loading support (initial: trang mới nhất, còn lại: theo cursor)"""
         async with self.loading_lock:  # Prevent concurrent loading
             if not self.current_group:
                 print("[GroupChatLogic] current_group is None, abort load_group_messages")
@@ -173,8 +182,11 @@ class GroupChatLogic:
             if not is_initial:
                 self.is_loading_more = True
                 
+            before = None if is_initial else self.history_cursor
+            if not is_initial and before is None:
+                return  # chưa có cursor -> không còn gì để tải thêm
             response = await self.api_client.get_group_messages(
-                self.current_group["group_id"], self.user_id, limit, offset
+                self.current_group["group_id"], self.user_id, limit, before
             )
             
             if not is_initial:
@@ -186,16 +198,19 @@ class GroupChatLogic:
                 
             if response.get("success"):
                 messages = response.get("messages", [])
-                print(f"[DEBUG] load_group_messages: Loaded {len(messages)} messages for group_id={self.current_group['group_id']}, offset={offset}")
+                print(f"[DEBUG] load_group_messages: Loaded {len(messages)} messages for group_id={self.current_group['group_id']}, cursor={before}")
                 
                 # Cập nhật trạng thái
-                if len(messages) < limit:
-                    self.has_more_messages = False
+                if is_initial:
+                    self.total_messages_loaded = 0
+                self.history_cursor = response.get("next_cursor")
+                self.has_more_messages = bool(response.get("has_more")) and self.history_cursor is not None
+                if not self.has_more_messages:
                     print("[DEBUG] No more messages to load")
                 
                 if len(messages) > 0:
                     self.total_messages_loaded += len(messages)
-                    self.display_messages(messages, offset, self.username, is_initial)
+                    self.display_messages(messages, self.username, is_initial)
                 else:
                     print("[DEBUG] No messages returned")
             else:
@@ -206,11 +221,11 @@ class GroupChatLogic:
                     return    # ---------------------------
     # Hiển thị tin nhắn
     # ---------------------------
-    def display_messages(self, messages, offset, username, is_initial=True):
+    def display_messages(self, messages, username, is_initial=True):
         """Hiển thị tin nhắn với hỗ trợ lazy loading và smooth animation"""
         try:
             # Không clear messages nếu đang load more (prepend vào đầu)
-            if not is_initial and offset > 0:
+            if not is_initial:
                 # Prepend messages vào đầu danh sách với animation
                 print(f"[DEBUG] Prepending {len(messages)} older messages with animation")
                 asyncio.create_task(self._animate_prepend_messages(messages, username))
@@ -26,13 +26,17 @@ class LogoutHandler:
                 self.client.user_id = None
             if hasattr(self.client, 'username'):
                 self.client.username = None
+            # Token nối lại phiên bị thu hồi cùng request switch_user bên dưới
+            resume_token = getattr(self.client, '_resume_token', None)
+            self.client._resume_token = None
+            self.client._auto_reconnect = False
             print(f"[DEBUG][LogoutHandler] Cleared local session data")
 
             # Gửi switch_user request để logout nhưng giữ connection
             try:
                 request = {
                     "action": "switch_user",  # Use switch_user instead of logout
-                    "data": {"username": username}
+                    "data": {"username": username, "resume_token": resume_token}
                 }
                 
                 async def switch_user_callback(response):
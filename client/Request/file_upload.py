@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import os
+
+
+UPLOAD_WINDOW = 4 * 256 * 1024   # byte đã gửi nhưng server chưa ack tối đa (giới hạn bộ nhớ hai phía)
+ACK_TIMEOUT = 30.0               # giây chờ ack trước khi coi như mất kết nối
+MAX_RESUME_ATTEMPTS = 5          # số lần nối lại một upload sau khi mất kết nối
+MAX_RESYNCS = 3                  # số lần gửi lại từ offset server báo (ack "Sai offset") cho một upload
+RECONNECT_WAIT = 30.0            # giây chờ client đăng nhập lại trước mỗi lần nối lại
+
+
+class UploadError(Exception):
+    pass
+
+
+class _Resync(Exception):
+    """Server báo sai offset (ack có "resync"): gọi lại upload_begin để lấy offset chính xác"""
+
+
+async def wait_for_connection(client, timeout=RECONNECT_WAIT):
+    """Chờ client kết nối + đăng nhập lại (auto-reconnect/resume), tối đa timeout giây"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        await asyncio.sleep(0.5)
+        if client.running and client.is_logged_in():
+            return
+
+
+def _sha256_file(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _read_at(path, offset, length):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+class FileUploader:
+    """
+    Upload file lên server qua socket chat: upload_begin -> frame nhị phân theo chunk -> upload_commit.
+    Chunk đọc từ đĩa từng phần (không nạp cả file), tối đa UPLOAD_WINDOW byte chưa được ack.
+    Mất kết nối giữa chừng: chờ client nối lại rồi upload_begin trả offset server đã nhận, gửi tiếp từ đó.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    async def upload(self, file_path, progress=None):
+        """
+        Trả về metadata server lưu (message_type, file_path, file_name, file_size, mime_type, thumbnail_path...).
+        progress(sent_bytes, total_bytes) được gọi sau mỗi ack.
+        """
+        loop = asyncio.get_running_loop()
+        file_name = os.path.basename(file_path)
+        size = os.path.getsize(file_path)
+        sha256 = await loop.run_in_executor(None, _sha256_file, file_path)
+
+        attempts = resyncs = 0
+        while True:
+            if os.path.getsize(file_path) != size:
+                raise UploadError(f"File {file_name} bị thay đổi trong lúc upload")
+            try:
+                return await self._upload_once(file_path, file_name, size, sha256, progress)
+            except _Resync as e:
+                resyncs += 1
+                if resyncs > MAX_RESYNCS:
+                    raise UploadError(f"Upload {file_name} thất bại: server liên tục báo sai offset ({e})")
+                continue
+            except ConnectionError as e:
+                attempts += 1
+                if attempts > MAX_RESUME_ATTEMPTS:
+                    raise UploadError(f"Upload {file_name} thất bại sau {attempts} lần thử: {e}")
+                print(f"⚠️ Upload {file_name} bị gián đoạn ({e}), chờ kết nối lại...")
+                await wait_for_connection(self.client)
+
+    async def _upload_once(self, file_path, file_name, size, sha256, progress):
+        response = await self.client.send_json({
+            "action": "upload_begin",
+            "data": {"file_name": file_name, "size": size, "sha256": sha256},
+        })
+        if response is None:
+            raise ConnectionError("không có phản hồi upload_begin")
+        if not response.get("success"):
+            raise UploadError(response.get("message", "upload_begin thất bại"))
+        if response.get("exists"):
+            # Server đã có nội dung này (cùng sha256): không cần gửi dữ liệu
+            if progress:
+                progress(size, size)
+            return response.get("data") or {}
+
+        upload_id = response["upload_id"]
+        chunk_size = response.get("chunk_size") or 256 * 1024
+        header = bytes.fromhex(upload_id)
+        state = {"acked": response.get("offset", 0), "error": None, "lost": False}
+        acked_event = asyncio.Event()
+
+        def on_ack(ack):
+            if ack is None:
+                state["lost"] = True
+            elif ack.get("success"):
+                state["acked"] = max(state["acked"], ack.get("offset", 0))
+            else:
+                state["error"] = ack
+            acked_event.set()
+
+        self.client._upload_listeners[upload_id] = on_ack
+        loop = asyncio.get_running_loop()
+        try:
+            sent = state["acked"]
+            if progress:
+                progress(sent, size)
+            while state["acked"] < size:
+                while sent < size and sent - state["acked"] < UPLOAD_WINDOW:
+                    data = await loop.run_in_executor(None, _read_at, file_path, sent, chunk_size)
+                    if not data:
+                        raise UploadError(f"File {file_name} bị thay đổi trong lúc upload")
+                    if not await self.client.send_binary(header + sent.to_bytes(8, "big") + data):
+                        raise ConnectionError("không gửi được chunk")
+                    sent += len(data)
+
+                # Kiểm tra rồi clear không có await ở giữa nên không lỡ ack đến trong lúc gửi
+                if state["acked"] < sent and state["error"] is None and not state["lost"]:
+                    acked_event.clear()
+                    try:
+                        await asyncio.wait_for(acked_event.wait(), timeout=ACK_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        raise ConnectionError("quá thời gian chờ ack")
+                if state["lost"]:
+                    raise ConnectionError("mất kết nối")
+                if state["error"] is not None:
+                    # Chỉ lệch offset mới gửi lại được; lỗi kích thước/dữ liệu gửi lại cũng hỏng y như cũ
+                    if state["error"].get("resync"):
+                        raise _Resync(state["error"].get("message"))
+                    raise UploadError(state["error"].get("message", "Chunk bị từ chối"))
+                if progress:
+                    progress(state["acked"], size)
+        finally:
+            if self.client._upload_listeners.get(upload_id) is on_ack:
+                del self.client._upload_listeners[upload_id]
+
+        response = await self.client.send_json({"action": "upload_commit", "data": {"upload_id": upload_id}},
+                                               timeout=60.0)
+        if response is None:
+            raise ConnectionError("không có phản hồi upload_commit")
+        if not response.get("success"):
+            raise UploadError(response.get("message", "upload_commit thất bại"))
+        return response.get("data") or {}
@@ -1,14 +1,20 @@
 import asyncio
 import json
+from collections import OrderedDict
 from PyQt6.QtCore import QObject, pyqtSignal
 
 
+BINARY_FRAME_FLAG = 0x80000000  # Bit cao của length prefix: frame nhị phân (chunk upload/download), không phải JSON
+SEEN_MESSAGES_LIMIT = 5000      # số message_id gần nhất nhớ để bỏ tin trùng (push, lịch sử + sync quét lại đoạn trước cursor)
+
+
 class AsyncPycTalkClient(QObject):
     # Signals for real-time events
     new_message_received = pyqtSignal(dict)  # Emit when new 1-1 message received
     new_group_message_received = pyqtSignal(dict)  # Emit when new group message received
     messages_read = pyqtSignal(dict)  # Emit when messages are read by recipient
     user_status_changed = pyqtSignal(str, str)  # Emit when user status changes
+    session_resumed = pyqtSignal(dict)  # Emit sau khi "resume" thành công: {"inbox": [...thay đổi], "unread": {...}}
     async def send_request(self, action, data):
         """
         Chuẩn hóa API cho chat 1-1: get_chat_history, send_message
@@ -22,7 +28,9 @@ class AsyncPycTalkClient(QObject):
                 "data": {
                     "user1": data.get("user_id") or data.get("user1"),
                     "user2": data.get("friend_id") or data.get("user2"),
-                    "limit": data.get("limit", 50)
+                    "limit": data.get("limit", 50),
+                    "before": data.get("before"),  # cursor phân trang
+                    "after": data.get("after"),
                 }
             }
         elif action == "send_message":
@@ -57,15 +65,25 @@ class AsyncPycTalkClient(QObject):
         # Thông tin user
         self.user_id = None
         self.username = None
+        self._bootstrap_task = None  # Snapshot "bootstrap" sau đăng nhập (dùng chung cho các widget)
 
         # Queue ghép request với callback - sử dụng dict để match theo ID
-        self._pending_requests = {}  # {request_id: callback}
+        self._pending_requests = {}  # {request_id: asyncio.Future}
         self._request_counter = 0
+        self._request_timeout = 10.0  # Timeout mặc định cho mỗi request
         self._listen_task = None
+        self._upload_listeners = {}  # {upload_id: callback(ack | None)} cho các upload đang chạy
+        self._download_listeners = {}  # {download_id: callback(offset, data) | callback(None, None)} cho các download
         
         # Auto-reconnect settings
         self._auto_reconnect = False
-        self._login_credentials = {}
+        self._resume_token = None  # Token server cấp khi login, dùng để nối lại phiên (không lưu mật khẩu)
+        self._last_private_message_id = 0  # Cursor "sync": tin 1-1 / tin nhóm mới nhất client đã thấy
+        self._last_group_message_id = 0
+        self._syncing = False  # đang chạy sync()
+        self._seen_messages = OrderedDict()  # {("user"|"group", message_id): None} đã phát / đã hiện - chống trùng
+        self._sync_floor = {}  # {"user"|"group": cursor lúc login} - tin cũ hơn thuộc trang lịch sử, sync không phát
+        self._sync_pushed = {}  # {"user"|"group": id push lớn nhất trong lúc sync} - cursor chỉ tiến sau khi sync xong
         self._reconnect_attempts = 0
         self._max_reconnect_attempts = 3
 
@@ -78,25 +96,24 @@ class AsyncPycTalkClient(QObject):
             
         self._reconnect_attempts += 1
         print(f"🔄 Reconnection attempt {self._reconnect_attempts}/{self._max_reconnect_attempts}")
+
+        # Response cho các request trên kết nối cũ sẽ không bao giờ đến
+        self._fail_pending_requests()
         
         # Wait before reconnecting
         await asyncio.sleep(2)
         
         # Try to reconnect
         if await self.connect():
-            # Try to re-login with saved credentials
-            if self._login_credentials:
-                print("🔑 Re-logging in with saved credentials...")
-                response = await self.login(
-                    self._login_credentials['username'],
-                    self._login_credentials['password']
-                )
-                if response and response.get("success"):
-                    print("✅ Reconnected and re-logged in successfully!")
+            # Nối lại phiên bằng resume token thay vì đăng nhập lại
+            if self._resume_token:
+                print("🔑 Resuming session with resume token...")
+                if await self.resume():
+                    print("✅ Reconnected and resumed session successfully!")
                     self._reconnect_attempts = 0  # Reset counter on success
                     return True
                 else:
-                    print("❌ Failed to re-login after reconnection")
+                    print("❌ Failed to resume session after reconnection")
                     return False
             else:
                 print("✅ Reconnected successfully!")
@@ -126,7 +143,9 @@ class AsyncPycTalkClient(QObject):
 
         self.user_id = None
         self.username = None
+        self._bootstrap_task = None
         self.running = False
+        self._fail_pending_requests()
 
         if self.writer:
             try:
@@ -138,76 +157,115 @@ class AsyncPycTalkClient(QObject):
             finally:
                 self.reader, self.writer = None, None
 
-    async def send_json(self, data: dict, callback=None):
+    async def send_json(self, data: dict, callback=None, timeout=None):
+        """
+        Gửi request và chờ response khớp theo _request_id.
+        Lock chỉ bao quanh việc ghi frame nên nhiều request có thể chờ response cùng lúc.
+        timeout: thời gian chờ response riêng cho request này (mặc định self._request_timeout)
+        """
         print(f"[DEBUG] send_json called with data: {data}")
+        if not self.writer or not self.running:
+            print("⚠️ Chưa có kết nối hoặc kết nối đã bị đóng.")
+            return None
+
+        # Tạo unique request ID
+        self._request_counter += 1
+        request_id = f"req_{self._request_counter}"
+
+        # Tạo future và đăng ký TRƯỚC khi gửi để không lỡ response đến sớm
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_requests[request_id] = future
+
         try:
-            # Thêm timeout cho lock để tránh deadlock
-            async def acquire_lock_and_send():
+            request_with_id = {**data, "_request_id": request_id}
+            json_request = json.dumps(request_with_id).encode()
+            prefix = len(json_request).to_bytes(4, 'big')
+            try:
                 async with self._io_lock:
-                    print(f"[DEBUG] Acquired io_lock for data: {data}")
-                    try:
-                        if not self.writer or not self.running:
-                            print("⚠️ Chưa có kết nối hoặc kết nối đã bị đóng.")
-                            return None
-
-                        # Tạo unique request ID
-                        self._request_counter += 1
-                        request_id = f"req_{self._request_counter}"
-                        
-                        # Tạo future để nhận response
-                        loop = asyncio.get_running_loop()
-                        future = loop.create_future()
-                        print(f"[DEBUG] Created future for data: {data} with ID: {request_id}")
-
-                        def _response_callback(response):
-                            if callback:
-                                # Nếu là coroutine thì await, nếu là function thì gọi trực tiếp
-                                if asyncio.iscoroutinefunction(callback):
-                                    loop.create_task(callback(response))
-                                else:
-                                    callback(response)
-                            if not future.done():
-                                future.set_result(response)
-
-                        # Gửi request với ID
-                        request_with_id = {**data, "_request_id": request_id}
-                        json_request = json.dumps(request_with_id).encode()
-                        prefix = len(json_request).to_bytes(4, 'big')
-                        print(f"[DEBUG] Sending request: {request_with_id}")
-                        self.writer.write(prefix + json_request)
-                        await self.writer.drain()
-                        
-                        # Lưu callback theo ID
-                        self._pending_requests[request_id] = _response_callback
-                        print(f"[DEBUG] Callback stored with ID: {request_id}, pending count: {len(self._pending_requests)}")
-                        
-                        # Chờ response
-                        response = await future
-                        print(f"[DEBUG] Received response for request ID {request_id}: {response}")
-                        return response
-                    except Exception as e:
-                        print(f"❌ Lỗi khi gửi dữ liệu: {e}")
-                        await self.disconnect()
+                    if not self.writer:
                         return None
-            
-            # Sử dụng wait_for cho Python 3.8 compatibility
-            return await asyncio.wait_for(acquire_lock_and_send(), timeout=5.0)
-        except asyncio.TimeoutError:
-            print(f"[ERROR] Lock timeout for data: {data} - possible deadlock!")
-            return None
+                    self.writer.write(prefix + json_request)
+                    await self.writer.drain()
+            except Exception as e:
+                print(f"❌ Lỗi khi gửi dữ liệu: {e}")
+                await self.disconnect()
+                return None
+            print(f"[DEBUG] Sent request ID: {request_id}, in-flight: {len(self._pending_requests)}")
+
+            # Chờ response với timeout riêng của request này
+            wait_timeout = self._request_timeout if timeout is None else timeout
+            try:
+                response = await asyncio.wait_for(future, timeout=wait_timeout)
+            except asyncio.TimeoutError:
+                print(f"[ERROR] Request {request_id} ({data.get('action')}) timed out after {wait_timeout}s")
+                return None
+
+            if response is not None and response.get("success"):
+                self._note_sent(data.get("action"), response)
+            if response is not None and callback:
+                # Nếu là coroutine thì await, nếu là function thì gọi trực tiếp
+                if asyncio.iscoroutinefunction(callback):
+                    await callback(response)
+                else:
+                    callback(response)
+            return response
         except Exception as e:
             print(f"[ERROR] send_json error: {e}")
             return None
+        finally:
+            # Dọn entry mồ côi (timeout, cancel, lỗi gửi)
+            self._pending_requests.pop(request_id, None)
+            if not future.done():
+                future.cancel()
+
+    async def send_binary(self, payload: bytes) -> bool:
+        """Gửi một frame nhị phân (chunk upload). Chỉ giữ lock trong lúc ghi một frame nên request khác vẫn xen vào được."""
+        if not self.writer or not self.running:
+            return False
+        try:
+            async with self._io_lock:
+                if not self.writer:
+                    return False
+                self.writer.write((len(payload) | BINARY_FRAME_FLAG).to_bytes(4, 'big') + payload)
+                await self.writer.drain()
+            return True
+        except Exception as e:
+            print(f"❌ Lỗi khi gửi chunk: {e}")
+            return False
+
+    def _fail_pending_requests(self):
+        """Trả None cho mọi request đang chờ khi mất kết nối"""
+        pending = list(self._pending_requests.values())
+        self._pending_requests.clear()
+        for future in pending:
+            if not future.done():
+                future.set_result(None)
+        for on_ack in list(self._upload_listeners.values()):
+            on_ack(None)  # upload đang chạy sẽ chờ kết nối lại rồi gửi tiếp
+        for on_chunk in list(self._download_listeners.values()):
+            on_chunk(None, None)  # download đang chạy sẽ tải tiếp phần còn thiếu bằng range
+        if pending:
+            print(f"[DEBUG] Released {len(pending)} pending requests after disconnect")
+
     async def listen_loop(self):
-        """Lắng nghe phản hồi từ server và gọi callback theo request ID"""
+        """Lắng nghe phản hồi từ server và resolve future theo request ID"""
         while self.running and self.reader:
             try:
                 length_prefix = await self.reader.readexactly(4)
                 response_length = int.from_bytes(length_prefix, 'big')
+                is_binary = bool(response_length & BINARY_FRAME_FLAG)
+                response_length &= ~BINARY_FRAME_FLAG
                 if response_length <= 0 or response_length > 10 * 1024 * 1024:
                     print(f"⚠️ Response length không hợp lệ: {response_length}")
                     continue
                 response_data = await self.reader.readexactly(response_length)
+                if is_binary:
+                    # Chunk media tải xuống: download_id (16 byte) + offset (8 byte) + dữ liệu
+                    on_chunk = self._download_listeners.get(response_data[:16].hex())
+                    if on_chunk:
+                        on_chunk(int.from_bytes(response_data[16:24], 'big'), memoryview(response_data)[24:])
+                    continue
                 try:
                     response = json.loads(response_data.decode())
                     print("📥 Phản hồi từ server:", response)
@@ -216,31 +274,26 @@ class AsyncPycTalkClient(QObject):
                     request_id = response.get("_request_id")
                     if request_id and request_id in self._pending_requests:
                         # Đây là response cho một request đã gửi
-                        print(f"[DEBUG] Found callback for request ID: {request_id}")
-                        callback = self._pending_requests.pop(request_id)
-                        print(f"[DEBUG] Remaining pending requests: {len(self._pending_requests)}")
-                        if callback:
-                            # Nếu là coroutine thì await, nếu là function thì gọi trực tiếp
-                            if asyncio.iscoroutinefunction(callback):
-                                await callback(response)
-                            else:
-                                callback(response)
-                            print(f"[DEBUG] Callback executed successfully for ID: {request_id}")
+                        future = self._pending_requests.pop(request_id)
+                        if not future.done():
+                            future.set_result(response)
+                        print(f"[DEBUG] Resolved request ID: {request_id}, remaining: {len(self._pending_requests)}")
                     elif not request_id:
                         # Đây là message được server push (không phải response cho request)
                         print(f"[DEBUG] Received pushed message from server: {response}")
                         await self._handle_pushed_message(response)
                     else:
-                        print(f"[WARNING] No callback found for request ID: {request_id}")
+                        print(f"[WARNING] No pending request for ID: {request_id} (late response after timeout?)")
                         print(f"[DEBUG] Pending request IDs: {list(self._pending_requests.keys())}")
                 except json.JSONDecodeError as e:
                     print(f"⚠️ Lỗi parse JSON: {e}. Data: {response_data}")
             except asyncio.IncompleteReadError:
                 print("⚠️ Server đóng kết nối.")
-                # Try to reconnect automatically if we have login credentials
+                # Try to reconnect automatically if we have a resume token.
+                # Chạy ở task riêng: listen_loop phải kết thúc để kết nối mới có listen_loop đọc response
                 if hasattr(self, '_auto_reconnect') and self._auto_reconnect:
                     print("🔄 Attempting to reconnect...")
-                    await self._attempt_reconnect()
+                    asyncio.create_task(self._attempt_reconnect())
                 else:
                     await self.disconnect()
                 break
@@ -249,7 +302,7 @@ class AsyncPycTalkClient(QObject):
                 # Try to reconnect for connection errors
                 if hasattr(self, '_auto_reconnect') and self._auto_reconnect and "connection" in str(e).lower():
                     print("🔄 Attempting to reconnect...")
-                    await self._attempt_reconnect()
+                    asyncio.create_task(self._attempt_reconnect())
                 else:
                     await self.disconnect()
                 break
@@ -275,11 +328,7 @@ class AsyncPycTalkClient(QObject):
     async def login(self, username, password):
         if not await self.connect():
             return
-            
-        # Save credentials for auto-reconnect
-        self._login_credentials = {'username': username, 'password': password}
-        self._auto_reconnect = True
-        
+
         request = {
             "action": "login",
             "data": {
@@ -292,14 +341,139 @@ class AsyncPycTalkClient(QObject):
             print("✅ Đăng nhập thành công.")
             self.user_id = response.get("user_id")
             self.username = username
+            self._bootstrap_task = None
+            # Auto-reconnect dùng resume token, mật khẩu không được giữ lại
+            self._resume_token = response.get("resume_token")
+            self._auto_reconnect = bool(self._resume_token)
+            sync_cursor = response.get("sync_cursor") or {}
+            self._last_private_message_id = sync_cursor.get("private", 0)
+            self._last_group_message_id = sync_cursor.get("group", 0)
+            self._sync_floor = {"user": self._last_private_message_id, "group": self._last_group_message_id}
+            self._seen_messages.clear()
             self.start_ping()
             self._reconnect_attempts = 0  # Reset on successful login
             return response
         else:
             self._auto_reconnect = False  # Disable auto-reconnect on login failure
+            self._resume_token = None
             await self.disconnect()
             return response
 
+    async def resume(self):
+        """
+        Nối lại phiên trên kết nối mới bằng resume token. Server trả về các cuộc trò chuyện có
+        tin mới hơn cursor của client (session_resumed), sau đó "sync" lấy đúng các tin bị lỡ;
+        UI không phải tải lại toàn bộ.
+        """
+        response = await self.send_json({
+            "action": "resume",
+            "data": {
+                "resume_token": self._resume_token,
+                "last_private_message_id": self._last_private_message_id,
+                "last_group_message_id": self._last_group_message_id,
+            }
+        })
+        if response and response.get("success"):
+            self.user_id = response.get("user_id")
+            self.username = response.get("username")
+            self._resume_token = response.get("resume_token") or self._resume_token
+            self.start_ping()
+            self.session_resumed.emit(response.get("changes") or {})
+            await self.sync()
+            return True
+        if response is not None:
+            # Token hết hạn/bị thu hồi: phải đăng nhập lại
+            self._resume_token = None
+            self._auto_reconnect = False
+        return False
+
+    async def sync(self):
+        """
+        Lấy các tin bị lỡ (mới hơn cursor) theo từng chunk và phát lại qua new_message_received /
+        new_group_message_received như tin push, nên cửa sổ chat chỉ thêm đúng các tin còn thiếu.
+        """
+        self._syncing = True
+        rescan = True  # chunk đầu: server quét lại một đoạn trước cursor (tin commit muộn)
+        try:
+            while True:
+                response = await self.send_json({
+                    "action": "sync",
+                    "data": {
+                        "private_after": self._last_private_message_id,
+                        "group_after": self._last_group_message_id,
+                        "rescan": rescan,
+                    }
+                })
+                rescan = False
+                if not response or not response.get("success"):
+                    print(f"❌ Sync thất bại: {response}")
+                    return False
+                chunk = response.get("data") or {}
+                for message in chunk.get("private") or []:
+                    if self._sync_is_new("user", message.get("message_id")):
+                        self.new_message_received.emit(message)
+                for message in chunk.get("groups") or []:
+                    if self._sync_is_new("group", message.get("message_id")):
+                        self.new_group_message_received.emit(message)
+                # Gán thẳng: khi còn tin, cursor có thể vẫn nằm trong đoạn quét lại (nhỏ hơn cursor cũ)
+                self._last_private_message_id = chunk.get("private_cursor", self._last_private_message_id)
+                self._last_group_message_id = chunk.get("group_cursor", self._last_group_message_id)
+                print(f"[DEBUG] Sync chunk: {len(chunk.get('private') or [])} tin 1-1, "
+                      f"{len(chunk.get('groups') or [])} tin nhóm, has_more={chunk.get('has_more')}")
+                if not chunk.get("has_more"):
+                    return True
+        finally:
+            self._syncing = False
+            pushed, self._sync_pushed = self._sync_pushed, {}
+            self._last_private_message_id = max(self._last_private_message_id, pushed.get("user", 0))
+            self._last_group_message_id = max(self._last_group_message_id, pushed.get("group", 0))
+
+    def _advance_cursor(self, kind, message_id):
+        """Tin push đã nhận. Đang sync thì để dành: cursor tiến sớm sẽ làm sync bỏ qua tin cũ hơn còn thiếu."""
+        if not isinstance(message_id, int):
+            return
+        if self._syncing:
+            self._sync_pushed[kind] = max(self._sync_pushed.get(kind, 0), message_id)
+        elif kind == "group":
+            self._last_group_message_id = max(self._last_group_message_id, message_id)
+        else:
+            self._last_private_message_id = max(self._last_private_message_id, message_id)
+
+    def _sync_is_new(self, kind, message_id):
+        """Tin sync quét lại: bỏ tin trước lúc login (đã thuộc trang lịch sử) và tin đã phát / đã hiện"""
+        if isinstance(message_id, int) and message_id <= self._sync_floor.get(kind, 0):
+            return False
+        return self._mark_delivered(kind, message_id)
+
+    def _note_sent(self, action, response):
+        """
+        Tin đã hiện trên UI mà không qua push: tin chính client này gửi và tin trong các trang lịch sử.
+        Ghi nhận id để sync quét lại không phát trùng vào cửa sổ chat đang mở.
+        """
+        if action == "send_message":
+            self._mark_delivered("user", response.get("message_id"))
+        elif action == "send_file_message":
+            self._mark_delivered("user", (response.get("data") or {}).get("message_id"))
+        elif action == "send_group_message":
+            self._mark_delivered("group", (response.get("message_data") or {}).get("message_id"))
+        elif action == "get_chat_history":
+            for message in (response.get("data") or {}).get("messages") or []:
+                self._mark_delivered("user", message.get("message_id"))
+        elif action == "get_group_messages":
+            for message in response.get("messages") or []:
+                self._mark_delivered("group", message.get("message_id"))
+
+    def _mark_delivered(self, kind, message_id):
+        """False nếu tin đã được phát (push và sync chồng nhau, hoặc sync quét lại tin đã nhận)"""
+        if message_id is None:
+            return True
+        if (kind, message_id) in self._seen_messages:
+            return False
+        self._seen_messages[(kind, message_id)] = None
+        if len(self._seen_messages) > SEEN_MESSAGES_LIMIT:
+            self._seen_messages.popitem(last=False)
+        return True
+
     def start_ping(self):
         # Tạm disable ping để test send_message
         print("[DEBUG] Ping disabled for testing")
@@ -333,6 +507,19 @@ class AsyncPycTalkClient(QObject):
     def is_logged_in(self):
         return self.user_id is not None and self.username is not None
 
+    async def get_bootstrap(self):
+        """
+        Snapshot sau đăng nhập (profile, friends, friend_requests, sent_requests, groups, inbox),
+        mỗi phần có cùng dạng response với action riêng lẻ. Chỉ gửi một request "bootstrap"
+        cho mọi widget gọi trong cùng phiên; None nếu server không trả được.
+        """
+        if self._bootstrap_task is None:
+            self._bootstrap_task = asyncio.ensure_future(self.send_json({"action": "bootstrap", "data": {}}))
+        response = await asyncio.shield(self._bootstrap_task)
+        if response and response.get("success"):
+            return response.get("data") or {}
+        return None
+
     async def _handle_pushed_message(self, data):
         """Handle server-pushed messages for real-time events"""
         try:
@@ -346,11 +533,17 @@ class AsyncPycTalkClient(QObject):
             if action == 'new_message':
                 # Real-time 1-1 message received
                 print(f"[DEBUG] New 1-1 message pushed from server: {message_data}")
+                if not self._mark_delivered("user", message_data.get("message_id")):
+                    return
+                self._advance_cursor("user", message_data.get("message_id"))
                 self.new_message_received.emit(message_data)
                 
             elif action == 'new_group_message':
                 # Real-time group message received
                 print(f"[DEBUG] New group message pushed from server: {message_data}")
+                if not self._mark_delivered("group", message_data.get("message_id")):
+                    return
+                self._advance_cursor("group", message_data.get("message_id"))
                 self.new_group_message_received.emit(message_data)
                 
             elif action == 'messages_read':
@@ -358,6 +551,12 @@ class AsyncPycTalkClient(QObject):
                 print(f"[DEBUG] Messages read notification from server: {message_data}")
                 self.messages_read.emit(message_data)
                 
+            elif action == 'upload_ack':
+                # Server đã ghi chunk upload xuống đĩa
+                on_ack = self._upload_listeners.get(message_data.get('upload_id'))
+                if on_ack:
+                    on_ack(message_data)
+
             elif action == 'user_status_change':
                 # User online/offline status change
                 user_id = message_data.get('user_id')
@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import os
+
+from Request.file_upload import wait_for_connection
+
+
+MEDIA_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pyctalk", "media")
+CHUNK_TIMEOUT = 30.0             # giây chờ chunk kế tiếp trước khi coi như mất kết nối
+MAX_RESUME_ATTEMPTS = 5          # số lần tải tiếp sau khi mất kết nối
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _append(path, data):
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+class MediaDownloader:
+    """
+    Tải file media đã lưu trên server qua socket chat (action download_media): server đẩy các frame
+    nhị phân (download_id, offset, bytes) ngay trên kết nối hiện có, xen giữa các tin nhắn khác.
+    Tải được cả một khoảng byte (preview) và tải tiếp từ file .part sau khi mất kết nối.
+    """
+
+    def __init__(self, client, cache_dir=MEDIA_CACHE_DIR):
+        self.client = client
+        self.cache_dir = cache_dir
+
+    def cached_path(self, server_path):
+        """Đường dẫn cache cục bộ cho một file trên server (có thể chưa tồn tại)"""
+        key = hashlib.sha1(server_path.encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{key}_{os.path.basename(server_path)}")
+
+    async def fetch_range(self, server_path, offset=0, length=None) -> bytes:
+        """Tải một khoảng byte vào bộ nhớ (vd. phần đầu file để preview)"""
+        parts = []
+        await self._stream(server_path, offset, length, lambda data: parts.append(bytes(data)))
+        return b"".join(parts)
+
+    async def fetch(self, server_path, progress=None) -> str:
+        """Tải cả file về cache (nếu chưa có) và trả về đường dẫn cục bộ"""
+        local_path = self.cached_path(server_path)
+        if os.path.exists(local_path):
+            return local_path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        part_path = local_path + ".part"
+        loop = asyncio.get_running_loop()
+
+        attempts = 0
+        while True:
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            try:
+                def on_data(data):
+                    return loop.run_in_executor(None, _append, part_path, bytes(data))
+
+                await self._stream(server_path, offset, None, on_data, progress)
+                break
+            except ConnectionError as e:
+                attempts += 1
+                if attempts > MAX_RESUME_ATTEMPTS:
+                    raise DownloadError(f"Tải {server_path} thất bại sau {attempts} lần thử: {e}")
+                print(f"⚠️ Tải {os.path.basename(server_path)} bị gián đoạn ({e}), chờ kết nối lại...")
+                await wait_for_connection(self.client)
+
+        os.replace(part_path, local_path)
+        return local_path
+
+    async def _stream(self, server_path, offset, length, on_data, progress=None):
+        download_id = os.urandom(16).hex()
+        chunks = asyncio.Queue()
+        # Đăng ký trước khi gửi request: chunk đầu có thể đến ngay sau response
+        self.client._download_listeners[download_id] = lambda chunk_offset, data: chunks.put_nowait((chunk_offset, data))
+        try:
+            response = await self.client.send_json({
+                "action": "download_media",
+                "data": {"file_path": server_path, "download_id": download_id, "offset": offset, "length": length},
+            })
+            if response is None:
+                raise ConnectionError("không có phản hồi download_media")
+            if not response.get("success"):
+                raise DownloadError(response.get("message", "download_media thất bại"))
+
+            position, end = response["offset"], response["offset"] + response["length"]
+            while position < end:
+                try:
+                    chunk_offset, data = await asyncio.wait_for(chunks.get(), timeout=CHUNK_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise ConnectionError("quá thời gian chờ dữ liệu")
+                if chunk_offset is None:
+                    raise ConnectionError("mất kết nối")
+                if chunk_offset != position:
+                    raise DownloadError(f"Chunk sai thứ tự (offset {chunk_offset}, cần {position})")
+                result = on_data(data)
+                if asyncio.isfuture(result) or asyncio.iscoroutine(result):
+                    await result
+                position += len(data)
+                if progress:
+                    progress(position, response["file_size"])
+        finally:
+            self.client._download_listeners.pop(download_id, None)
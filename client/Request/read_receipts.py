@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+
+READ_RECEIPT_INTERVAL = 1.0  # giây: tối đa một receipt mỗi cuộc trò chuyện
+
+
+class ReadReceiptDebouncer:
+    """
+    Gộp các receipt "đã đọc" của một cuộc trò chuyện: gửi ngay nếu đã quá interval
+    kể từ lần gửi trước, ngược lại gửi một lần ở cuối cửa sổ với message_id lớn nhất.
+    send: coroutine function send(last_message_id) (last_message_id có thể là None = tin mới nhất).
+    """
+
+    def __init__(self, send, interval=READ_RECEIPT_INTERVAL):
+        self._send = send
+        self.interval = interval
+        self._last_sent = 0.0
+        self._pending = False
+        self._pending_id = None
+        self._task = None
+
+    def schedule(self, message_id=None):
+        if message_id:
+            self._pending_id = max(self._pending_id or 0, int(message_id))
+        self._pending = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._pending:
+            wait = self._last_sent + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            last_id, self._pending_id = self._pending_id, None
+            self._pending = False
+            self._last_sent = time.monotonic()
+            try:
+                await self._send(last_id)
+            except Exception as e:
+                print(f"[ERROR][ReadReceiptDebouncer] send receipt error: {e}")
@@ -167,8 +167,14 @@ class ChatListItem(QtWidgets.QFrame):
             return ""
         if hasattr(timestamp, 'strftime'):
             return timestamp.strftime("%H:%M")
-        else:
-            return str(timestamp)[:5]
+        text = str(timestamp)
+        if len(text) >= 16 and text[10] in " T":
+            # "YYYY-mm-dd HH:MM:SS" từ server: hôm nay chỉ hiện giờ, ngày khác hiện dd/mm
+            from datetime import date
+            if text[:10] == date.today().isoformat():
+                return text[11:16]
+            return f"{text[8:10]}/{text[5:7]}"
+        return text[:5]
     
     def mousePressEvent(self, event):
         """Handle mouse click event"""
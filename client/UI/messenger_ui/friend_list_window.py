@@ -23,7 +23,10 @@ class FriendListWindow(QtWidgets.QWidget):
         from Add_friend.friend_list_logic import FriendListLogic
         self.logic = FriendListLogic(self.client, self.username, self.current_user_id)
         import asyncio
-        asyncio.create_task(self._load_conversations())
+        asyncio.create_task(self._load_conversations(use_snapshot=True))
+        self._conversations = []
+        if self.client is not None and hasattr(self.client, 'session_resumed'):
+            self.client.session_resumed.connect(self._on_session_resumed)
         
     # Đã bỏ kết nối database, chỉ lấy từ server
     
@@ -122,15 +125,19 @@ class FriendListWindow(QtWidgets.QWidget):
         scroll_area.setWidget(self.friends_container)
         main_layout.addWidget(scroll_area)
     
-    async def _load_conversations(self):
-        """Lấy danh sách bạn bè từ logic, chỉ nhận list dict đã xử lý"""
+    async def _load_conversations(self, use_snapshot=False):
+        """
+        Lấy danh sách bạn bè từ logic, chỉ nhận list dict đã xử lý.
+        use_snapshot: lần tải đầu dùng snapshot "bootstrap" chung thay vì get_friends + get_inbox riêng.
+        """
         print(f"[DEBUG][FriendListWindow] _load_conversations called, self.client={self.client}")
         if self.client is None:
             print("[ERROR][FriendListWindow] Không tìm thấy client để lấy danh sách bạn bè. Hãy truyền client khi khởi tạo FriendListWindow.")
             self._display_conversations([])
             return
         try:
-            conversations = await self.logic.get_conversations()
+            snapshot = await self.client.get_bootstrap() if use_snapshot else None
+            conversations = await self.logic.get_conversations(snapshot)
             print(f"[DEBUG][FriendListWindow] conversations={conversations}")
             self._display_conversations(conversations)
         except Exception as e:
@@ -141,6 +148,7 @@ class FriendListWindow(QtWidgets.QWidget):
     
     def _display_conversations(self, conversations):
         """Display conversations in the list"""
+        self._conversations = conversations
         # Clear existing items
         while self.friends_layout.count() > 1:  # Keep the stretch
             child = self.friends_layout.takeAt(0)
@@ -153,6 +161,24 @@ class FriendListWindow(QtWidgets.QWidget):
             chat_item.clicked.connect(self._on_friend_selected)
             self.friends_layout.insertWidget(self.friends_layout.count() - 1, chat_item)
     
+    def _on_session_resumed(self, changes):
+        """Sau khi nối lại phiên: chỉ cập nhật các cuộc trò chuyện server báo có tin mới"""
+        entries = [entry for entry in changes.get("inbox") or [] if entry.get("type") == "user"]
+        if not entries:
+            return
+        by_id = {str(conv['friend_id']): conv for conv in self._conversations}
+        for entry in entries:
+            conv = by_id.get(str(entry.get("peer_id")))
+            if conv is None:
+                # Bạn mới chưa có trong danh sách -> tải lại danh sách
+                self.refresh_conversations()
+                return
+            conv['last_message'] = entry.get('last_message') or ''
+            conv['last_message_time'] = entry.get('last_message_time') or ''
+            conv['unread_count'] = entry.get('unread_count', 0)
+        self._conversations.sort(key=lambda c: c['last_message_time'], reverse=True)
+        self._display_conversations(self._conversations)
+
     def _on_friend_selected(self, chat_data):
         """Handle friend selection"""
         self.friend_selected.emit(chat_data)
@@ -12,7 +12,10 @@ class GroupListWindow(QtWidgets.QWidget):
         self.client = client
         self._setup_ui()
         import asyncio
-        asyncio.create_task(self._load_groups())
+        asyncio.create_task(self._load_groups(use_snapshot=True))
+        self._groups = []
+        if self.client is not None and hasattr(self.client, 'session_resumed'):
+            self.client.session_resumed.connect(self._on_session_resumed)
 
     def _setup_ui(self):
         layout = QtWidgets.QVBoxLayout(self)
@@ -96,8 +99,11 @@ class GroupListWindow(QtWidgets.QWidget):
         scroll_area.setWidget(self.groups_container)
         main_layout.addWidget(scroll_area)
 
-    async def _load_groups(self):
-        """Lấy danh sách nhóm từ server qua GroupAPIClient"""
+    async def _load_groups(self, use_snapshot=False):
+        """
+        Lấy danh sách nhóm từ server qua GroupAPIClient.
+        use_snapshot: lần tải đầu dùng snapshot "bootstrap" chung thay vì get_user_groups + get_inbox riêng.
+        """
         print(f"[DEBUG][GroupListWindow] _load_groups called, client={self.client}, user_id={self.user_id}")
         if self.client is None or self.user_id is None:
             print(f"[DEBUG][GroupListWindow] Client hoặc user_id là None, hiển thị danh sách trống")
@@ -106,10 +112,28 @@ class GroupListWindow(QtWidgets.QWidget):
         try:
             from Group_chat.group_api_client import GroupAPIClient
             api_client = GroupAPIClient(self.client)
-            print(f"[DEBUG][GroupListWindow] Gọi get_user_groups với user_id={self.user_id}")
-            response = await api_client.get_user_groups(int(self.user_id))
+            snapshot = await self.client.get_bootstrap() if use_snapshot else None
+            if snapshot and snapshot.get("groups") is not None:
+                response = snapshot["groups"]
+            else:
+                print(f"[DEBUG][GroupListWindow] Gọi get_user_groups với user_id={self.user_id}")
+                response = await api_client.get_user_groups(int(self.user_id))
             print(f"[DEBUG][GroupListWindow] Response từ server: {response}")
             groups = response.get("groups", []) if response and response.get("success") else []
+            if snapshot and snapshot.get("inbox") is not None:
+                inbox_response = snapshot["inbox"]
+            else:
+                inbox_response = await api_client.get_inbox()
+            if inbox_response and inbox_response.get("success"):
+                inbox = {str(entry["peer_id"]): entry for entry in inbox_response.get("data") or []
+                         if entry.get("type") == "group"}
+                for group in groups:
+                    entry = inbox.get(str(group.get("group_id")))
+                    if entry:
+                        group["last_message"] = entry.get("last_message") or ""
+                        group["last_message_time"] = entry.get("last_message_time") or ""
+                        group["unread_count"] = entry.get("unread_count", 0)
+                groups.sort(key=lambda g: g.get("last_message_time") or "", reverse=True)
             print(f"[DEBUG][GroupListWindow] Danh sách groups: {groups}")
             # Truyền nguyên group dict vào UI
             self._display_groups(groups)
@@ -121,6 +145,7 @@ class GroupListWindow(QtWidgets.QWidget):
 
     def _display_groups(self, groups):
         print(f"[DEBUG][GroupListWindow] _display_groups được gọi với {len(groups)} groups")
+        self._groups = groups
         while self.groups_layout.count() > 1:
             child = self.groups_layout.takeAt(0)
             if child.widget():
@@ -140,6 +165,24 @@ class GroupListWindow(QtWidgets.QWidget):
             chat_item.clicked.connect(lambda _, g=group: self._on_group_selected(g))
             self.groups_layout.insertWidget(self.groups_layout.count() - 1, chat_item)
 
+    def _on_session_resumed(self, changes):
+        """Sau khi nối lại phiên: chỉ cập nhật các nhóm server báo có tin mới"""
+        entries = [entry for entry in changes.get("inbox") or [] if entry.get("type") == "group"]
+        if not entries:
+            return
+        by_id = {str(group.get("group_id")): group for group in self._groups}
+        for entry in entries:
+            group = by_id.get(str(entry.get("peer_id")))
+            if group is None:
+                # Nhóm mới chưa có trong danh sách -> tải lại danh sách
+                self.refresh_groups()
+                return
+            group["last_message"] = entry.get("last_message") or ""
+            group["last_message_time"] = entry.get("last_message_time") or ""
+            group["unread_count"] = entry.get("unread_count", 0)
+        self._groups.sort(key=lambda g: g.get("last_message_time") or "", reverse=True)
+        self._display_groups(self._groups)
+
     def _on_group_selected(self, chat_data):
         self.group_selected.emit(chat_data)
 
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import os
 from pathlib import Path
@@ -14,7 +15,7 @@ class MediaMessageBubble(QWidget):
     file_clicked = pyqtSignal(str)  # Signal when file is clicked to open/download
     
     def __init__(self, message_data, is_sent=True, timestamp=None, sender_name=None, 
-                 show_sender_name=False, show_timestamp=False, is_read=None, parent=None):
+                 show_sender_name=False, show_timestamp=False, is_read=None, parent=None, downloader=None):
         super().__init__(parent)
         
         # Message data can contain text, media info, etc.
@@ -25,6 +26,7 @@ class MediaMessageBubble(QWidget):
         self.show_sender_name = show_sender_name
         self.show_timestamp = show_timestamp
         self.is_read = is_read
+        self.downloader = downloader  # MediaDownloader: tải ảnh chưa có trên máy từ server
         
         # Extract message info
         self.message_type = message_data.get('message_type', 'text')
@@ -106,54 +108,29 @@ class MediaMessageBubble(QWidget):
         
         # Use thumbnail if available, otherwise original image
         image_path = self.thumbnail_path or self.file_path
+        pending_download = None
+        if image_path and not os.path.exists(image_path) and self.downloader:
+            # Ảnh nằm trên server: dùng bản cache nếu đã tải, chưa có thì tải nền
+            cached = self.downloader.cached_path(image_path)
+            if os.path.exists(cached):
+                image_path = cached
+            else:
+                pending_download = image_path
         
-        if image_path and os.path.exists(image_path):
+        if pending_download:
+            image_label = QLabel("⏳ Đang tải ảnh...")
+            image_label.setObjectName("imageContent")
+            image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            image_label.setMinimumSize(120, 80)
+            image_layout.addWidget(image_label)
+            asyncio.ensure_future(self._download_image(image_label, pending_download))
+        elif image_path and os.path.exists(image_path):
             # Create image label
             image_label = QLabel()
             image_label.setObjectName("imageContent")
             image_label.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
             image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            
-            # Load and scale image
-            pixmap = QPixmap(image_path)
-            if not pixmap.isNull():
-                # Scale image to fit bubble (max 280x180 for better proportion)
-                max_width = 280
-                max_height = 180
-                scaled_pixmap = pixmap.scaled(
-                    max_width, max_height, 
-                    Qt.AspectRatioMode.KeepAspectRatio, 
-                    Qt.TransformationMode.SmoothTransformation
-                )
-                image_label.setPixmap(scaled_pixmap)
-                
-                # Set minimum size to prevent tiny images
-                image_label.setMinimumSize(120, 80)
-                
-                # Add subtle styling for better appearance
-                image_label.setStyleSheet("""
-                    QLabel {
-                        border-radius: 8px;
-                        background-color: transparent;
-                    }
-                """)
-                
-                # Click to view full image
-                image_label.mousePressEvent = lambda e: self.file_clicked.emit(self.file_path)
-            else:
-                image_label.setText("🖼️ Image not available")
-                image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-                image_label.setStyleSheet("""
-                    QLabel {
-                        color: #999;
-                        font-size: 14px;
-                        padding: 20px;
-                        background-color: rgba(248, 249, 250, 0.8);
-                        border-radius: 8px;
-                        border: 1px solid #e9ecef;
-                    }
-                """)
-                
+            self._show_image(image_label, image_path)
             image_layout.addWidget(image_label)
         else:
             # Fallback if image not found
@@ -173,6 +150,59 @@ class MediaMessageBubble(QWidget):
             
         layout.addWidget(image_container)
         
+    def _show_image(self, image_label, image_path):
+        """Load and scale image into label"""
+        image_label.setText("")
+        pixmap = QPixmap(image_path)
+        if not pixmap.isNull():
+            # Scale image to fit bubble (max 280x180 for better proportion)
+            max_width = 280
+            max_height = 180
+            scaled_pixmap = pixmap.scaled(
+                max_width, max_height, 
+                Qt.AspectRatioMode.KeepAspectRatio, 
+                Qt.TransformationMode.SmoothTransformation
+            )
+            image_label.setPixmap(scaled_pixmap)
+            
+            # Set minimum size to prevent tiny images
+            image_label.setMinimumSize(120, 80)
+            
+            # Add subtle styling for better appearance
+            image_label.setStyleSheet("""
+                QLabel {
+                    border-radius: 8px;
+                    background-color: transparent;
+                }
+            """)
+            
+            # Click to view full image
+            image_label.mousePressEvent = lambda e: self.file_clicked.emit(self.file_path)
+        else:
+            image_label.setText("🖼️ Image not available")
+            image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            image_label.setStyleSheet("""
+                QLabel {
+                    color: #999;
+                    font-size: 14px;
+                    padding: 20px;
+                    background-color: rgba(248, 249, 250, 0.8);
+                    border-radius: 8px;
+                    border: 1px solid #e9ecef;
+                }
+            """)
+
+    async def _download_image(self, image_label, server_path):
+        """Tải ảnh (thumbnail nếu có) từ server rồi hiển thị vào label"""
+        try:
+            local_path = await self.downloader.fetch(server_path)
+        except Exception as e:
+            print(f"[ERROR][MediaMessageBubble] Không tải được ảnh {server_path}: {e}")
+            image_label.setText("🖼️ Image not available")
+            return
+        image_label.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
+        self._show_image(image_label, local_path)
+        
     def _add_file_content(self, layout):
         """Add file content to bubble"""
         file_container = QFrame()
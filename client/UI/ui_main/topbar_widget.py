@@ -81,7 +81,7 @@ class TopBarWidget(QtWidgets.QFrame):
         
         # Load avatar if client is available
         if self.client and self.user_id:
-            QtCore.QTimer.singleShot(100, lambda: asyncio.create_task(self._load_avatar()))
+            QtCore.QTimer.singleShot(100, lambda: asyncio.create_task(self._load_avatar(use_snapshot=True)))
         
         # Theme toggle button (giữ lại vì hữu ích)
         self.btnThemeToggle = QtWidgets.QPushButton("🌙")
@@ -95,16 +95,20 @@ class TopBarWidget(QtWidgets.QFrame):
 
     # Các phương thức cập nhật trạng thái, theme, ... có thể bổ sung tại đây
     
-    async def _load_avatar(self):
-        """Load user avatar from server"""
+    async def _load_avatar(self, use_snapshot=False):
+        """Load user avatar from server (lần đầu lấy profile từ snapshot "bootstrap")"""
         try:
             if not self.client or not self.user_id:
                 return
-                
-            response = await self.client.send_json({
-                'action': 'get_user_profile',
-                'data': {'user_id': self.user_id}
-            })
+
+            snapshot = await self.client.get_bootstrap() if use_snapshot else None
+            if snapshot and snapshot.get('profile') is not None:
+                response = snapshot['profile']
+            else:
+                response = await self.client.send_json({
+                    'action': 'get_user_profile',
+                    'data': {'user_id': self.user_id}
+                })
             
             if response and response.get('status') == 'ok':
                 profile_data = response.get('data', {})
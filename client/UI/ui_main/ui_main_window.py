@@ -1145,7 +1145,7 @@ class Ui_MainWindow(QtCore.QObject):
         # Luôn reload lại tin nhắn khi chuyển nhóm
         if hasattr(chat_widget, 'logic'):
             import asyncio
-            asyncio.create_task(chat_widget.logic.load_group_messages(offset=0))
+            asyncio.create_task(chat_widget.logic.load_group_messages())
     
     def _handle_group_action(self, action_data):
         """Handle actions from group chat widget (like user left group)"""
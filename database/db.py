@@ -1,16 +1,89 @@
 # database/db.py
+import os
+import time
 import asyncio
+from collections import namedtuple
+from contextlib import asynccontextmanager
 import aiomysql
 
 
+# Cấu hình pool dùng chung, đọc từ biến môi trường (PYCTALK_DB_*)
+DB_CONFIG = {
+    "host": os.environ.get("PYCTALK_DB_HOST", "localhost"),
+    "user": os.environ.get("PYCTALK_DB_USER", "root"),
+    "password": os.environ.get("PYCTALK_DB_PASSWORD", ""),
+    "database": os.environ.get("PYCTALK_DB_NAME", "pyctalk"),
+    "minsize": int(os.environ.get("PYCTALK_DB_POOL_MIN", 2)),
+    "maxsize": int(os.environ.get("PYCTALK_DB_POOL_MAX", 20)),
+    "pool_recycle": int(os.environ.get("PYCTALK_DB_POOL_RECYCLE", 3600)),        # giây, -1 = không recycle
+    "acquire_timeout": float(os.environ.get("PYCTALK_DB_ACQUIRE_TIMEOUT", 5.0)),  # giây chờ lấy kết nối
+}
+
+# Kết quả của execute: số dòng bị ảnh hưởng + id AUTO_INCREMENT của INSERT (cùng kết nối)
+ExecuteResult = namedtuple("ExecuteResult", ["rowcount", "lastrowid"])
+
+# Mốc histogram thời gian chờ lấy kết nối (ms)
+ACQUIRE_WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+
+class Transaction:
+    """
+    Các lệnh chạy trên một kết nối đã ghim, trong một transaction.
+    Dùng qua `async with db.transaction() as tx:` - commit khi thoát bình thường, rollback khi có lỗi.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def execute(self, query, params=()) -> ExecuteResult:
+        async with self.conn.cursor() as cursor:
+            await cursor.execute(query, params)
+            return ExecuteResult(cursor.rowcount, cursor.lastrowid)
+
+    async def executemany(self, query, seq_of_params) -> ExecuteResult:
+        """Gộp nhiều dòng INSERT thành một lệnh (aiomysql ghép VALUES thành multi-row)"""
+        seq_of_params = list(seq_of_params)
+        if not seq_of_params:
+            return ExecuteResult(0, None)
+        async with self.conn.cursor() as cursor:
+            await cursor.executemany(query, seq_of_params)
+            return ExecuteResult(cursor.rowcount, cursor.lastrowid)
+
+    async def insert_returning(self, query, params=()) -> int:
+        result = await self.execute(query, params)
+        return result.lastrowid
+
+    async def fetch_one(self, query, params=()):
+        async with self.conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchone()
+
+    async def fetch_all(self, query, params=()):
+        async with self.conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+
+
 class AsyncMySQLDatabase:
-    def __init__(self, host="localhost", user="root", password="", database="pyctalk"):
-        self.host = host
-        self.user = user
-        self.password = password
-        self.database = database
+    def __init__(self, host=None, user=None, password=None, database=None,
+                 minsize=None, maxsize=None, pool_recycle=None, acquire_timeout=None):
+        self.host = host or DB_CONFIG["host"]
+        self.user = user or DB_CONFIG["user"]
+        self.password = password if password is not None else DB_CONFIG["password"]
+        self.database = database or DB_CONFIG["database"]
+        self.minsize = minsize or DB_CONFIG["minsize"]
+        self.maxsize = maxsize or DB_CONFIG["maxsize"]
+        self.pool_recycle = pool_recycle or DB_CONFIG["pool_recycle"]
+        self.acquire_timeout = acquire_timeout or DB_CONFIG["acquire_timeout"]
         self.pool = None
 
+        # Thống kê lấy kết nối
+        self.waiters = 0
+        self.acquire_count = 0
+        self.acquire_timeouts = 0
+        self.max_wait_ms = 0.0
+        self.wait_buckets = [0] * (len(ACQUIRE_WAIT_BUCKETS_MS) + 1)  # ô cuối: > mốc lớn nhất
+
     async def connect(self):
         """Kết nối tới MySQL server với connection pool."""
         if self.pool is not None:
@@ -24,11 +97,12 @@ class AsyncMySQLDatabase:
                 autocommit=True,     # tự động commit
                 charset="utf8mb4",
                 use_unicode=True,
-                minsize=1,           # số kết nối tối thiểu
-                maxsize=10,          # số kết nối tối đa
-                connect_timeout=10   # timeout kết nối
+                minsize=self.minsize,            # số kết nối tối thiểu
+                maxsize=self.maxsize,            # số kết nối tối đa
+                pool_recycle=self.pool_recycle,  # đóng kết nối cũ hơn N giây
+                connect_timeout=10               # timeout kết nối
             )
-            print("✅ Đã kết nối MySQL Database (async) thành công.")
+            print(f"✅ Đã kết nối MySQL Database (async) thành công. Pool {self.minsize}-{self.maxsize}")
         except Exception as e:
             print(f"❌ Lỗi khi kết nối MySQL (async): {e}")
             self.pool = None
@@ -38,45 +112,115 @@ class AsyncMySQLDatabase:
         if self.pool:
             self.pool.close()
             await self.pool.wait_closed()
+            self.pool = None
             print("🔌 Đã ngắt kết nối MySQL Database (async).")
 
-    async def execute(self, query, params=()):
-        """Dùng cho INSERT, UPDATE, DELETE."""
+    @asynccontextmanager
+    async def acquire(self):
+        """Lấy kết nối từ pool (có timeout) và ghi nhận thời gian chờ."""
+        if self.pool is None:
+            await self.connect()
+        if self.pool is None:
+            raise ConnectionError("MySQL pool chưa sẵn sàng")
+
+        started = time.perf_counter()
+        self.waiters += 1
+        try:
+            conn = await asyncio.wait_for(self.pool.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.acquire_timeouts += 1
+            raise TimeoutError(f"Hết {self.acquire_timeout}s chờ kết nối MySQL (pool đầy)")
+        finally:
+            self.waiters -= 1
+        self._record_wait((time.perf_counter() - started) * 1000)
+
+        try:
+            yield conn
+        finally:
+            self.pool.release(conn)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Ghim một kết nối, BEGIN ... COMMIT (ROLLBACK nếu có exception)."""
+        async with self.acquire() as conn:
+            await conn.begin()
+            try:
+                yield Transaction(conn)
+            except BaseException:
+                await conn.rollback()
+                raise
+            else:
+                await conn.commit()
+
+    def _record_wait(self, wait_ms):
+        self.acquire_count += 1
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        for index, bound in enumerate(ACQUIRE_WAIT_BUCKETS_MS):
+            if wait_ms <= bound:
+                self.wait_buckets[index] += 1
+                return
+        self.wait_buckets[-1] += 1
+
+    def get_stats(self) -> dict:
+        """in-use / idle / waiters + histogram thời gian chờ lấy kết nối"""
+        size = self.pool.size if self.pool else 0
+        idle = self.pool.freesize if self.pool else 0
+        labels = [f"<={bound}ms" for bound in ACQUIRE_WAIT_BUCKETS_MS] + [f">{ACQUIRE_WAIT_BUCKETS_MS[-1]}ms"]
+        return {
+            "minsize": self.minsize,
+            "maxsize": self.maxsize,
+            "size": size,
+            "in_use": size - idle,
+            "idle": idle,
+            "waiters": self.waiters,
+            "acquired": self.acquire_count,
+            "acquire_timeouts": self.acquire_timeouts,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+            "wait_histogram": dict(zip(labels, self.wait_buckets)),
+        }
+
+    async def execute(self, query, params=()) -> ExecuteResult:
+        """Dùng cho INSERT, UPDATE, DELETE. Trả về ExecuteResult(rowcount, lastrowid)."""
         try:
-            if self.pool is None:
-                await self.connect()
-            async with self.pool.acquire() as conn:
+            async with self.acquire() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute(query, params)
+                    return ExecuteResult(cursor.rowcount, cursor.lastrowid)
         except Exception as e:
             print(f"❌ Lỗi SQL Execute (async): {e}")
             raise  # Báo lỗi lên trên để messenger_db.py nhận biết
-    async def fetch_one(self, query, params=()):
-        """Dùng cho SELECT 1 dòng."""
+
+    async def insert_returning(self, query, params=()) -> int:
+        """INSERT và trả về id vừa tạo (lastrowid lấy trên chính kết nối đã INSERT)."""
+        result = await self.execute(query, params)
+        return result.lastrowid
+
+    async def fetch_one(self, query, params=(), raise_errors=False):
+        """Dùng cho SELECT 1 dòng. raise_errors=True: báo lỗi lên thay vì trả None (vd. trước khi cache)."""
         try:
-            if self.pool is None:
-                await self.connect()
-            async with self.pool.acquire() as conn:
+            async with self.acquire() as conn:
                 async with conn.cursor(aiomysql.DictCursor) as cursor:
                     await cursor.execute(query, params)
                     return await cursor.fetchone()
         except Exception as e:
             print(f"❌ Lỗi SQL Fetch One (async): {e}")
+            if raise_errors:
+                raise
             return None
 
-    async def fetch_all(self, query, params=()):
-        """Dùng cho SELECT nhiều dòng."""
+    async def fetch_all(self, query, params=(), raise_errors=False):
+        """Dùng cho SELECT nhiều dòng. raise_errors=True: báo lỗi lên thay vì trả [] (vd. trước khi cache)."""
         try:
-            if self.pool is None:
-                await self.connect()
-            async with self.pool.acquire() as conn:
+            async with self.acquire() as conn:
                 async with conn.cursor(aiomysql.DictCursor) as cursor:
                     await cursor.execute(query, params)
                     return await cursor.fetchall()
         except Exception as e:
             print(f"❌ Lỗi SQL Fetch All (async): {e}")
+            if raise_errors:
+                raise
             return []
 
 
-# Khởi tạo thể hiện duy nhất
+# Khởi tạo thể hiện duy nhất - pool dùng chung cho mọi handler, tạo khi server start
 db = AsyncMySQLDatabase()
@@ -0,0 +1,339 @@
+# database/migrations.py
+"""
+Migration có version cho schema PycTalk.
+
+Mỗi migration chạy đúng một lần, theo thứ tự version, và được ghi vào bảng
+schema_migrations. Backfill dữ liệu chạy theo từng khoảng khóa chính nhỏ
+để không khóa bảng lớn trong thời gian dài.
+"""
+import asyncio
+
+
+MIGRATIONS = []               # [(version, name, coroutine_function)]
+BACKFILL_CHUNK_SIZE = 5000    # số dòng mỗi lần UPDATE khi backfill
+BACKFILL_PAUSE = 0.05         # giây nghỉ giữa các chunk, nhường I/O cho server
+
+
+def migration(version: int, name: str):
+    """Đăng ký một migration. Version phải tăng dần và không trùng."""
+    def decorator(func):
+        if any(existing == version for existing, _, _ in MIGRATIONS):
+            raise ValueError(f"Migration version {version} bị trùng")
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+
+# ---------------------------
+# Helpers cho migration
+# ---------------------------
+async def column_exists(db, table: str, column: str) -> bool:
+    row = await db.fetch_one(
+        """SELECT COUNT(*) AS total FROM INFORMATION_SCHEMA.COLUMNS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s""",
+        (table, column)
+    )
+    return bool(row and row["total"])
+
+
+async def index_exists(db, table: str, index: str) -> bool:
+    row = await db.fetch_one(
+        """SELECT COUNT(*) AS total FROM INFORMATION_SCHEMA.STATISTICS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s""",
+        (table, index)
+    )
+    return bool(row and row["total"])
+
+
+async def add_column(db, table: str, column: str, definition: str):
+    if await column_exists(db, table, column):
+        print(f"⏭️  Column {table}.{column} already exists")
+        return
+    # Cột nullable thêm online (INPLACE, không khóa ghi)
+    await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}, ALGORITHM=INPLACE, LOCK=NONE")
+    print(f"✅ Added column: {table}.{column}")
+
+
+async def add_index(db, table: str, index: str, columns: str):
+    if await index_exists(db, table, index):
+        print(f"⏭️  Index {table}.{index} already exists")
+        return
+    await db.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns}), ALGORITHM=INPLACE, LOCK=NONE")
+    print(f"✅ Added index: {table}.{index} ({columns})")
+
+
+async def backfill_in_chunks(db, table: str, pk: str, set_sql: str, where_sql: str,
+                             chunk_size: int = None):
+    """
+    UPDATE table SET set_sql theo từng khoảng pk (pk > start AND pk <= start + chunk_size).
+    Mỗi chunk là một câu lệnh autocommit ngắn nên chỉ khóa vài nghìn dòng mỗi lần.
+    where_sql chọn các dòng còn cần backfill (vd. "col IS NULL") và phải sai sau khi set_sql chạy:
+    hết một lượt thì tìm lại khoảng pk còn khớp (dòng server cũ ghi trong lúc backfill, hoặc commit
+    muộn với pk nhỏ hơn) và lặp tới khi không còn dòng nào.
+    """
+    chunk_size = chunk_size or BACKFILL_CHUNK_SIZE
+    chunks = rounds = 0
+    while True:
+        bounds = await db.fetch_one(
+            f"SELECT MIN({pk}) AS low, MAX({pk}) AS high FROM {table} WHERE {where_sql}",
+            raise_errors=True
+        )
+        if not bounds or bounds["low"] is None:
+            break
+        rounds += 1
+        start, high = bounds["low"] - 1, bounds["high"]
+        while start < high:
+            end = start + chunk_size
+            await db.execute(
+                f"UPDATE {table} SET {set_sql} WHERE {pk} > %s AND {pk} <= %s AND ({where_sql})",
+                (start, end)
+            )
+            start = end
+            chunks += 1
+            if chunks % 20 == 0:
+                print(f"   ... backfill {table}: {pk} <= {min(end, high)} / {high}")
+            await asyncio.sleep(BACKFILL_PAUSE)
+    if not rounds:
+        print(f"⏭️  {table}: không còn dòng cần backfill")
+        return
+    print(f"✅ Backfilled {table} ({chunks} chunks, {rounds} lượt)")
+
+
+# ---------------------------
+# Runner
+# ---------------------------
+async def ensure_migrations_table(db):
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS schema_migrations (
+               version INT NOT NULL PRIMARY KEY,
+               name VARCHAR(255) NOT NULL,
+               applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+    )
+
+
+async def applied_versions(db) -> set:
+    rows = await db.fetch_all("SELECT version FROM schema_migrations")
+    return {row["version"] for row in rows}
+
+
+async def pending_migrations(db) -> list:
+    await ensure_migrations_table(db)
+    done = await applied_versions(db)
+    return [(version, name, func) for version, name, func in MIGRATIONS if version not in done]
+
+
+async def run_migrations(db, target: int = None, dry_run: bool = False) -> list:
+    """Áp dụng các migration chưa chạy theo thứ tự (tới version target nếu có)"""
+    applied = []
+    for version, name, func in await pending_migrations(db):
+        if target is not None and version > target:
+            break
+        print(f"\n▶️  Migration {version:04d}: {name}")
+        if dry_run:
+            applied.append(version)
+            continue
+        await func(db)
+        await db.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+            (version, name)
+        )
+        applied.append(version)
+        print(f"✅ Migration {version:04d} done")
+    return applied
+
+
+# ---------------------------
+# Các migration (thêm mới ở cuối, không sửa migration đã phát hành)
+# ---------------------------
+MEDIA_COLUMNS = [
+    ("message_type", "ENUM('text', 'image', 'file', 'audio', 'video') DEFAULT 'text'"),
+    ("file_path", "VARCHAR(500) NULL"),
+    ("file_name", "VARCHAR(255) NULL"),
+    ("file_size", "BIGINT NULL"),
+    ("mime_type", "VARCHAR(100) NULL"),
+    ("thumbnail_path", "VARCHAR(500) NULL"),
+]
+
+
+@migration(1, "media columns for private_messages and group_messages")
+async def media_columns(db):
+    for table in ("private_messages", "group_messages"):
+        for column_name, column_def in MEDIA_COLUMNS:
+            await add_column(db, table, column_name, column_def)
+
+
+@migration(2, "conversation key (user_low, user_high) on private_messages")
+async def private_conversation_key(db):
+    await add_column(db, "private_messages", "user_low", "INT(11) NULL")
+    await add_column(db, "private_messages", "user_high", "INT(11) NULL")
+    await backfill_in_chunks(
+        db, "private_messages", "message_private_id",
+        "user_low = LEAST(sender_id, receiver_id), user_high = GREATEST(sender_id, receiver_id)",
+        where_sql="user_low IS NULL",
+    )
+    await add_index(db, "private_messages", "idx_conversation_time",
+                    "user_low, user_high, time_send, message_private_id")
+
+
+@migration(3, "group_messages (group_id, time_send, message_group_id) index")
+async def group_messages_time_index(db):
+    await add_index(db, "group_messages", "idx_group_time",
+                    "group_id, time_send, message_group_id")
+
+
+@migration(4, "unread_counters table (per user/peer unread badge)")
+async def unread_counters_table(db):
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS unread_counters (
+               user_id INT(11) NOT NULL,
+               peer_type ENUM('user', 'group') NOT NULL,
+               peer_id INT(11) NOT NULL,
+               unread INT NOT NULL DEFAULT 0,
+               PRIMARY KEY (user_id, peer_type, peer_id)
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+    )
+    # Khởi tạo bộ đếm 1-1 từ các tin is_read = FALSE hiện có
+    await db.execute(
+        """INSERT INTO unread_counters (user_id, peer_type, peer_id, unread)
+           SELECT receiver_id, 'user', sender_id, COUNT(*) FROM private_messages
+           WHERE is_read = FALSE GROUP BY receiver_id, sender_id
+           ON DUPLICATE KEY UPDATE unread = VALUES(unread)"""
+    )
+    print("✅ unread_counters ready")
+
+
+@migration(5, "read_watermarks table (per reader/peer last read message)")
+async def read_watermarks_table(db):
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS read_watermarks (
+               reader_id INT(11) NOT NULL,
+               peer_id INT(11) NOT NULL,
+               last_read_message_id BIGINT NOT NULL DEFAULT 0,
+               read_at DATETIME NULL,
+               PRIMARY KEY (reader_id, peer_id)
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+    )
+    # Khởi tạo watermark từ các tin đã được đánh dấu is_read theo kiểu cũ
+    await db.execute(
+        """INSERT INTO read_watermarks (reader_id, peer_id, last_read_message_id, read_at)
+           SELECT receiver_id, sender_id, MAX(message_private_id), MAX(read_at) FROM private_messages
+           WHERE is_read = TRUE GROUP BY receiver_id, sender_id
+           ON DUPLICATE KEY UPDATE last_read_message_id = GREATEST(last_read_message_id, VALUES(last_read_message_id))"""
+    )
+    print("✅ read_watermarks ready")
+
+
+@migration(6, "conversation_summaries table (inbox: last message per user/conversation)")
+async def conversation_summaries_table(db):
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS conversation_summaries (
+               user_id INT(11) NOT NULL,
+               peer_type ENUM('user', 'group') NOT NULL,
+               peer_id INT(11) NOT NULL,
+               last_message_id BIGINT NULL,
+               last_sender_id INT(11) NULL,
+               last_preview VARCHAR(255) NULL,
+               last_message_type VARCHAR(20) NULL,
+               last_time DATETIME NOT NULL,
+               PRIMARY KEY (user_id, peer_type, peer_id),
+               KEY idx_user_recent (user_id, last_time)
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+    )
+    # Khởi tạo từ tin cuối cùng (id lớn nhất) của mỗi cuộc trò chuyện hiện có
+    for viewer, peer in (("sender_id", "receiver_id"), ("receiver_id", "sender_id")):
+        await db.execute(
+            f"""INSERT IGNORE INTO conversation_summaries
+                   (user_id, peer_type, peer_id, last_message_id, last_sender_id, last_preview, last_message_type, last_time)
+                SELECT pm.{viewer}, 'user', pm.{peer}, pm.message_private_id, pm.sender_id,
+                       LEFT(COALESCE(NULLIF(pm.content, ''), pm.file_name, ''), 100), pm.message_type, pm.time_send
+                FROM private_messages pm
+                JOIN (SELECT MAX(message_private_id) AS id FROM private_messages GROUP BY user_low, user_high) latest
+                  ON pm.message_private_id = latest.id"""
+        )
+    await db.execute(
+        """INSERT IGNORE INTO conversation_summaries
+               (user_id, peer_type, peer_id, last_message_id, last_sender_id, last_preview, last_message_type, last_time)
+           SELECT gmb.user_id, 'group', gm.group_id, gm.message_group_id, gm.sender_id,
+                  LEFT(COALESCE(gm.content, ''), 100), gm.message_type, gm.time_send
+           FROM group_messages gm
+           JOIN (SELECT MAX(message_group_id) AS id FROM group_messages GROUP BY group_id) latest
+             ON gm.message_group_id = latest.id
+           JOIN group_members gmb ON gmb.group_id = gm.group_id"""
+    )
+    print("✅ conversation_summaries ready")
+
+
+@migration(7, "private_messages (receiver_id / sender_id, message_private_id) indexes for delta sync")
+async def private_sync_indexes(db):
+    await add_index(db, "private_messages", "idx_receiver_id", "receiver_id, message_private_id")
+    await add_index(db, "private_messages", "idx_sender_id", "sender_id, message_private_id")
+
+
+@migration(8, "media table (content-addressed uploads by sha256, reference counted)")
+async def media_table(db):
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS media (
+               sha256 CHAR(64) NOT NULL PRIMARY KEY,
+               file_size BIGINT NOT NULL,
+               file_path VARCHAR(500) NOT NULL,
+               thumbnail_path VARCHAR(500) NULL,
+               ref_count INT NOT NULL DEFAULT 0,
+               created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+    )
+    print("✅ media ready")
+
+
+@migration(9, "media_grants table + file path indexes (media access checks)")
+async def media_access(db):
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS media_grants (
+               sha256 CHAR(64) NOT NULL,
+               user_id INT(11) NOT NULL,
+               created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (sha256, user_id)
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+    )
+    # Tra file -> tin nhắn / dòng media khi kiểm tra quyền tải
+    for table in ("private_messages", "group_messages", "media"):
+        await add_index(db, table, "idx_file_path", "file_path(191)")
+        await add_index(db, table, "idx_thumbnail_path", "thumbnail_path(191)")
+    # Người đã upload nội dung trước migration này (theo các tin đã gửi)
+    await db.execute(
+        """INSERT IGNORE INTO media_grants (sha256, user_id)
+           SELECT m.sha256, pm.sender_id FROM media m JOIN private_messages pm ON pm.file_path = m.file_path"""
+    )
+    print("✅ media_grants ready")
+
+
+@migration(10, "media.ref_count counts messages referencing the file")
+async def media_message_refcount(db):
+    # Trước đây ref_count đếm số lần upload; giờ là số tin nhắn đính kèm (0 = có thể dọn)
+    await db.execute(
+        """UPDATE media m SET ref_count =
+               (SELECT COUNT(*) FROM private_messages pm WHERE pm.file_path = m.file_path)
+             + (SELECT COUNT(*) FROM group_messages gm WHERE gm.file_path = m.file_path)"""
+    )
+    await add_index(db, "media", "idx_unreferenced", "ref_count, created_at")
+
+
+@migration(11, "fill private_messages (user_low, user_high) on insert")
+async def private_conversation_key_trigger(db):
+    # Server bản cũ (chưa ghi user_low/user_high) còn chạy trong lúc chuyển đổi: tin của nó vẫn có khóa,
+    # không biến mất khỏi lịch sử (truy vấn lọc theo hai cột này)
+    await db.execute("DROP TRIGGER IF EXISTS trg_private_messages_conversation_key")
+    await db.execute(
+        """CREATE TRIGGER trg_private_messages_conversation_key BEFORE INSERT ON private_messages
+           FOR EACH ROW SET
+               NEW.user_low = COALESCE(NEW.user_low, LEAST(NEW.sender_id, NEW.receiver_id)),
+               NEW.user_high = COALESCE(NEW.user_high, GREATEST(NEW.sender_id, NEW.receiver_id))"""
+    )
+    # Lượt cuối sau khi có trigger: dòng ghi sau migration 2 và trước trigger
+    await backfill_in_chunks(
+        db, "private_messages", "message_private_id",
+        "user_low = LEAST(sender_id, receiver_id), user_high = GREATEST(sender_id, receiver_id)",
+        where_sql="user_low IS NULL OR user_high IS NULL",
+    )
+    print("✅ private_messages conversation key trigger ready")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Script to apply versioned database migrations (see database/migrations.py)
+
+    python scripts/migrate_database.py            # áp dụng mọi migration chưa chạy
+    python scripts/migrate_database.py --status   # xem migration nào đã/chưa chạy
+    python scripts/migrate_database.py --to 2     # chỉ chạy tới version 2
+"""
+
+import argparse
+import asyncio
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+async def migrate_database(args):
+    """Apply pending migrations in order"""
+    from database.db import db
+    from database import migrations
+
+    try:
+        if args.chunk_size:
+            migrations.BACKFILL_CHUNK_SIZE = args.chunk_size
+
+        await migrations.ensure_migrations_table(db)
+        done = await migrations.applied_versions(db)
+
+        if args.status:
+            for version, name, _ in migrations.MIGRATIONS:
+                mark = "✅" if version in done else "⏳"
+                print(f"{mark} {version:04d} {name}")
+            return
+
+        applied = await migrations.run_migrations(db, target=args.to, dry_run=args.dry_run)
+        if not applied:
+            print("⏭️  Database schema is up to date")
+        elif args.dry_run:
+            print(f"\nWould apply: {applied}")
+        else:
+            print(f"\n🎉 Applied migrations: {applied}")
+
+    except Exception as e:
+        print(f"❌ Error migrating database: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        await db.disconnect()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PycTalk database migrations")
+    parser.add_argument("--status", action="store_true", help="list applied/pending migrations")
+    parser.add_argument("--to", type=int, default=None, help="apply up to this version")
+    parser.add_argument("--dry-run", action="store_true", help="show pending migrations without applying")
+    parser.add_argument("--chunk-size", type=int, default=None, help="rows per backfill UPDATE")
+    asyncio.run(migrate_database(parser.parse_args()))
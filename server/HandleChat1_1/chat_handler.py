@@ -1,29 +1,104 @@
 # server/chat_1v1_handler.py
-import json
-import asyncio
 from datetime import datetime
+from outbound_queue import encode_frame
+from session_registry import registry
+from pagination import clamp_limit, keyset_clause, keyset_page
+from write_behind import WriteBehindInserter
+from hot_tail import HotTailCache, CachedMessage
+from unread_counters import unread_counters, PEER_USER
+from read_watermarks import read_watermarks
+from conversation_summaries import conversation_summaries, make_preview
+from media_store import media_store
+
+
+PRIVATE_MESSAGE_INSERT = (
+    "INSERT INTO private_messages "
+    "(sender_id, receiver_id, user_low, user_high, content, time_send, is_read, "
+    "message_type, file_path, file_name, file_size, mime_type, thumbnail_path) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+)
+
+
+async def write_conversation_state(tx, rows, ids):
+    """
+    +1 badge người nhận và tin cuối trong inbox của cả hai bên cho các tin vừa INSERT (rows là params
+    của PRIVATE_MESSAGE_INSERT), trong cùng transaction: badge/inbox không lệch với bảng tin nhắn.
+    """
+    increments, summaries = [], []
+    for params, message_id in zip(rows, ids):
+        sender, recipient, content, time_send, message_type, file_name = (
+            params[0], params[1], params[4], params[5], params[7], params[9]
+        )
+        increments.append((int(recipient), PEER_USER, int(sender)))
+        summaries.extend(conversation_summaries.private_rows(
+            sender, recipient, message_id, make_preview(content, message_type, file_name), message_type, time_send
+        ))
+    await unread_counters.write_increments(tx, increments)
+    await conversation_summaries.write(tx, summaries)
+
+
+def conversation_key(user_a, user_b) -> tuple:
+    """(user_low, user_high) - khóa chuẩn hóa của cuộc trò chuyện 1-1"""
+    user_a, user_b = int(user_a), int(user_b)
+    return (min(user_a, user_b), max(user_a, user_b))
 
 
 class Chat1v1Handler:
     def __init__(self):
         self.active_chats = {}       # {user1_user2: [client1, client2]}
-        self.user_connections = {}   # {username: (reader, writer)}
-        self.message_history = {}    # {chat_id: [messages]}
-
-    async def handle_message_request(self, reader, writer, data: dict):
-        """Handle different types of message requests"""
-        action = data.get("action")
-
-        if action == "send_message":
-            return await self.handle_send_message(writer, data.get("data", {}))
-        elif action == "send_file_message":
-            return await self.handle_send_file_message(writer, data.get("data", {}))
-        elif action == "get_chat_history":
-            return await self.handle_get_history(writer, data.get("data", {}))
-        elif action == "mark_as_read":
-            return await self.handle_mark_read(writer, data.get("data", {}))
+        self.hot_tail = HotTailCache()   # N tin cuối mỗi cuộc trò chuyện (trang lịch sử đầu tiên)
+        self.write_behind = None     # WriteBehindInserter khi bật chế độ group-commit
+
+    # ---------------------------
+    # Ghi tin nhắn vào DB
+    # ---------------------------
+    def enable_write_behind(self, **options):
+        """Bật write-behind: INSERT của các request đồng thời gộp thành multi-row INSERT, ack sau khi batch commit"""
+        if self.write_behind is None:
+            self.write_behind = WriteBehindInserter(PRIVATE_MESSAGE_INSERT, name="private_messages",
+                                                    after_insert=write_conversation_state, **options)
+            self.write_behind.start()
+            print("✍️ Write-behind cho private_messages đã bật")
+
+    async def close_write_behind(self):
+        if self.write_behind is not None:
+            await self.write_behind.close()
+
+    def get_write_stats(self):
+        return self.write_behind.get_stats() if self.write_behind else {"mode": "direct"}
+
+    def get_hot_tail_stats(self):
+        return self.hot_tail.get_stats()
+
+    async def _insert_private_message(self, sender, recipient, content, time_send, message_type="text",
+                                      file_path=None, file_name=None, file_size=None, mime_type=None,
+                                      thumbnail_path=None):
+        """
+        Ghi một tin nhắn (time_send: datetime, không có microsecond) và trả về id đã commit
+        (kể cả ở chế độ write-behind: chờ batch chứa tin này flush xong). Badge/inbox ghi trong cùng
+        transaction; tin vào hot-tail và bộ đếm RAM sau khi commit.
+        """
+        key = conversation_key(sender, recipient)
+        params = (sender, recipient, *key, content, time_send, False,
+                  message_type, file_path, file_name, file_size, mime_type, thumbnail_path)
+
+        if self.write_behind is not None:
+            # Queue đầy -> chờ (backpressure); id có khi batch commit. Sender ack, push, sync và
+            # lịch sử đều cần id thật nên không ack trước khi tin nằm trong DB.
+            message_id = await (await self.write_behind.submit(params))
+            if message_id is None:
+                raise RuntimeError("write-behind flush thất bại")
         else:
-            return {"success": False, "message": "Unknown action"}
+            from database.db import db
+            async with db.transaction() as tx:
+                message_id = await tx.insert_returning(PRIVATE_MESSAGE_INSERT, params)
+                await write_conversation_state(tx, [params], [message_id])
+        unread_counters.apply_increments([(int(recipient), PEER_USER, int(sender))])
+        self.hot_tail.append(key, CachedMessage(
+            message_id, sender, recipient, content, time_send,
+            message_type, file_path, file_name, file_size, mime_type, thumbnail_path
+        ))
+        return message_id
 
     async def handle_send_message(self, writer, message_data: dict):
         """Handle sending a message from one user to another, lưu vào database"""
@@ -36,14 +111,20 @@ class Chat1v1Handler:
             if not all([sender, recipient, message_text]):
                 return {"success": False, "message": "Missing required fields"}
 
-            # Create chat ID
-            chat_id = "_".join(sorted([sender, recipient]))
+            # Lưu vào database: một câu INSERT (hoặc batch write-behind), id lấy từ lastrowid
+            # (FK của private_messages đảm bảo sender/recipient tồn tại)
+            now_dt = datetime.now().replace(microsecond=0)
+            timestamp_str = now_dt.strftime('%Y-%m-%d %H:%M:%S')
+            try:
+                message_id = await self._insert_private_message(sender, recipient, message_text, now_dt)
+            except Exception as db_exc:
+                print(f"❌ Lỗi lưu tin nhắn vào DB: {db_exc}")
+                return {"success": False, "message": "Không lưu được tin nhắn"}
 
             # Message object
-            now_dt = datetime.now()
-            timestamp_str = now_dt.strftime('%Y-%m-%d %H:%M:%S')
             message_obj = {
-                "id": f"{chat_id}_{int(asyncio.get_event_loop().time() * 1000)}",
+                "id": message_id,
+                "message_id": message_id,
                 "from": sender,
                 "to": recipient,
                 "message": message_text,
@@ -52,48 +133,12 @@ class Chat1v1Handler:
                 "read": False,
             }
 
-            # Save to history (RAM)
-            self.message_history.setdefault(chat_id, []).append(message_obj)
-
-            # Lưu vào database
-            try:
-                from database.db import db
-                # Lấy user_id từ id (client gửi 'from' và 'to' là id)
-                sender_row = await db.fetch_one("SELECT id FROM users WHERE id = %s", (sender,))
-                recipient_row = await db.fetch_one("SELECT id FROM users WHERE id = %s", (recipient,))
-                print(f"[DB] sender_row: {sender_row}, recipient_row: {recipient_row}")
-                if sender_row and recipient_row:
-                    print(f"[DB] Lưu tin nhắn: sender_id={sender_row['id']}, receiver_id={recipient_row['id']}, content={message_text}, time_send={timestamp_str}")
-                    # Insert with message status (unread by default)
-                    await db.execute(
-                        "INSERT INTO private_messages (sender_id, receiver_id, content, time_send, is_read) VALUES (%s, %s, %s, %s, %s)",
-                        (sender_row["id"], recipient_row["id"], message_text, timestamp_str, False)
-                    )
-                    print(f"[DB] Đã lưu tin nhắn vào DB với trạng thái chưa đọc.")
-                else:
-                    print(f"[DB] Không tìm thấy user_id cho sender hoặc recipient.")
-            except Exception as db_exc:
-                print(f"❌ Lỗi lưu tin nhắn vào DB: {db_exc}")
-
-            # Send push message to recipient if online (not sender to avoid duplicate)
-            recipient_conn = self.user_connections.get(recipient)
-            if recipient_conn:
-                _, recipient_writer = recipient_conn
-                try:
-                    push_message = {
-                        "action": "new_message", 
-                        "data": message_obj,
-                    }
-                    # Gửi với length prefix như client expect
-                    message_json = json.dumps(push_message)
-                    message_bytes = message_json.encode('utf-8')
-                    length_prefix = len(message_bytes).to_bytes(4, 'big')
-                    
-                    recipient_writer.write(length_prefix + message_bytes)
-                    await recipient_writer.drain()
-                    print(f"[DEBUG] Pushed message to recipient {recipient}")
-                except Exception as e:
-                    print(f"⚠️ Failed to send message to {recipient}: {e}")
+            # Send push message to every device of recipient (not sender to avoid duplicate)
+            push_message = {
+                "action": "new_message",
+                "data": message_obj,
+            }
+            self._push_to_user(recipient, push_message)
 
             return {
                 "success": True,
@@ -120,14 +165,35 @@ class Chat1v1Handler:
             if not all([sender, recipient, file_path, file_name]):
                 return {"success": False, "message": "Missing required file message parameters"}
 
+            # Chỉ đính kèm file người gửi đã upload hoặc đã nhận được: đường dẫn do client gửi lên
+            for path in filter(None, (file_path, thumbnail_path)):
+                if not await media_store.can_access(sender, path):
+                    return {"success": False, "message": "Không có quyền gửi file này"}
+
             print(f"[DEBUG][Chat1v1Handler] Handling file message: {message_type} from {sender} to {recipient}")
 
             # Create message object with timestamp
-            timestamp = datetime.now()
+            timestamp = datetime.now().replace(microsecond=0)
             timestamp_str = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+
+            # Save to database with media fields: một câu INSERT (hoặc queue write-behind)
+            try:
+                print(f"[DB] Saving file message: sender_id={sender}, receiver_id={recipient}, type={message_type}")
+                message_id = await self._insert_private_message(
+                    sender, recipient, content, timestamp, message_type,
+                    file_path, file_name, file_size, mime_type, thumbnail_path
+                )
+            except Exception as db_exc:
+                print(f"❌ Error saving file message to DB: {db_exc}")
+                return {"success": False, "message": "Could not save file message"}
+            try:
+                await media_store.add_reference(file_path)
+            except Exception as e:
+                print(f"⚠️ Không cập nhật được ref_count của {file_path}: {e}")
             
             message_obj = {
-                "id": f"{sender}_{recipient}_{timestamp.timestamp()}",
+                "id": message_id,
+                "message_id": message_id,
                 "from": sender,
                 "to": recipient,
                 "message_type": message_type,
@@ -141,44 +207,12 @@ class Chat1v1Handler:
                 "is_read": False
             }
 
-            # Save to database with media fields
-            try:
-                from database.db import db
-                
-                sender_row = await db.fetch_one("SELECT id FROM users WHERE id = %s", (sender,))
-                recipient_row = await db.fetch_one("SELECT id FROM users WHERE id = %s", (recipient,))
-                
-                if sender_row and recipient_row:
-                    print(f"[DB] Saving file message: sender_id={sender_row['id']}, receiver_id={recipient_row['id']}, type={message_type}")
-                    await db.execute(
-                        """INSERT INTO private_messages 
-                           (sender_id, receiver_id, content, time_send, is_read, 
-                            message_type, file_path, file_name, file_size, mime_type, thumbnail_path) 
-                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                        (sender_row["id"], recipient_row["id"], content, timestamp_str, False,
-                         message_type, file_path, file_name, file_size, mime_type, thumbnail_path)
-                    )
-                    print(f"[DB] File message saved to database")
-                else:
-                    print(f"[DB] Could not find user IDs for sender or recipient")
-                    
-            except Exception as db_exc:
-                print(f"❌ Error saving file message to DB: {db_exc}")
-
             # Send push message to recipient if online
-            recipient_conn = self.user_connections.get(str(recipient))
-            if recipient_conn:
-                try:
-                    session_id, recipient_writer = recipient_conn
-                    push_message = {
-                        "action": "new_message",
-                        "data": message_obj
-                    }
-                    await self._send_message_to_client(recipient_writer, push_message)
-                    print(f"[PUSH] File message sent to recipient {recipient}")
-                except Exception as push_exc:
-                    print(f"❌ Error sending push file message: {push_exc}")
-            else:
+            push_message = {
+                "action": "new_message",
+                "data": message_obj
+            }
+            if not self._push_to_user(recipient, push_message):
                 print(f"[PUSH] Recipient {recipient} is not online")
 
             return {
@@ -197,50 +231,75 @@ class Chat1v1Handler:
             return {"success": False, "message": f"Error sending file message: {str(e)}"}
 
     async def handle_get_history(self, writer, request_data: dict):
-        """Get chat history between two users with pagination support"""
+        """Get chat history between two users with keyset (cursor) pagination"""
         try:
             user1 = request_data.get("user1")
             user2 = request_data.get("user2")
-            limit = request_data.get("limit", 50)
-            offset = request_data.get("offset", 0)
+            limit = clamp_limit(request_data.get("limit", 50))
+            before = request_data.get("before")  # cursor: lấy tin cũ hơn
+            after = request_data.get("after")    # cursor: lấy tin mới hơn
 
             if not all([user1, user2]):
                 return {"success": False, "message": "Missing user parameters"}
 
-            # Truy vấn DB để lấy lịch sử tin nhắn giữa user1 và user2 với trạng thái đọc
-            from database.db import db
-            # Nếu user1/user2 là id, dùng trực tiếp, nếu là username thì cần truy vấn id
-            # Ở đây giả sử là id
-            
-            # First get total count of messages
-            count_query = (
-                "SELECT COUNT(*) as total "
-                "FROM private_messages "
-                "WHERE (sender_id = %s AND receiver_id = %s) OR (sender_id = %s AND receiver_id = %s)"
-            )
-            count_params = (user1, user2, user2, user1)
-            count_result = await db.fetch_one(count_query, count_params)
-            total_messages = count_result["total"] if count_result else 0
-            
-            # Then get the paginated messages with media fields
-            query = (
-                "SELECT sender_id, receiver_id, content, time_send, is_read, read_at, "
-                "message_type, file_path, file_name, file_size, mime_type, thumbnail_path "
-                "FROM private_messages "
-                "WHERE (sender_id = %s AND receiver_id = %s) OR (sender_id = %s AND receiver_id = %s) "
-                "ORDER BY time_send DESC LIMIT %s OFFSET %s"
+            try:
+                cursor_sql, cursor_params, order_sql = keyset_clause(
+                    "time_send", "message_private_id", before=before, after=after
+                )
+            except ValueError as e:
+                return {"success": False, "message": str(e)}
+
+            key = conversation_key(user1, user2)
+            first_page = not before and not after
+
+            # Trang đầu (mới nhất): đọc từ hot-tail nếu đủ tin, không chạm MySQL
+            rows = None
+            if first_page:
+                cached = self.hot_tail.latest(key, limit)
+                if cached is not None:
+                    rows = [message.as_row() for message in cached]
+
+            if rows is None:
+                # Truy vấn DB để lấy lịch sử tin nhắn giữa user1 và user2 với trạng thái đọc
+                from database.db import db
+
+                # Lấy dư 1 dòng để biết còn trang sau hay không (không cần COUNT(*))
+                query = (
+                    "SELECT message_private_id, sender_id, receiver_id, content, time_send, "
+                    "message_type, file_path, file_name, file_size, mime_type, thumbnail_path "
+                    "FROM private_messages "
+                    "WHERE user_low = %s AND user_high = %s "  # dùng idx_conversation_time
+                    f"AND {cursor_sql} "
+                    f"ORDER BY {order_sql} LIMIT %s"
+                )
+                params = key + cursor_params + (limit + 1,)
+                rows = await db.fetch_all(query, params)
+                if first_page:
+                    self.hot_tail.seed(key, [CachedMessage.from_row(row) for row in rows],
+                                       complete=len(rows) <= limit)
+
+            rows, next_cursor, has_more = keyset_page(
+                rows, limit, "time_send", "message_private_id", after=after
             )
-            params = (user1, user2, user2, user1, limit, offset)
-            rows = await db.fetch_all(query, params)
+
+            # Trạng thái đã đọc suy ra từ watermark của người nhận (không đọc cột is_read)
+            watermarks = {
+                int(user1): await read_watermarks.get(user1, user2),
+                int(user2): await read_watermarks.get(user2, user1),
+            }
+
             messages = []
             for row in rows:
+                last_read_id, read_at = watermarks.get(int(row["receiver_id"]), (0, None))
+                is_read = row["message_private_id"] <= last_read_id
                 message_data = {
+                    "message_id": row["message_private_id"],
                     "from": row["sender_id"],
                     "to": row["receiver_id"],
                     "message": row["content"],
                     "timestamp": str(row["time_send"]),
-                    "is_read": row["is_read"],
-                    "read_at": str(row["read_at"]) if row["read_at"] else None,
+                    "is_read": is_read,
+                    "read_at": str(read_at) if is_read and read_at else None,
                     "message_type": row.get("message_type", "text")
                 }
                 
@@ -259,10 +318,10 @@ class Chat1v1Handler:
                 "success": True,
                 "data": {
                     "chat_id": f"{user1}_{user2}",
-                    "messages": list(reversed(messages)),  # đảo ngược để hiển thị từ cũ đến mới
-                    "total_count": total_messages,  # Total count of all messages in conversation
+                    "messages": messages,  # luôn từ cũ đến mới
                     "current_count": len(messages),  # Count of messages in this response
-                    "offset": offset,
+                    "next_cursor": next_cursor,  # truyền lại vào before/after để lấy trang tiếp
+                    "has_more": has_more,
                     "limit": limit,
                 },
             }
@@ -270,146 +329,77 @@ class Chat1v1Handler:
             return {"success": False, "message": f"Error getting history: {str(e)}"}
 
     async def handle_mark_read(self, writer, request_data: dict):
-        """Mark messages as read in database and notify sender"""
+        """Tiến read watermark (reader, sender) và báo cho người gửi; debounce theo cuộc trò chuyện"""
         try:
             user_id = request_data.get("user_id")  # Current user who is reading
             sender_id = request_data.get("sender_id")  # Person who sent the messages
+            last_message_id = request_data.get("last_message_id")  # None = tới tin mới nhất
 
             if not all([user_id, sender_id]):
                 return {"success": False, "message": "Missing user_id or sender_id"}
 
-            # Update database to mark messages as read
-            from database.db import db
-            from datetime import datetime
-            
-            read_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            # Mark all unread messages from sender_id to user_id as read
-            result = await db.execute(
-                """UPDATE private_messages 
-                   SET is_read = TRUE, read_at = %s 
-                   WHERE sender_id = %s AND receiver_id = %s AND is_read = FALSE""",
-                (read_time, sender_id, user_id)
-            )
-            
-            # Also update in-memory cache
-            chat_id = "_".join(sorted([str(user_id), str(sender_id)]))
-            if chat_id in self.message_history:
-                for message in self.message_history[chat_id]:
-                    if message["to"] == str(user_id) and message["from"] == str(sender_id):
-                        message["read"] = True
-
-            # Notify sender that their messages have been read
-            sender_conn = self.user_connections.get(str(sender_id))
-            if sender_conn:
-                _, sender_writer = sender_conn
-                try:
-                    read_notification = {
-                        "action": "messages_read",
-                        "data": {
-                            "reader_id": user_id,
-                            "sender_id": sender_id,  # Add sender_id for proper filtering
-                            "read_at": read_time
-                        }
+            if last_message_id:
+                # Đọc tới giữa chừng: badge còn đúng số tin mới hơn watermark
+                remaining = await self._count_unread_after(user_id, sender_id, last_message_id)
+                await unread_counters.lower_to(user_id, PEER_USER, sender_id, remaining)
+            else:
+                # Badge của cuộc trò chuyện về 0 (bỏ qua nếu đã là 0)
+                await unread_counters.reset(user_id, PEER_USER, sender_id)
+
+            async def notify_sender(last_read_id, read_at):
+                # Notify sender (all devices) that their messages have been read
+                self._push_to_user(sender_id, {
+                    "action": "messages_read",
+                    "data": {
+                        "reader_id": user_id,
+                        "sender_id": sender_id,  # Add sender_id for proper filtering
+                        "last_read_message_id": last_read_id,
+                        "read_at": read_at.strftime('%Y-%m-%d %H:%M:%S'),
                     }
-                    # Send with length prefix
-                    message_json = json.dumps(read_notification)
-                    message_bytes = message_json.encode('utf-8')
-                    length_prefix = len(message_bytes).to_bytes(4, 'big')
-                    
-                    sender_writer.write(length_prefix + message_bytes)
-                    await sender_writer.drain()
-                    print(f"[DEBUG] Notified sender {sender_id} that messages were read by {user_id}")
-                except Exception as e:
-                    print(f"[ERROR] Failed to notify sender {sender_id}: {e}")
+                })
 
-            return {"success": True, "message": "Messages marked as read", "affected_rows": result}
+            # Một dòng watermark thay cho UPDATE is_read trên từng tin; receipt dồn dập được gộp
+            applied = await read_watermarks.submit(user_id, sender_id, last_message_id, notify_sender)
+            return {"success": True, "message": "Messages marked as read", "debounced": not applied}
 
         except Exception as e:
             return {"success": False, "message": f"Error marking as read: {str(e)}"}
 
-    async def _send_message_to_client(self, writer, message_dict):
-        """Send message to client with proper formatting"""
-        try:
-            message_json = json.dumps(message_dict, ensure_ascii=False)
-            message_bytes = message_json.encode('utf-8')
-            length_prefix = len(message_bytes).to_bytes(4, 'big')
-            
-            writer.write(length_prefix + message_bytes)
-            await writer.drain()
-            print(f"[DEBUG] Message sent to client successfully")
-        except Exception as e:
-            print(f"❌ Error sending message to client: {e}")
-            raise
-
-    def register_user_connection(self, username: str, user_id: str, writer):
-        """Register user connection with session-specific tracking"""
-        import time
-        session_id = f"{username}_{user_id}_{int(time.time() * 1000)}"  # Add timestamp for uniqueness
-        connection_data = (session_id, writer)
-        
-        # Store with session-specific key to avoid conflicts
-        self.user_connections[session_id] = connection_data
-        
-        # Keep backward compatibility mappings (latest connection wins)
-        self.user_connections[username] = connection_data
-        self.user_connections[str(user_id)] = connection_data
-        
-        print(f"✅ User {username} (ID: {user_id}) connected for chat (session: {session_id})")
-        print(f"[DEBUG] Total active connections: {len(self.user_connections)}")
-        
-        return session_id  # Return session ID for cleanup
-
-    def unregister_user_connection(self, username: str, user_id: str = None, session_id: str = None):
-        """Unregister user connection - use session_id for precise cleanup"""
-        connections_to_remove = []
-        
-        # If session_id provided, remove that specific session
-        if session_id and session_id in self.user_connections:
-            connections_to_remove.append(session_id)
-            print(f"[DEBUG] Removing specific session: {session_id}")
-        else:
-            # Fallback to old method - find connections to remove
-            if user_id:
-                connection_key = f"{username}_{user_id}"
-                if connection_key in self.user_connections:
-                    connections_to_remove.append(connection_key)
-            
-            # Remove old-style entries only if no specific session
-            if username in self.user_connections:
-                connections_to_remove.append(username)
-            if user_id and str(user_id) in self.user_connections:
-                connections_to_remove.append(str(user_id))
-        
-        # Clean up connections
-        for key in connections_to_remove:
-            if key in self.user_connections:
-                try:
-                    _, writer = self.user_connections[key]
-                    if hasattr(writer, 'is_closing') and not writer.is_closing():
-                        writer.close()
-                        asyncio.create_task(writer.wait_closed())
-                except Exception as e:
-                    print(f"[WARNING] Error closing writer for {key}: {e}")
-                
-                del self.user_connections[key]
-                print(f"❌ Connection {key} removed from chat")
-        
-        print(f"[DEBUG] Active connections after cleanup: {len(self.user_connections)} total")
+    async def _count_unread_after(self, reader_id, sender_id, last_read_id) -> int:
+        """Số tin sender gửi reader có id > last_read_id (idx_receiver_id: chỉ quét tin mới hơn watermark)"""
+        from database.db import db
+        row = await db.fetch_one(
+            """SELECT COUNT(*) AS total FROM private_messages
+               WHERE receiver_id = %s AND message_private_id > %s AND sender_id = %s""",
+            (int(reader_id), int(last_read_id), int(sender_id)), raise_errors=True
+        )
+        return int(row["total"]) if row else 0
+
+    def _push_to_user(self, user_id, message_dict) -> int:
+        """Encode một lần, enqueue tới mọi thiết bị online của user. Trả về số thiết bị nhận."""
+        outbounds = registry.get_user_outbounds(user_id)
+        if not outbounds:
+            return 0
+        frame = encode_frame(message_dict)
+        return sum(1 for outbound in outbounds if outbound.enqueue(frame))
 
     def get_online_users(self):
-        """Get list of currently online users"""
-        return list(self.user_connections.keys())
-
-    def get_unread_count(self, username: str) -> int:
-        """Get count of unread messages for a user"""
-        unread_count = 0
-        for chat_id, messages in self.message_history.items():
-            for message in messages:
-                if message["to"] == username and not message["read"]:
-                    unread_count += 1
-        return unread_count
+        """Get list of currently online user ids"""
+        return registry.online_user_ids()
 
 
 # Global instance
 chat_handler = Chat1v1Handler()
+
+
+# Đăng ký action với router của server
+from action_router import router
+
+router.register("send_message", lambda session, p: chat_handler.handle_send_message(session.writer, p),
+                required=("from", "to", "message"))
+router.register("send_file_message", lambda session, p: chat_handler.handle_send_file_message(session.writer, p),
+                required=("from", "to", "file_path", "file_name"))
+router.register("get_chat_history", lambda session, p: chat_handler.handle_get_history(session.writer, p),
+                required=("user1", "user2"))
+router.register("mark_as_read", lambda session, p: chat_handler.handle_mark_read(session.writer, p),
+                required=("user_id", "sender_id"))
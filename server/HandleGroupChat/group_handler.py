@@ -1,55 +1,47 @@
 # server/group_handler.py
 from database.db import db
 from datetime import datetime
+from outbound_queue import encode_frame
+from fanout import fanout
+from session_registry import registry
+from pagination import clamp_limit, keyset_clause, keyset_page
+from user_directory import user_directory
+from group_membership import group_members
+from unread_counters import unread_counters, PEER_GROUP
+from conversation_summaries import conversation_summaries, make_preview
 
 class GroupHandler:
     def __init__(self):
         pass
 
     async def create_group_with_members(self, group_name: str, created_by: int, member_ids: list) -> dict:
-        """Tạo nhóm mới và thêm nhiều thành viên"""
+        """Tạo nhóm mới và thêm nhiều thành viên (một transaction)"""
         try:
-            # Tạo nhóm
-            await db.execute(
-                "INSERT INTO group_chat (group_name, created_by) VALUES (%s, %s)",
-                (group_name, created_by)
-            )
-
-            # Lấy ID nhóm vừa tạo
-            result = await db.fetch_one("SELECT LAST_INSERT_ID() as group_id")
-            group_id = result["group_id"]
-
-            # Thêm người tạo vào nhóm với role admin
-            await db.execute(
-                "INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'admin')",
-                (group_id, created_by)
-            )
+            # Nhóm mới nên chỉ cần bỏ trùng lặp, người tạo và user không tồn tại
+            candidate_ids = list(dict.fromkeys(int(uid) for uid in member_ids if int(uid) != int(created_by)))
+            valid_ids = await user_directory.filter_existing(candidate_ids)
+
+            async with db.transaction() as tx:
+                # Tạo nhóm, lấy ID nhóm vừa tạo từ chính câu INSERT
+                group_id = await tx.insert_returning(
+                    "INSERT INTO group_chat (group_name, created_by) VALUES (%s, %s)",
+                    (group_name, created_by)
+                )
 
-            # Thêm các thành viên được chọn
-            added_count = 0
-            for uid in member_ids:
-                if int(uid) == int(created_by):
-                    continue
-
-                # Kiểm tra user tồn tại
-                user_exists = await db.fetch_one("SELECT id FROM users WHERE id = %s", (uid,))
-                if not user_exists:
-                    continue
-
-                # Kiểm tra đã là thành viên chưa
-                already_member = await db.fetch_one(
-                    "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                    (group_id, uid)
+                # Thêm người tạo vào nhóm với role admin
+                await tx.execute(
+                    "INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'admin')",
+                    (group_id, created_by)
                 )
-                if already_member:
-                    continue
 
-                await db.execute(
+                # Thêm các thành viên được chọn: INSERT gộp một lần
+                await tx.executemany(
                     "INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)",
-                    (group_id, uid)
+                    [(group_id, uid) for uid in valid_ids]
                 )
-                added_count += 1
+                added_count = len(valid_ids)
 
+            group_members.set_group(group_id, {created_by: "admin", **{uid: "member" for uid in valid_ids}})
             return {
                 "success": True,
                 "message": f"Tạo nhóm '{group_name}' thành công, đã thêm {added_count} thành viên.",
@@ -61,18 +53,18 @@ class GroupHandler:
     async def create_group(self, group_name: str, created_by: int) -> dict:
         """Tạo nhóm chat mới"""
         try:
-            await db.execute(
-                "INSERT INTO group_chat (group_name, created_by) VALUES (%s, %s)",
-                (group_name, created_by)
-            )
-            result = await db.fetch_one("SELECT LAST_INSERT_ID() as group_id")
-            group_id = result["group_id"]
+            async with db.transaction() as tx:
+                group_id = await tx.insert_returning(
+                    "INSERT INTO group_chat (group_name, created_by) VALUES (%s, %s)",
+                    (group_name, created_by)
+                )
 
-            # Set creator làm admin ngay từ đầu
-            await db.execute(
-                "INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'admin')",
-                (group_id, created_by)
-            )
+                # Set creator làm admin ngay từ đầu
+                await tx.execute(
+                    "INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'admin')",
+                    (group_id, created_by)
+                )
+            group_members.set_group(group_id, {created_by: "admin"})
             return {"status": "ok", "message": f"Tạo nhóm '{group_name}' thành công", "group_id": group_id}
         except Exception as e:
             return {"status": "error", "message": f"Lỗi tạo nhóm: {str(e)}"}
@@ -84,24 +76,20 @@ class GroupHandler:
             if not group_info or group_info["created_by"] != added_by:
                 return {"success": False, "message": "Chỉ admin mới được thêm thành viên"}
 
-            user_exists = await db.fetch_one("SELECT id FROM users WHERE id = %s", (user_id,))
-            if not user_exists:
+            username = await user_directory.get_username(user_id)
+            if username is None:
                 return {"success": False, "message": "Người dùng không tồn tại"}
 
-            already_member = await db.fetch_one(
-                "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, user_id)
-            )
-            if already_member:
+            if await group_members.is_member(group_id, user_id):
                 return {"success": False, "message": "Người dùng đã là thành viên của nhóm"}
 
             await db.execute(
                 "INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)",
                 (group_id, user_id)
             )
+            group_members.add_member(group_id, user_id)
 
-            user_info = await db.fetch_one("SELECT username FROM users WHERE id = %s", (user_id,))
-            return {"success": True, "message": f"Đã thêm {user_info['username']} vào nhóm"}
+            return {"success": True, "message": f"Đã thêm {username} vào nhóm"}
         except Exception as e:
             return {"success": False, "message": f"Lỗi thêm thành viên: {str(e)}"}
 
@@ -109,11 +97,7 @@ class GroupHandler:
         """Thêm bạn bè vào nhóm (tất cả thành viên đều có thể thêm bạn của họ)"""
         try:
             # Kiểm tra người thêm có phải thành viên của nhóm không
-            member_check = await db.fetch_one(
-                "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, added_by)
-            )
-            if not member_check:
+            if not await group_members.is_member(group_id, added_by):
                 return {"success": False, "message": "Bạn không phải thành viên của nhóm này"}
 
             # Kiểm tra friend_id có phải bạn bè của added_by không
@@ -127,94 +111,120 @@ class GroupHandler:
                 return {"success": False, "message": "Bạn chỉ có thể thêm những người trong danh sách bạn bè của mình"}
 
             # Kiểm tra friend_id có tồn tại không
-            user_exists = await db.fetch_one("SELECT id, username FROM users WHERE id = %s", (friend_id,))
-            if not user_exists:
+            friend_name = await user_directory.get_username(friend_id)
+            if friend_name is None:
                 return {"success": False, "message": "Người dùng không tồn tại"}
 
             # Kiểm tra đã là thành viên chưa
-            already_member = await db.fetch_one(
-                "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, friend_id)
-            )
-            if already_member:
-                return {"success": False, "message": f"{user_exists['username']} đã là thành viên của nhóm"}
+            if await group_members.is_member(group_id, friend_id):
+                return {"success": False, "message": f"{friend_name} đã là thành viên của nhóm"}
 
             # Thêm vào nhóm với role member
             await db.execute(
                 "INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'member')",
                 (group_id, friend_id)
             )
+            group_members.add_member(group_id, friend_id)
 
-            return {"success": True, "message": f"Đã thêm {user_exists['username']} vào nhóm"}
+            return {"success": True, "message": f"Đã thêm {friend_name} vào nhóm"}
         except Exception as e:
             return {"success": False, "message": f"Lỗi thêm bạn bè vào nhóm: {str(e)}"}
 
     async def send_group_message(self, sender_id: int, group_id: int, content: str) -> dict:
         """Gửi tin nhắn nhóm"""
         try:
-            member_check = await db.fetch_one(
-                "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, sender_id)
-            )
-            if not member_check:
+            # Kiểm tra thành viên + tên người gửi đều lấy từ cache (không truy vấn DB)
+            if not await group_members.is_member(group_id, sender_id):
                 return {"success": False, "message": "Bạn không phải thành viên của nhóm này"}
+            sender_name = await user_directory.get_username(sender_id)
 
             if not content or len(content.strip()) == 0:
                 return {"success": False, "message": "Nội dung tin nhắn không được để trống"}
             if len(content) > 1000:
                 return {"success": False, "message": "Nội dung tin nhắn quá dài (tối đa 1000 ký tự)"}
 
-            await db.execute(
-                "INSERT INTO group_messages (sender_id, group_id, content) VALUES (%s, %s, %s)",
-                (sender_id, group_id, content)
-            )
+            # time_send do server đặt để dựng response mà không cần SELECT lại
+            time_send = datetime.now().replace(microsecond=0)
+            members = await group_members.get_members(group_id)
+            increments = [(uid, PEER_GROUP, int(group_id)) for uid in members if uid != int(sender_id)]
+            # Tin + badge mọi thành viên khác + tin cuối trong inbox: một transaction, một commit
+            async with db.transaction() as tx:
+                message_id = await tx.insert_returning(
+                    "INSERT INTO group_messages (sender_id, group_id, content, time_send) VALUES (%s, %s, %s, %s)",
+                    (sender_id, group_id, content, time_send)
+                )
+                await unread_counters.write_increments(tx, increments)
+                await conversation_summaries.write(tx, conversation_summaries.group_rows(
+                    group_id, members, sender_id, message_id, make_preview(content), "text", time_send
+                ))
+            unread_counters.apply_increments(increments)
+
+            message_data = {
+                "message_id": message_id,
+                "sender_id": int(sender_id),
+                "group_id": int(group_id),
+                "content": content,
+                "time_send": time_send.isoformat(),
+                "sender_name": sender_name
+            }
 
-            message = await db.fetch_one(
-                """SELECT gm.message_group_id, gm.sender_id, gm.group_id, gm.content, gm.time_send, u.username as sender_name
-                   FROM group_messages gm 
-                   JOIN users u ON gm.sender_id = u.id 
-                   WHERE gm.sender_id = %s AND gm.group_id = %s 
-                   ORDER BY gm.message_group_id DESC LIMIT 1""",
-                (sender_id, group_id)
-            )
-            if not message:
-                return {"success": False, "message": "Không thể lấy thông tin tin nhắn"}
+            # Đẩy real-time tới các thành viên đang online (chạy nền)
+            self._push_group_message(group_id, sender_id, message_data)
 
             return {
                 "success": True,
                 "message": "Gửi tin nhắn thành công",
-                "message_data": {
-                    "message_id": message["message_group_id"],
-                    "sender_id": message["sender_id"],
-                    "group_id": message["group_id"],
-                    "content": message["content"],
-                    "time_send": message["time_send"].isoformat() if message["time_send"] else None,
-                    "sender_name": message["sender_name"]
-                }
+                "message_data": message_data
             }
         except Exception as e:
             import traceback
             print("[GroupHandler] Lỗi gửi tin nhắn:", traceback.format_exc())
             return {"success": False, "message": f"Lỗi gửi tin nhắn: {str(e)}"}
 
-    async def get_group_messages(self, group_id: int, user_id: int, limit: int = 50, offset: int = 0) -> dict:
-        """Lấy tin nhắn nhóm"""
+    def _push_group_message(self, group_id, sender_id, message_data: dict):
+        """Encode frame new_group_message một lần rồi fan-out tới thành viên online"""
+        frame = encode_frame({"action": "new_group_message", "data": message_data})
+        fanout.publish(frame, self._get_online_member_outbounds(group_id, exclude_user_id=sender_id))
+
+    async def _get_online_member_outbounds(self, group_id, exclude_user_id=None) -> list:
+        """Hàng đợi gửi của các thành viên nhóm đang online (trừ người gửi)"""
+        members = await group_members.get_members(group_id)
+        outbounds = []
+        for member_id in members:
+            if str(member_id) == str(exclude_user_id):
+                continue
+            outbounds.extend(registry.get_user_outbounds(member_id))
+        return outbounds
+
+    async def get_group_messages(self, group_id: int, user_id: int, limit: int = 50,
+                                 before: str = None, after: str = None) -> dict:
+        """Lấy tin nhắn nhóm theo cursor (keyset trên time_send, message_group_id)"""
         try:
-            member_check = await db.fetch_one(
-                "SELECT * FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, user_id)
-            )
-            if not member_check:
+            if not await group_members.is_member(group_id, user_id):
                 return {"success": False, "message": "Bạn không phải thành viên của nhóm này"}
 
+            limit = clamp_limit(limit)
+            try:
+                cursor_sql, cursor_params, order_sql = keyset_clause(
+                    "gm.time_send", "gm.message_group_id", before=before, after=after
+                )
+            except ValueError as e:
+                return {"success": False, "message": str(e)}
+
             messages = await db.fetch_all(
-                """SELECT gm.message_group_id, gm.sender_id, gm.group_id, gm.content, gm.time_send, u.username as sender_name
+                f"""SELECT gm.message_group_id, gm.sender_id, gm.group_id, gm.content, gm.time_send, u.username as sender_name
                    FROM group_messages gm 
                    JOIN users u ON gm.sender_id = u.id 
-                   WHERE gm.group_id = %s 
-                   ORDER BY gm.time_send DESC LIMIT %s OFFSET %s""",
-                (group_id, limit, offset)
+                   WHERE gm.group_id = %s AND {cursor_sql}
+                   ORDER BY {order_sql} LIMIT %s""",
+                (group_id,) + cursor_params + (limit + 1,)
             )
+            messages, next_cursor, has_more = keyset_page(
+                messages, limit, "time_send", "message_group_id", after=after
+            )
+            if not before and not after:
+                # Đã xem trang mới nhất -> badge nhóm về 0
+                await unread_counters.reset(user_id, PEER_GROUP, group_id)
             message_list = [
                 {
                     "message_id": msg["message_group_id"],
@@ -226,10 +236,21 @@ class GroupHandler:
                 }
                 for msg in messages
             ]
-            return {"success": True, "messages": message_list[::-1]}
+            return {"success": True, "messages": message_list,
+                    "next_cursor": next_cursor, "has_more": has_more}
         except Exception as e:
             return {"success": False, "message": f"Lỗi lấy tin nhắn: {str(e)}"}
 
+    async def mark_group_as_read(self, group_id: int, user_id: int) -> dict:
+        """Đặt badge tin chưa đọc của nhóm về 0 (vd. khi đang mở cửa sổ nhóm và có tin mới)"""
+        try:
+            if not await group_members.is_member(group_id, user_id):
+                return {"success": False, "message": "Bạn không phải thành viên của nhóm này"}
+            await unread_counters.reset(user_id, PEER_GROUP, group_id)
+            return {"success": True}
+        except Exception as e:
+            return {"success": False, "message": f"Lỗi đánh dấu đã đọc: {str(e)}"}
+
     async def get_user_groups(self, user_id: int) -> dict:
         """Lấy danh sách nhóm của user"""
         try:
@@ -238,8 +259,7 @@ class GroupHandler:
             except Exception:
                 return {"success": False, "message": "user_id không hợp lệ"}
 
-            user_exists = await db.fetch_one("SELECT id FROM users WHERE id = %s", (user_id,))
-            if not user_exists:
+            if not await user_directory.exists(user_id):
                 return {"success": False, "message": "User không tồn tại"}
 
             groups = await db.fetch_all(
@@ -271,11 +291,7 @@ class GroupHandler:
         """Lấy danh sách thành viên nhóm"""
         try:
             if user_id:
-                member_check = await db.fetch_one(
-                    "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                    (group_id, user_id)
-                )
-                if not member_check:
+                if not await group_members.is_member(group_id, user_id):
                     return {"success": False, "message": "Bạn không phải thành viên của nhóm này"}
 
             members = await db.fetch_all(
@@ -304,16 +320,11 @@ class GroupHandler:
                 return {"status": "error", "message": "Nhóm không tồn tại"}
             
             # Kiểm tra user tồn tại
-            user_exists = await db.fetch_one("SELECT user_id FROM users WHERE user_id = %s", (user_id,))
-            if not user_exists:
+            if not await user_directory.exists(user_id):
                 return {"status": "error", "message": "Người dùng không tồn tại"}
             
             # Kiểm tra đã là thành viên chưa
-            already_member = await db.fetch_one(
-                "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, user_id)
-            )
-            if already_member:
+            if await group_members.is_member(group_id, user_id):
                 return {"status": "error", "message": "Bạn đã là thành viên của nhóm"}
             
             # Thêm vào nhóm với role member
@@ -321,6 +332,7 @@ class GroupHandler:
                 "INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'member')",
                 (group_id, user_id)
             )
+            group_members.add_member(group_id, user_id)
             
             return {"status": "ok", "message": "Đã tham gia nhóm thành công"}
             
@@ -337,16 +349,11 @@ class GroupHandler:
                 return {"status": "error", "message": "Nhóm không tồn tại"}
             
             # Kiểm tra user tồn tại
-            user_exists = await db.fetch_one("SELECT id FROM users WHERE id = %s", (user_id,))
-            if not user_exists:
+            if not await user_directory.exists(user_id):
                 return {"status": "error", "message": "Người dùng không tồn tại"}
             
             # Kiểm tra đã là thành viên chưa
-            already_member = await db.fetch_one(
-                "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, user_id)
-            )
-            if already_member:
+            if await group_members.is_member(group_id, user_id):
                 return {"status": "error", "message": "Người dùng đã là thành viên của nhóm"}
             
             # Thêm vào nhóm
@@ -354,6 +361,7 @@ class GroupHandler:
                 "INSERT INTO group_members (group_id, user_id) VALUES (%s, %s)",
                 (group_id, user_id)
             )
+            group_members.add_member(group_id, user_id)
             
             return {"status": "ok", "message": "Đã thêm thành viên vào nhóm"}
             
@@ -362,49 +370,46 @@ class GroupHandler:
             return {"status": "error", "message": str(e)}
 
     async def leave_group(self, group_id: int, user_id: int) -> dict:
-        """Rời khỏi nhóm - kiểm tra quyền admin"""
+        """Rời khỏi nhóm - kiểm tra quyền admin (một transaction)"""
         try:
-            # Kiểm tra user có trong nhóm không
-            member_info = await db.fetch_one(
-                "SELECT role FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, user_id)
-            )
-            
-            if not member_info:
-                return {"status": "error", "message": "Bạn không phải thành viên của nhóm này"}
-            
-            # Nếu là admin, kiểm tra có admin khác không
-            if member_info["role"] == "admin":
-                other_admins = await db.fetch_all(
-                    "SELECT user_id FROM group_members WHERE group_id = %s AND role = 'admin' AND user_id != %s",
-                    (group_id, user_id)
+            async with db.transaction() as tx:
+                # Khóa danh sách thành viên của nhóm: role của user + số admin/thành viên còn lại
+                members = await tx.fetch_all(
+                    "SELECT user_id, role FROM group_members WHERE group_id = %s FOR UPDATE",
+                    (group_id,)
                 )
+                member_info = next((m for m in members if str(m["user_id"]) == str(user_id)), None)
                 
-                if not other_admins:
+                if not member_info:
+                    return {"status": "error", "message": "Bạn không phải thành viên của nhóm này"}
+                
+                # Nếu là admin, kiểm tra có admin khác không
+                others = [m for m in members if m is not member_info]
+                if member_info["role"] == "admin" and not any(m["role"] == "admin" for m in others):
                     # Không có admin khác, cần chuyển quyền trước
                     return {
                         "status": "error", 
                         "message": "Bạn là admin duy nhất. Vui lòng chuyển quyền trưởng nhóm cho ai đó trước khi rời nhóm",
                         "require_transfer": True
                     }
-            
-            # Xóa khỏi nhóm
-            await db.execute(
-                "DELETE FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, user_id)
-            )
-            
-            # Kiểm tra nếu nhóm không còn thành viên nào thì xóa nhóm
-            remaining_members = await db.fetch_all(
-                "SELECT user_id FROM group_members WHERE group_id = %s",
-                (group_id,)
-            )
-            
-            if not remaining_members:
-                # Xóa nhóm nếu không còn ai
-                await db.execute("DELETE FROM group_chat WHERE group_id = %s", (group_id,))
+                
+                # Xóa khỏi nhóm
+                await tx.execute(
+                    "DELETE FROM group_members WHERE group_id = %s AND user_id = %s",
+                    (group_id, user_id)
+                )
+                
+                if not others:
+                    # Xóa nhóm nếu không còn ai
+                    await tx.execute("DELETE FROM group_chat WHERE group_id = %s", (group_id,))
+            
+            # Cập nhật cache + inbox sau khi transaction đã commit
+            if not others:
+                group_members.drop_group(group_id)
+                await conversation_summaries.forget_group(group_id)
                 return {"status": "ok", "message": "Đã rời nhóm. Nhóm đã bị giải tán do không còn thành viên"}
-            
+            group_members.remove_member(group_id, user_id)
+            await conversation_summaries.forget(user_id, PEER_GROUP, group_id)
             return {"status": "ok", "message": "Đã rời khỏi nhóm thành công"}
             
         except Exception as e:
@@ -412,38 +417,34 @@ class GroupHandler:
             return {"status": "error", "message": str(e)}
 
     async def transfer_admin(self, group_id: int, current_admin_id: int, new_admin_id: int) -> dict:
-        """Chuyển quyền trưởng nhóm"""
+        """Chuyển quyền trưởng nhóm (một transaction)"""
         try:
-            # Kiểm tra current_admin có phải admin không
-            current_admin = await db.fetch_one(
-                "SELECT role FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, current_admin_id)
-            )
-            
-            if not current_admin or current_admin["role"] != "admin":
-                return {"status": "error", "message": "Bạn không có quyền chuyển quyền trưởng nhóm"}
-            
-            # Kiểm tra new_admin có trong nhóm không
-            new_admin = await db.fetch_one(
-                "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, new_admin_id)
-            )
-            
-            if not new_admin:
-                return {"status": "error", "message": "Người được chọn không phải thành viên của nhóm"}
-            
-            # Chuyển new_admin thành admin
-            await db.execute(
-                "UPDATE group_members SET role = 'admin' WHERE group_id = %s AND user_id = %s",
-                (group_id, new_admin_id)
-            )
-            
-            # Chuyển current_admin thành member (nếu muốn)
-            await db.execute(
-                "UPDATE group_members SET role = 'member' WHERE group_id = %s AND user_id = %s",
-                (group_id, current_admin_id)
-            )
+            async with db.transaction() as tx:
+                # Lấy + khóa role của cả hai người trong một truy vấn
+                rows = await tx.fetch_all(
+                    "SELECT user_id, role FROM group_members WHERE group_id = %s AND user_id IN (%s, %s) FOR UPDATE",
+                    (group_id, current_admin_id, new_admin_id)
+                )
+                roles = {str(row["user_id"]): row["role"] for row in rows}
+                
+                # Kiểm tra current_admin có phải admin không
+                if roles.get(str(current_admin_id)) != "admin":
+                    return {"status": "error", "message": "Bạn không có quyền chuyển quyền trưởng nhóm"}
+                
+                # Kiểm tra new_admin có trong nhóm không
+                if str(new_admin_id) not in roles:
+                    return {"status": "error", "message": "Người được chọn không phải thành viên của nhóm"}
+                
+                # new_admin thành admin, current_admin thành member - một câu UPDATE
+                await tx.execute(
+                    """UPDATE group_members
+                       SET role = CASE WHEN user_id = %s THEN 'admin' ELSE 'member' END
+                       WHERE group_id = %s AND user_id IN (%s, %s)""",
+                    (new_admin_id, group_id, current_admin_id, new_admin_id)
+                )
             
+            group_members.set_role(group_id, new_admin_id, "admin")
+            group_members.set_role(group_id, current_admin_id, "member")
             return {"status": "ok", "message": "Đã chuyển quyền trưởng nhóm thành công"}
             
         except Exception as e:
@@ -520,25 +521,17 @@ class GroupHandler:
         """Admin kick thành viên khỏi nhóm"""
         try:
             # Kiểm tra admin có quyền không
-            admin_check = await db.fetch_one(
-                "SELECT role FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, admin_id)
-            )
-            
-            if not admin_check or admin_check["role"] != "admin":
+            members = await group_members.get_members(group_id)
+            if members.get(int(admin_id)) != "admin":
                 return {"status": "error", "message": "Bạn không có quyền kick thành viên"}
             
             # Kiểm tra member có trong nhóm không
-            member_check = await db.fetch_one(
-                "SELECT role FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, member_id)
-            )
-            
-            if not member_check:
+            member_role = members.get(int(member_id))
+            if member_role is None:
                 return {"status": "error", "message": "Thành viên không tồn tại trong nhóm"}
             
             # Không cho phép kick admin khác
-            if member_check["role"] == "admin":
+            if member_role == "admin":
                 return {"status": "error", "message": "Không thể kick admin khác"}
             
             # Xóa thành viên
@@ -546,6 +539,8 @@ class GroupHandler:
                 "DELETE FROM group_members WHERE group_id = %s AND user_id = %s",
                 (group_id, member_id)
             )
+            group_members.remove_member(group_id, member_id)
+            await conversation_summaries.forget(member_id, PEER_GROUP, group_id)
             
             return {"status": "ok", "message": "Đã kick thành viên khỏi nhóm"}
             
@@ -557,12 +552,7 @@ class GroupHandler:
         """Thêm bạn bè vào nhóm (mọi thành viên đều có thể thêm bạn bè của họ)"""
         try:
             # Kiểm tra người thêm có trong nhóm không
-            adder_check = await db.fetch_one(
-                "SELECT role FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, added_by)
-            )
-            
-            if not adder_check:
+            if not await group_members.is_member(group_id, added_by):
                 return {"status": "error", "message": "Bạn không phải thành viên của nhóm này"}
             
             # Kiểm tra friend_id có phải bạn bè của added_by không
@@ -575,12 +565,7 @@ class GroupHandler:
                 return {"status": "error", "message": "Chỉ có thể thêm bạn bè của bạn vào nhóm"}
             
             # Kiểm tra friend đã trong nhóm chưa
-            existing_member = await db.fetch_one(
-                "SELECT user_id FROM group_members WHERE group_id = %s AND user_id = %s",
-                (group_id, friend_id)
-            )
-            
-            if existing_member:
+            if await group_members.is_member(group_id, friend_id):
                 return {"status": "error", "message": "Người này đã là thành viên của nhóm"}
             
             # Thêm friend vào nhóm với role member
@@ -588,9 +573,59 @@ class GroupHandler:
                 "INSERT INTO group_members (group_id, user_id, role) VALUES (%s, %s, 'member')",
                 (group_id, friend_id)
             )
+            group_members.add_member(group_id, friend_id)
             
             return {"status": "ok", "message": "Đã thêm bạn bè vào nhóm thành công"}
             
         except Exception as e:
             print(f"❌ Lỗi add_friend_to_group: {e}")
             return {"status": "error", "message": str(e)}
+
+
+# Global instance
+group_handler = GroupHandler()
+
+
+# Đăng ký action với router của server
+from action_router import router
+
+router.register("create_group", lambda session, p: group_handler.create_group(p["group_name"], p["user_id"]),
+                required=("group_name", "user_id"))
+router.register("create_group_with_members",
+                lambda session, p: group_handler.create_group_with_members(p["group_name"], p["user_id"], p.get("member_ids", [])),
+                required=("group_name", "user_id"))
+router.register("get_user_groups", lambda session, p: group_handler.get_user_groups(p["user_id"]),
+                required=("user_id",))
+router.register("add_user_to_group", lambda session, p: group_handler.add_user_to_group(p["group_id"], p["user_id"]),
+                required=("group_id", "user_id"))
+router.register("get_group_messages",
+                lambda session, p: group_handler.get_group_messages(p["group_id"], p["user_id"],
+                                                                    p.get("limit", 50),
+                                                                    before=p.get("before"), after=p.get("after")),
+                required=("group_id", "user_id"))
+router.register("mark_group_as_read",
+                lambda session, p: group_handler.mark_group_as_read(p["group_id"], p["user_id"]),
+                required=("group_id", "user_id"))
+router.register("send_group_message",
+                lambda session, p: group_handler.send_group_message(p["sender_id"], p["group_id"], p["content"]),
+                required=("group_id", "sender_id", "content"))
+router.register("leave_group", lambda session, p: group_handler.leave_group(p["group_id"], p["user_id"]),
+                required=("group_id", "user_id"))
+router.register("transfer_admin",
+                lambda session, p: group_handler.transfer_admin(p["group_id"], p["current_admin_id"], p["new_admin_id"]),
+                required=("group_id", "current_admin_id", "new_admin_id"))
+router.register("transfer_leadership",
+                lambda session, p: group_handler.transfer_leadership(p["group_id"], p["current_admin_id"], p["new_admin_id"]),
+                required=("group_id", "current_admin_id", "new_admin_id"))
+router.register("get_group_members", lambda session, p: group_handler.get_group_members_with_roles(p["group_id"]),
+                required=("group_id",))
+router.register("join_group", lambda session, p: group_handler.join_group(p["group_id"], p["user_id"]),
+                required=("group_id", "user_id"))
+router.register("remove_member",
+                lambda session, p: group_handler.remove_member(p["group_id"], p["admin_id"], p["member_id"]),
+                required=("group_id", "admin_id", "member_id"))
+router.register("add_friend_to_group",
+                lambda session, p: group_handler.add_friend_to_group(p["group_id"], p["friend_id"], p["added_by"]),
+                required=("group_id", "friend_id", "added_by"))
+router.register("get_user_friends", lambda session, p: group_handler.get_user_friends(p["user_id"]),
+                required=("user_id",))
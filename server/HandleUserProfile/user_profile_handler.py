@@ -4,21 +4,18 @@ import base64
 import uuid
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from database.db import AsyncMySQLDatabase
+from database.db import db
+from user_directory import user_directory
 
 class UserProfileHandler:
     def __init__(self):
-        self.db = AsyncMySQLDatabase()
+        self.db = db  # Pool dùng chung toàn server
 
     async def get_user_profile(self, user_id):
         """Lấy thông tin profile đầy đủ của user"""
         try:
             print(f"[DEBUG] get_user_profile called for user_id: {user_id}")
             
-            # Ensure database connection
-            if not self.db.pool:
-                await self.db.connect()
-            
             # Get basic user info
             user_query = """
                 SELECT id, username, email, created_at 
@@ -88,10 +85,6 @@ class UserProfileHandler:
         try:
             print(f"[DEBUG] get_mutual_groups called for user1_id: {user1_id}, user2_id: {user2_id}")
             
-            # Ensure database connection
-            if not self.db.pool:
-                await self.db.connect()
-            
             query = """
                 SELECT DISTINCT g.group_id, g.group_name, g.created_by,
                        (SELECT COUNT(*) FROM group_members gm WHERE gm.group_id = g.group_id) as member_count
@@ -128,10 +121,6 @@ class UserProfileHandler:
             print(f"[DEBUG] update_user_profile called for user_id: {user_id}")
             print(f"[DEBUG] profile_data: {profile_data}")
             
-            # Ensure database connection
-            if not self.db.pool:
-                await self.db.connect()
-            
             # Update user_profiles table
             update_query = """
                 UPDATE user_profiles 
@@ -162,6 +151,7 @@ class UserProfileHandler:
                 email_update_query = "UPDATE users SET email = %s WHERE id = %s"
                 await self.db.execute(email_update_query, (profile_data['email'], user_id))
             
+            user_directory.invalidate(user_id=user_id)
             print(f"✅ Profile updated successfully for user_id {user_id}")
             return {"status": "ok", "message": "Profile updated successfully"}
             
@@ -176,10 +166,6 @@ class UserProfileHandler:
         try:
             print(f"[DEBUG] upload_avatar called for user_id: {user_id}, filename: {filename}")
             
-            # Ensure database connection
-            if not self.db.pool:
-                await self.db.connect()
-            
             # Tạo thư mục uploads nếu chưa có
             upload_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'uploads', 'avatars')
             os.makedirs(upload_dir, exist_ok=True)
@@ -237,10 +223,6 @@ class UserProfileHandler:
         try:
             print(f"[DEBUG] delete_avatar called for user_id: {user_id}")
             
-            # Ensure database connection
-            if not self.db.pool:
-                await self.db.connect()
-            
             # Lấy avatar_url hiện tại
             select_query = "SELECT avatar_url FROM user_profiles WHERE user_id = %s"
             result = await self.db.fetch_one(select_query, (user_id,))
@@ -276,3 +258,20 @@ class UserProfileHandler:
 
 # Create global instance
 user_profile_handler = UserProfileHandler()
+
+
+# Đăng ký action với router của server
+from action_router import router
+
+router.register("get_user_profile", lambda session, p: user_profile_handler.get_user_profile(p["user_id"]),
+                required=("user_id",))
+router.register("get_mutual_groups",
+                lambda session, p: user_profile_handler.get_mutual_groups(p["user1_id"], p["user2_id"]),
+                required=("user1_id", "user2_id"))
+router.register("update_user_profile", lambda session, p: user_profile_handler.update_user_profile(p["user_id"], p),
+                required=("user_id",))
+router.register("upload_avatar",
+                lambda session, p: user_profile_handler.upload_avatar(p["user_id"], p["avatar_data"], p["filename"]),
+                required=("user_id", "avatar_data", "filename"))
+router.register("delete_avatar", lambda session, p: user_profile_handler.delete_avatar(p["user_id"]),
+                required=("user_id",))
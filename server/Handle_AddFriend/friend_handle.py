@@ -1,6 +1,7 @@
 # server/friend_handler.py
 import json
 from database.db import db
+from user_directory import user_directory
 
 
 class FriendHandler:
@@ -10,14 +11,11 @@ class FriendHandler:
     async def get_suggestions(self, username):
         """Lấy danh sách gợi ý kết bạn"""
         try:
-            user_query = "SELECT id FROM users WHERE username = %s"
-            user_result = await self.db.fetch_one(user_query, (username,))
+            user_id = await user_directory.get_id(username)
 
-            if not user_result:
+            if user_id is None:
                 return {"status": "error", "message": "User not found"}
 
-            user_id = user_result["id"]
-
             suggestions_query = """
                 SELECT u.username 
                 FROM users u 
@@ -56,20 +54,33 @@ class FriendHandler:
             print(f"❌ Lỗi get_suggestions: {e}")
             return {"status": "error", "message": str(e)}
 
+    async def search_users(self, query, exclude_user_id=None, limit=20):
+        """Tìm user theo tiền tố username (dùng index của users.username)"""
+        try:
+            query = (query or "").strip()
+            if not query:
+                return {"status": "ok", "data": []}
+            # Ký tự đại diện của LIKE trong từ khóa được hiểu theo nghĩa đen
+            pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            users = await self.db.fetch_all(
+                "SELECT id, username FROM users WHERE username LIKE %s AND id != %s ORDER BY username LIMIT %s",
+                (pattern, int(exclude_user_id or 0), int(limit)),
+            )
+            return {"status": "ok", "data": [{"user_id": u["id"], "username": u["username"]} for u in users]}
+
+        except Exception as e:
+            print(f"❌ Lỗi search_users: {e}")
+            return {"status": "error", "message": str(e)}
+
     async def add_friend(self, from_user, to_user):
         """Gửi lời mời kết bạn"""
         try:
-            from_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (from_user,)
-            )
-            to_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (to_user,)
-            )
+            ids = await user_directory.get_ids(from_user, to_user)
 
-            if not from_result or not to_result:
+            if from_user not in ids or to_user not in ids:
                 return {"status": "error", "message": "User not found"}
 
-            from_user_id, to_user_id = from_result["id"], to_result["id"]
+            from_user_id, to_user_id = ids[from_user], ids[to_user]
 
             friend_check_query = """
                 SELECT * FROM friends 
@@ -114,12 +125,9 @@ class FriendHandler:
     async def get_friends(self, username):
         """Lấy danh sách bạn bè"""
         try:
-            user_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (username,)
-            )
-            if not user_result:
+            user_id = await user_directory.get_id(username)
+            if user_id is None:
                 return {"status": "error", "message": "User not found"}
-            user_id = user_result["id"]
 
             friends_query = """
                 SELECT u.id as friend_id, u.username as friend_name
@@ -145,12 +153,9 @@ class FriendHandler:
     async def get_friend_requests(self, username):
         """Lấy lời mời kết bạn"""
         try:
-            user_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (username,)
-            )
-            if not user_result:
+            user_id = await user_directory.get_id(username)
+            if user_id is None:
                 return {"status": "error", "message": "User not found"}
-            user_id = user_result["id"]
 
             requests_query = """
                 SELECT u.username as from_username
@@ -170,17 +175,12 @@ class FriendHandler:
     async def accept_friend(self, username, from_user):
         """Chấp nhận lời mời kết bạn"""
         try:
-            user_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (username,)
-            )
-            from_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (from_user,)
-            )
+            ids = await user_directory.get_ids(username, from_user)
 
-            if not user_result or not from_result:
+            if username not in ids or from_user not in ids:
                 return {"status": "error", "message": "User not found"}
 
-            user_id, from_user_id = user_result["id"], from_result["id"]
+            user_id, from_user_id = ids[username], ids[from_user]
 
             # Kiểm tra xem đã là bạn bè chưa
             friend_check_query = """
@@ -201,7 +201,7 @@ class FriendHandler:
             result = await self.db.execute(update_request_query, (from_user_id, user_id))
             
             # Kiểm tra xem có friend request nào được cập nhật không
-            if result == 0:
+            if result.rowcount == 0:
                 return {"status": "error", "message": "No pending friend request found"}
 
             # Chỉ tạo friendship mới nếu chưa tồn tại
@@ -223,17 +223,12 @@ class FriendHandler:
     async def reject_friend(self, username, from_user):
         """Từ chối lời mời kết bạn"""
         try:
-            user_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (username,)
-            )
-            from_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (from_user,)
-            )
+            ids = await user_directory.get_ids(username, from_user)
 
-            if not user_result or not from_result:
+            if username not in ids or from_user not in ids:
                 return {"status": "error", "message": "User not found"}
 
-            user_id, from_user_id = user_result["id"], from_result["id"]
+            user_id, from_user_id = ids[username], ids[from_user]
 
             update_request_query = """
                 UPDATE friend_requests 
@@ -251,17 +246,12 @@ class FriendHandler:
     async def remove_friend(self, username, friend_name):
         """Xóa bạn bè"""
         try:
-            user_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (username,)
-            )
-            friend_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (friend_name,)
-            )
+            ids = await user_directory.get_ids(username, friend_name)
 
-            if not user_result or not friend_result:
+            if username not in ids or friend_name not in ids:
                 return {"status": "error", "message": "User not found"}
 
-            user_id, friend_id = user_result["id"], friend_result["id"]
+            user_id, friend_id = ids[username], ids[friend_name]
 
             delete_friend_query = """
                 DELETE FROM friends 
@@ -294,15 +284,12 @@ class FriendHandler:
         try:
             print(f"[DEBUG] get_sent_friend_requests called for username: {username}")
             
-            user_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (username,)
-            )
+            user_id = await user_directory.get_id(username)
             
-            if not user_result:
+            if user_id is None:
                 print(f"[DEBUG] User not found: {username}")
                 return {"status": "error", "message": "User not found"}
             
-            user_id = user_result["id"]
             print(f"[DEBUG] Found user_id: {user_id} for username: {username}")
             
             # Lấy danh sách lời mời đã gửi (status = 'pending')
@@ -346,18 +333,13 @@ class FriendHandler:
     async def cancel_friend_request(self, sender_username, receiver_username):
         """Thu hồi lời mời kết bạn đã gửi"""
         try:
-            sender_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (sender_username,)
-            )
-            receiver_result = await self.db.fetch_one(
-                "SELECT id FROM users WHERE username = %s", (receiver_username,)
-            )
+            ids = await user_directory.get_ids(sender_username, receiver_username)
             
-            if not sender_result or not receiver_result:
+            if sender_username not in ids or receiver_username not in ids:
                 return {"status": "error", "message": "User not found"}
             
-            sender_id = sender_result["id"]
-            receiver_id = receiver_result["id"]
+            sender_id = ids[sender_username]
+            receiver_id = ids[receiver_username]
             
             # Kiểm tra xem có lời mời pending không
             check_query = """
@@ -386,3 +368,35 @@ class FriendHandler:
 
 # Global instance
 friend_handler = FriendHandler()
+
+
+# Đăng ký action với router của server
+from action_router import router
+
+router.register("get_friends", lambda session, p: friend_handler.get_friends(p["username"]),
+                required=("username",))
+router.register("send_friend_request",
+                lambda session, p: friend_handler.add_friend(p["sender_username"], p["receiver_username"]),
+                required=("sender_username", "receiver_username"))
+router.register("get_friend_requests", lambda session, p: friend_handler.get_friend_requests(p["username"]),
+                required=("username",))
+router.register("get_sent_friend_requests",
+                lambda session, p: friend_handler.get_sent_friend_requests(p["username"]),
+                required=("username",))
+router.register("handle_friend_request",
+                lambda session, p: friend_handler.handle_friend_request(p["from_username"], p["to_username"], p["action"]),
+                required=("from_username", "to_username", "action"))
+router.register("cancel_friend_request",
+                lambda session, p: friend_handler.cancel_friend_request(p["sender_username"], p["receiver_username"]),
+                required=("sender_username", "receiver_username"))
+router.register("remove_friend", lambda session, p: friend_handler.remove_friend(p["username"], p["friend_name"]),
+                required=("username", "friend_name"))
+
+
+async def _handle_search_users(session, p):
+    if not session.logged_in_user_id:
+        return {"status": "error", "message": "Cần đăng nhập"}
+    return await friend_handler.search_users(p["query"], exclude_user_id=session.logged_in_user_id)
+
+
+router.register("search_users", _handle_search_users, required=("query",))
@@ -1,4 +1,5 @@
 from database.db import db
+from user_directory import user_directory
 import hashlib
 
 def hash_password_sha256(password: str) -> str:
@@ -15,6 +16,7 @@ class LoginHandler:
         stored_hash = user["password_hash"]
         
         if hashed_input == stored_hash:
+            user_directory.prime(user["id"], user["username"])
             return {
                 "success": True,
                 "message": "Đăng nhập thành công.",
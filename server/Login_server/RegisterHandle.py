@@ -1,6 +1,7 @@
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 from database.db import db
+from user_directory import user_directory
 import hashlib
 
 def hash_password_sha256(password: str) -> str:
@@ -10,10 +11,8 @@ def hash_password_sha256(password: str) -> str:
 class RegisterHandler:
     async def register_user(self, username: str, password: str, email: str) -> dict:
         # Kiểm tra username đã tồn tại chưa
-        existing_user = await db.fetch_one(
-            "SELECT * FROM users WHERE Username = %s", (username,)
-        )
-        if existing_user:
+        existing_user = await user_directory.get_id(username)
+        if existing_user is not None:
             return {"success": False, "message": "Tên người dùng đã tồn tại."}
 
         # Kiểm tra email đã tồn tại chưa
@@ -27,11 +26,13 @@ class RegisterHandler:
         hashed_password = hash_password_sha256(password)
 
         try:
-            await db.execute(
+            user_id = await db.insert_returning(
                 "INSERT INTO users (username, password_hash, email) VALUES (%s, %s, %s)",
                 (username, hashed_password, email)
             )
-            return {"success": True, "message": "Đăng ký thành công."}
+            user_directory.invalidate(username=username)
+            user_directory.prime(user_id, username)
+            return {"success": True, "message": "Đăng ký thành công.", "user_id": user_id}
         except Exception as e:
             return {"success": False, "message": f"Lỗi đăng ký: {str(e)}"}
 
@@ -0,0 +1,125 @@
+# server/action_router.py
+import time
+import bisect
+
+
+# Biên trên (ms) của các bucket histogram độ trễ, bucket cuối là +inf
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class ActionStats:
+    """Thống kê số lần gọi, số lỗi và histogram độ trễ của một action"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms: float, is_error: bool):
+        self.count += 1
+        if is_error:
+            self.errors += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+    def percentile(self, fraction: float):
+        """Ước lượng percentile từ histogram (trả về biên trên của bucket)"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= target:
+                if index < len(LATENCY_BUCKETS_MS):
+                    return LATENCY_BUCKETS_MS[index]
+                return round(self.max_ms, 2)
+        return round(self.max_ms, 2)
+
+    def to_dict(self) -> dict:
+        labels = [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + ["le_inf"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "histogram": dict(zip(labels, self.buckets)),
+        }
+
+
+class Route:
+    def __init__(self, action: str, handler, required=()):
+        self.action = action
+        self.handler = handler      # handler(session, payload) -> awaitable[dict | None]
+        self.required = tuple(required)
+
+
+class ActionRouter:
+    """Bảng action -> handler; thay cho chuỗi if/elif trong ClientSession"""
+
+    def __init__(self):
+        self.routes = {}
+        self.stats = {}
+
+    def register(self, action: str, handler, required=()):
+        """Đăng ký handler cho action. required: các field bắt buộc trong data["data"]"""
+        if action in self.routes:
+            raise ValueError(f"Action '{action}' đã được đăng ký")
+        self.routes[action] = Route(action, handler, required)
+        self.stats[action] = ActionStats()
+
+    def route(self, action: str, *required):
+        """Decorator dạng @router.route("login", "username", "password")"""
+        def decorator(handler):
+            self.register(action, handler, required)
+            return handler
+        return decorator
+
+    def has_route(self, action: str) -> bool:
+        return action in self.routes
+
+    async def dispatch(self, session, data: dict):
+        """Gọi handler của action, trả về response dict (None = không phản hồi)"""
+        action = data.get("action")
+        route = self.routes.get(action)
+        if route is None:
+            self.stats.setdefault("<unknown>", ActionStats()).record(0.0, True)
+            return {"success": False, "message": f"Unknown action: {action}"}
+
+        payload = data.get("data") or {}
+        missing = [field for field in route.required if field not in payload]
+        if missing:
+            self.stats[action].record(0.0, True)
+            return {"success": False, "message": f"Missing required fields: {', '.join(missing)}"}
+
+        started = time.perf_counter()
+        is_error = True
+        try:
+            result = await route.handler(session, payload)
+            is_error = isinstance(result, dict) and (
+                result.get("success") is False or result.get("status") == "error"
+            )
+            return result
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stats[action].record(elapsed_ms, is_error)
+
+    def get_stats(self) -> dict:
+        """Snapshot thống kê của các action đã được gọi, sắp theo tổng thời gian xử lý"""
+        used = [(action, stats) for action, stats in self.stats.items() if stats.count]
+        used.sort(key=lambda item: item[1].total_ms, reverse=True)
+        return {action: stats.to_dict() for action, stats in used}
+
+    def reset_stats(self):
+        for action in self.stats:
+            self.stats[action] = ActionStats()
+
+
+# Router dùng chung cho toàn server
+router = ActionRouter()
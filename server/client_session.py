@@ -3,53 +3,92 @@ import asyncio
 import time
 from Login_server.RegisterHandle import register
 from Login_server.LoginHandle import login
-from HandleGroupChat.group_handler import GroupHandler
+from action_router import router
+# Module handler tự đăng ký action khi import: import ở đây để bảng router đủ ngay lúc khởi động,
+# import lỗi thì server không khởi động (thay vì thiếu action một cách im lặng)
+from HandleGroupChat.group_handler import group_handler
+from Handle_AddFriend.friend_handle import friend_handler
+from HandleChat1_1.chat_handler import chat_handler
+from HandleUserProfile.user_profile_handler import user_profile_handler
+from upload_manager import upload_manager
+from outbound_queue import OutboundQueue, encode_frame, BINARY_FRAME_FLAG
+from fanout import fanout
+from session_registry import registry
+from database.db import db
+from user_directory import user_directory
+from group_membership import group_members
+from unread_counters import unread_counters
+from read_watermarks import read_watermarks
+from conversation_summaries import conversation_summaries
+from resume_tokens import resume_tokens
+from delta_sync import delta_sync, SYNC_CHUNK_SIZE
+from media_stream import media_streamer
+
+# Action thay đổi trạng thái session -> luôn xử lý tuần tự trong vòng đọc
+SESSION_STATE_ACTIONS = {"ping", "login", "resume", "register", "logout", "switch_user"}
+
+# Action ghi vào cùng một cuộc trò chuyện/đối tượng phải giữ thứ tự gửi
+CHAT_ORDERED_ACTIONS = {"send_message", "send_file_message", "mark_as_read"}
+GROUP_ORDERED_ACTIONS = {
+    "send_group_message", "leave_group", "transfer_admin", "transfer_leadership",
+    "join_group", "add_user_to_group", "remove_member", "add_friend_to_group", "mark_group_as_read",
+}
+FRIEND_ORDERED_ACTIONS = {"send_friend_request", "handle_friend_request", "cancel_friend_request", "remove_friend"}
+PROFILE_ORDERED_ACTIONS = {"update_user_profile", "upload_avatar", "delete_avatar"}
+
+
+def ordering_key(data: dict):
+    """Trả về key tuần tự hóa cho request, hoặc None nếu có thể chạy song song hoàn toàn"""
+    action = data.get("action")
+    payload = data.get("data") or {}
+    if action in CHAT_ORDERED_ACTIONS:
+        first = payload.get("from", payload.get("user_id"))
+        second = payload.get("to", payload.get("sender_id"))
+        return ("chat",) + tuple(sorted((str(first), str(second))))
+    if action in GROUP_ORDERED_ACTIONS:
+        return ("group", str(payload.get("group_id")))
+    if action in FRIEND_ORDERED_ACTIONS:
+        return ("friends",)
+    if action in PROFILE_ORDERED_ACTIONS:
+        return ("profile",)
+    return None
 
 
 class ClientSession:
-    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client_address):
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client_address,
+                 concurrent_requests=True, max_inflight_requests=8):
         self.reader = reader
         self.writer = writer
         self.client_address = client_address
         self.running = True
-        self.group_handler = GroupHandler()
+        self.group_handler = group_handler
         self.last_ping_time = time.time()
+
+        # Xử lý nhiều request song song trên cùng session
+        self.concurrent_requests = concurrent_requests
+        self._inflight_slots = asyncio.Semaphore(max_inflight_requests)
+        self._inflight_tasks = set()
+        self._ordering_tails = {}  # {ordering_key: task cuối cùng trong chuỗi}
+
+        # Mọi frame gửi đi (response + push) đi qua hàng đợi riêng của kết nối
+        self.outbound = OutboundQueue(writer, on_overflow=self._on_outbound_overflow, name=str(client_address))
         
         # User login info
         self.logged_in_username = None
         self.logged_in_user_id = None
-        self.session_id = None  # Track session ID for proper cleanup        # Friend handler
-        try:
-            from Handle_AddFriend.friend_handle import friend_handler
-            self.friend_handler = friend_handler
-        except Exception as e:
-            print(f"Không thể import friend_handler: {e}")
-            self.friend_handler = None
+        self.session_id = None  # Session ID trong registry, dùng để gỡ đúng thiết bị
 
-        # Chat 1-1 handler
-        try:
-            from HandleChat1_1.chat_handler import chat_handler
-            self.chat1v1_handler = chat_handler
-        except Exception as e:
-            print(f"Không thể import chat_handler: {e}")
-            self.chat1v1_handler = None
-
-        # User profile handler
-        try:
-            from HandleUserProfile.user_profile_handler import UserProfileHandler
-            self.user_profile_handler = UserProfileHandler()
-            print(f"✅ UserProfileHandler imported successfully: {self.user_profile_handler}")
-        except Exception as e:
-            print(f"❌ Không thể import UserProfileHandler: {e}")
-            import traceback
-            traceback.print_exc()
-            self.user_profile_handler = None
+        # Handler dùng chung cho mọi session
+        self.friend_handler = friend_handler
+        self.chat1v1_handler = chat_handler
+        self.user_profile_handler = user_profile_handler
+        self.upload_manager = upload_manager
 
     async def run(self):
         print(f"🟢 Client {self.client_address} session started.")
+        self.outbound.start()
         try:
             while self.running:
-                print(f"[DEBUG] Session loop running, self.running={self.running}")
                 # Increased timeout to 5 minutes and only check if client is inactive
                 if time.time() - self.last_ping_time > 300:  # 5 minutes instead of 1 minute
                     await self.handle_disconnect("Timeout - Không có ping từ client")
@@ -68,6 +107,8 @@ class ClientSession:
                     break
 
                 message_length = int.from_bytes(length_prefix, "big")
+                is_binary = bool(message_length & BINARY_FRAME_FLAG)
+                message_length &= ~BINARY_FRAME_FLAG
 
                 if message_length > 1024 * 1024:  # 1MB
                     await self.handle_disconnect("Tin nhắn quá lớn")
@@ -80,9 +121,10 @@ class ClientSession:
 
                 # Update ping time on successful message receive
                 self.last_ping_time = time.time()
-                print(f"[DEBUG] About to call handle_message for {self.client_address}")
-                await self.handle_message(message_data)
-                print(f"[DEBUG] handle_message completed for {self.client_address}, running={self.running}")
+                if is_binary:
+                    await self.handle_binary_frame(message_data)
+                else:
+                    await self.dispatch_message(message_data)
 
         except asyncio.IncompleteReadError:
             print(f"[DEBUG] IncompleteReadError - Client closed connection")
@@ -96,6 +138,73 @@ class ClientSession:
             print(f"[DEBUG] run() method ending, calling cleanup")
             await self.cleanup()
 
+    async def handle_binary_frame(self, payload):
+        """
+        Chunk upload: xử lý ngay trong vòng đọc nên các chunk của một kết nối được ghi theo thứ tự,
+        và socket chỉ được đọc tiếp khi chunk trước đã xuống đĩa (backpressure tự nhiên).
+        """
+        if not self.logged_in_user_id:
+            self.outbound.enqueue_json({"action": "upload_ack",
+                                        "data": {"success": False, "message": "Không nhận upload"}})
+            return
+        try:
+            ack = await self.upload_manager.write_chunk(self.logged_in_user_id, payload)
+        except Exception as e:
+            ack = {"success": False, "message": str(e)}
+        self.outbound.enqueue_json({"action": "upload_ack", "data": ack})
+
+    async def dispatch_message(self, raw_data):
+        """Chạy request inline hoặc thành task riêng tùy chế độ và loại action"""
+        if not self.concurrent_requests:
+            await self.handle_message(raw_data)
+            return
+
+        try:
+            data = json.loads(raw_data.decode())
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            await self.handle_message(raw_data)  # handle_message sẽ trả lỗi Invalid JSON
+            return
+
+        if not isinstance(data, dict) or data.get("action") in SESSION_STATE_ACTIONS:
+            await self.handle_message(data)
+            return
+
+        # Giới hạn số request đang chạy: hết slot thì ngừng đọc socket (backpressure)
+        await self._inflight_slots.acquire()
+        key = ordering_key(data)
+        previous = self._ordering_tails.get(key) if key else None
+        task = asyncio.create_task(self._run_request(data, previous))
+        self._inflight_tasks.add(task)
+        task.add_done_callback(self._inflight_tasks.discard)
+        if key:
+            self._ordering_tails[key] = task
+            task.add_done_callback(lambda t, k=key: self._release_ordering_key(k, t))
+
+    async def _run_request(self, data, previous=None):
+        try:
+            if previous is not None:
+                # Chờ request trước cùng key xong (không quan tâm kết quả)
+                await asyncio.wait([previous])
+            await self.handle_message(data)
+        finally:
+            self._inflight_slots.release()
+
+    def _release_ordering_key(self, key, task):
+        if self._ordering_tails.get(key) is task:
+            del self._ordering_tails[key]
+
+    async def _drain_inflight_requests(self, timeout=5.0):
+        """Cho các request đang chạy (vd. ghi DB) hoàn tất, quá hạn thì hủy"""
+        tasks = list(self._inflight_tasks)
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            print(f"[DEBUG] Cancelled {len(pending)} in-flight requests for {self.client_address}")
+
     async def handle_disconnect(self, reason):
         print(f"⛔ Client {self.client_address} disconnected. Lý do: {reason}")
         import traceback
@@ -105,15 +214,14 @@ class ClientSession:
 
     async def cleanup(self):
         try:
-            # Unregister from chat handler if logged in - use session_id for precise cleanup
-            if self.chat1v1_handler and self.logged_in_username:
-                self.chat1v1_handler.unregister_user_connection(
-                    self.logged_in_username, 
-                    self.logged_in_user_id,
-                    session_id=getattr(self, 'session_id', None)
-                )
-                print(f"[Chat1v1] Unregistered {self.logged_in_username} on cleanup - Session: {self.client_address}")
-                
+            await self._drain_inflight_requests()
+
+            # Gỡ phiên khỏi registry (chỉ thiết bị này, các thiết bị khác vẫn online)
+            self.unregister_session()
+
+            # Dừng download đang stream, gửi nốt frame còn trong hàng đợi rồi mới đóng socket
+            await media_streamer.cancel(self.outbound)
+            await self.outbound.close()
             if not self.writer.is_closing():
                 self.writer.close()
                 await self.writer.wait_closed()
@@ -121,17 +229,27 @@ class ClientSession:
         except Exception as e:
             print(f"⚠️ Lỗi khi đóng writer {self.client_address}: {e}")
 
+    def unregister_session(self):
+        if self.session_id:
+            registry.unregister(self.session_id)
+            self.session_id = None
+
+    def _on_outbound_overflow(self, queue):
+        """Client đọc quá chậm, hàng đợi vượt giới hạn byte -> ngắt kết nối"""
+        print(f"⛔ Client {self.client_address} quá chậm ({queue.queued_bytes} bytes đang chờ), ngắt kết nối")
+        self.running = False
+        transport = getattr(self.writer, "transport", None)
+        if transport is not None:
+            transport.abort()
+
     async def send_response(self, response_dict, request_id=None, is_logout=False):
         try:
             # Thêm request_id vào response nếu có
             if request_id:
                 response_dict["_request_id"] = request_id
-            print(f"[DEBUG] Sending response to {self.client_address}: {response_dict}")
-            response_json = json.dumps(response_dict, ensure_ascii=False).encode("utf-8")
-            response_length = len(response_json).to_bytes(4, "big")
-            self.writer.write(response_length + response_json)
-            await self.writer.drain()
-            print(f"[DEBUG] Response sent successfully to {self.client_address}")
+            # Chỉ enqueue, writer task của session sẽ gửi
+            if not self.outbound.enqueue(encode_frame(response_dict)):
+                raise ConnectionError("outbound queue closed")
         except Exception as e:
             print(f"❌ Không gửi được phản hồi cho {self.client_address}: {e}")
             # Do NOT close connection for logout response send failures
@@ -143,312 +261,211 @@ class ClientSession:
     async def handle_message(self, raw_data):
         request_id = None  # Initialize request_id at top level
         try:
-            data = json.loads(raw_data.decode())
+            # dispatch_message có thể đã decode sẵn
+            data = raw_data if isinstance(raw_data, dict) else json.loads(raw_data.decode())
             action = data.get("action")
             request_id = data.get("_request_id")  # Lấy request ID từ client
-            print(f"[DEBUG] Handling action: {action}, request_id: {request_id}")
-
-            if action == "ping":
-                print(f"💓 Ping từ {self.client_address} ({data['data']['username']})")
-                self.last_ping_time = time.time()
-                return
-
-            elif action == "login":
-                username = data["data"]["username"]
-                password = data["data"]["password"]
-                result = await login.login_user(username, password)
-                await self.send_response(result, request_id)
-
-                if result and result.get("success") and self.chat1v1_handler:
-                    try:
-                        user_id = result.get("user_id")
-                        # Save login info
-                        self.logged_in_username = username
-                        self.logged_in_user_id = str(user_id)
-                        
-                        # Register with session-specific connection to avoid conflicts
-                        self.session_id = self.chat1v1_handler.register_user_connection(username, str(user_id), self.writer)
-                        print(f"[Chat1v1] Registered real-time connection for {username} (ID: {user_id}) - Session: {self.client_address}, Session ID: {self.session_id}")
-                    except Exception as e:
-                        print(f"[Chat1v1] Failed to register connection for {username}: {e}")
-
-            elif action == "register":
-                username = data["data"]["username"]
-                password = data["data"]["password"]
-                email = data["data"]["email"]
-                result = await register.register_user(username, password, email)
-                await self.send_response(result, request_id)
-                self.running = False
 
-            elif action == "logout":
-                print(f"[DEBUG][ClientSession] ======= LOGOUT START =======")
-                print(f"[DEBUG][ClientSession] Processing logout for user: {data['data'].get('username')}")
-                print(f"[DEBUG][ClientSession] Current logged_in_username: {self.logged_in_username}")
-                print(f"[DEBUG][ClientSession] Current running state: {self.running}")
-                
-                if self.chat1v1_handler and self.logged_in_username:
-                    print(f"[DEBUG][ClientSession] Unregistering from chat handler...")
-                    # Use session_id for precise cleanup
-                    self.chat1v1_handler.unregister_user_connection(
-                        self.logged_in_username, 
-                        self.logged_in_user_id, 
-                        session_id=getattr(self, 'session_id', None)
-                    )
-                    print(f"[Chat1v1] Unregistered connection for {self.logged_in_username} - Session: {self.client_address}")
-                
-                # Clear user session data but keep connection alive
-                old_username = self.logged_in_username
-                self.logged_in_username = None
-                self.logged_in_user_id = None
-                print(f"[ClientSession] User {old_username} logged out, session cleared but connection maintained")
-                
-                # Send logout response with special flag to keep connection alive even if send fails
-                print(f"[DEBUG][ClientSession] Sending logout response, keeping connection alive")
-                await self.send_response({"success": True, "message": "Đăng xuất thành công."}, request_id, is_logout=True)
-                print(f"[DEBUG][ClientSession] Logout response sent, connection should remain alive")
-                print(f"[DEBUG][ClientSession] Final running state: {self.running}")
-                print(f"[DEBUG][ClientSession] ======= LOGOUT END =======")
-                # Do NOT set self.running = False - keep connection alive for re-login
-
-            elif action == "switch_user":
-                try:
-                    print(f"[DEBUG][ClientSession] ======= SWITCH_USER START =======")
-                    print(f"[DEBUG][ClientSession] Processing switch_user for user: {data['data'].get('username')}")
-                    
-                    # Simplified logic - just clear session without complex operations
-                    old_username = self.logged_in_username
-                    self.logged_in_username = None
-                    self.logged_in_user_id = None
-                    print(f"[ClientSession] User {old_username} switched user, session cleared")
-                    
-                    # Send simple response
-                    print(f"[DEBUG][ClientSession] Sending switch_user response")
-                    await self.send_response({"success": True, "message": "Chuyển user thành công."}, request_id)
-                    print(f"[DEBUG][ClientSession] Switch_user response sent successfully")
-                    print(f"[DEBUG][ClientSession] ======= SWITCH_USER END =======")
-                except Exception as switch_user_error:
-                    print(f"[ERROR][ClientSession] Switch user failed: {switch_user_error}")
-                    import traceback
-                    traceback.print_exc()
-                    # Send error response but keep connection alive
-                    try:
-                        await self.send_response({"success": False, "message": f"Switch user error: {switch_user_error}"}, request_id)
-                    except Exception as response_error:
-                        print(f"[ERROR] Failed to send error response: {response_error}")
-                    # Do NOT set self.running = False even on error
-
-            elif action == "test_connection":
-                print(f"[DEBUG][ClientSession] ======= TEST_CONNECTION =======")
-                print(f"[DEBUG][ClientSession] Simple test action received")
-                try:
-                    await self.send_response({"success": True, "message": "Test connection OK"}, request_id)
-                    print(f"[DEBUG][ClientSession] Test response sent successfully")
-                except Exception as test_error:
-                    print(f"[ERROR] Test connection error: {test_error}")
-                print(f"[DEBUG][ClientSession] ======= TEST_CONNECTION END =======")
-
-            elif action == "get_friends":
-                username = data["data"]["username"]
-                result = await self.friend_handler.get_friends(username)
-                await self.send_response(result, request_id)
-
-            elif action == "send_friend_request":
-                sender_username = data["data"]["sender_username"]
-                receiver_username = data["data"]["receiver_username"]
-                result = await self.friend_handler.add_friend(sender_username, receiver_username)
-                await self.send_response(result, request_id)
-
-            elif action == "get_friend_requests":
-                username = data["data"]["username"]
-                result = await self.friend_handler.get_friend_requests(username)
-                await self.send_response(result, request_id)
-
-            elif action == "get_sent_friend_requests":
-                username = data["data"]["username"]
-                print(f"[DEBUG] Server: get_sent_friend_requests for username={username}")
-                result = await self.friend_handler.get_sent_friend_requests(username)
-                print(f"[DEBUG] Server: get_sent_friend_requests result={result}")
-                await self.send_response(result, request_id)
-
-            elif action == "handle_friend_request":
-                from_username = data["data"]["from_username"]
-                to_username = data["data"]["to_username"]
-                action_param = data["data"]["action"]
-                result = await self.friend_handler.handle_friend_request(from_username, to_username, action_param)
-                await self.send_response(result, request_id)
-
-            elif action == "cancel_friend_request":
-                sender_username = data["data"]["sender_username"]
-                receiver_username = data["data"]["receiver_username"]
-                result = await self.friend_handler.cancel_friend_request(sender_username, receiver_username)
-                await self.send_response(result, request_id)
-
-            elif action == "remove_friend":
-                username = data["data"]["username"]
-                friend_name = data["data"]["friend_name"]
-                result = await self.friend_handler.remove_friend(username, friend_name)
-                await self.send_response(result, request_id)
-
-            elif action == "search_users":
-                query = data["data"]["query"]
-                result = await self.friend_handler.search_users(query)
-                await self.send_response(result, request_id)
-
-            elif action == "get_chat_history" and self.chat1v1_handler:
-                result = await self.chat1v1_handler.handle_message_request(self.reader, self.writer, data)
-                await self.send_response(result, request_id)
-
-            elif action == "create_group":
-                group_name = data["data"]["group_name"]
-                user_id = data["data"]["user_id"]
-                result = await self.group_handler.create_group(group_name, user_id)
-                await self.send_response(result, request_id)
-
-            elif action == "get_user_groups":
-                user_id = data["data"]["user_id"]
-                result = await self.group_handler.get_user_groups(user_id)
-                await self.send_response(result, request_id)
-
-            elif action == "add_user_to_group":
-                group_id = data["data"]["group_id"]
-                user_id = data["data"]["user_id"]
-                result = await self.group_handler.add_user_to_group(group_id, user_id)
-                await self.send_response(result, request_id)
-
-            elif action == "get_group_messages":
-                group_id = data["data"]["group_id"]
-                user_id = data["data"]["user_id"]
-                result = await self.group_handler.get_group_messages(group_id, user_id)
-                await self.send_response(result, request_id)
-
-            elif action == "send_group_message":
-                group_id = data["data"]["group_id"]
-                sender_id = data["data"]["sender_id"]
-                content = data["data"]["content"]
-                result = await self.group_handler.send_group_message(sender_id, group_id, content)  # Fixed parameter order
-                await self.send_response(result, request_id)
-
-            elif action == "leave_group":
-                group_id = data["data"]["group_id"]
-                user_id = data["data"]["user_id"]
-                result = await self.group_handler.leave_group(group_id, user_id)
-                await self.send_response(result, request_id)
-
-            elif action == "transfer_admin":
-                group_id = data["data"]["group_id"]
-                current_admin_id = data["data"]["current_admin_id"]
-                new_admin_id = data["data"]["new_admin_id"]
-                result = await self.group_handler.transfer_admin(group_id, current_admin_id, new_admin_id)
-                await self.send_response(result, request_id)
-
-            elif action == "get_group_members":
-                group_id = data["data"]["group_id"]
-                result = await self.group_handler.get_group_members_with_roles(group_id)
-                await self.send_response(result, request_id)
-
-            elif action == "join_group":
-                group_id = data["data"]["group_id"]
-                user_id = data["data"]["user_id"]
-                result = await self.group_handler.join_group(group_id, user_id)
-                await self.send_response(result, request_id)
-
-            elif action == "leave_group":
-                group_id = data["data"]["group_id"]
-                user_id = data["data"]["user_id"]
-                result = await self.group_handler.leave_group(group_id, user_id)
-                await self.send_response(result, request_id)
-
-            elif action == "transfer_leadership":
-                group_id = data["data"]["group_id"]
-                current_admin_id = data["data"]["current_admin_id"]
-                new_admin_id = data["data"]["new_admin_id"]
-                result = await self.group_handler.transfer_leadership(group_id, current_admin_id, new_admin_id)
-                await self.send_response(result, request_id)
-
-            elif action == "remove_member":
-                group_id = data["data"]["group_id"]
-                admin_id = data["data"]["admin_id"]
-                member_id = data["data"]["member_id"]
-                result = await self.group_handler.remove_member(group_id, admin_id, member_id)
-                await self.send_response(result, request_id)
-
-            elif action == "add_friend_to_group":
-                group_id = data["data"]["group_id"]
-                friend_id = data["data"]["friend_id"]
-                added_by = data["data"]["added_by"]
-                result = await self.group_handler.add_friend_to_group(group_id, friend_id, added_by)
-                await self.send_response(result, request_id)
-
-            elif action == "get_user_friends":
-                user_id = data["data"]["user_id"]
-                result = await self.group_handler.get_user_friends(user_id)
-                await self.send_response(result, request_id)
-
-            elif action == "send_message" and self.chat1v1_handler:
-                print(f"[DEBUG] Server received send_message: {data}")
-                result = await self.chat1v1_handler.handle_message_request(self.reader, self.writer, data)
-                await self.send_response(result, request_id)
-
-            elif action == "mark_as_read" and self.chat1v1_handler:
-                print(f"[DEBUG] Server received mark_as_read: {data}")
-                result = await self.chat1v1_handler.handle_message_request(self.reader, self.writer, data)
-                await self.send_response(result, request_id)
-
-            elif action == "send_file_message" and self.chat1v1_handler:
-                print(f"[DEBUG] Server received send_file_message: {data}")
-                result = await self.chat1v1_handler.handle_message_request(self.reader, self.writer, data)
-                await self.send_response(result, request_id)
-
-            elif action == "get_user_profile":
-                if self.user_profile_handler:
-                    print(f"[DEBUG] Processing get_user_profile action with handler: {self.user_profile_handler}")
-                    user_id = data["data"]["user_id"]
-                    print(f"[DEBUG] get_user_profile for user_id: {user_id}")
-                    result = await self.user_profile_handler.get_user_profile(user_id)
-                    print(f"[DEBUG] get_user_profile result: {result}")
-                    await self.send_response(result, request_id)
-                else:
-                    print("[ERROR] get_user_profile action but no user_profile_handler available")
-                    await self.send_response({"status": "error", "message": "User profile handler not available"}, request_id)
-
-            elif action == "get_mutual_groups":
-                if self.user_profile_handler:
-                    print(f"[DEBUG] Processing get_mutual_groups action with handler: {self.user_profile_handler}")
-                    user1_id = data["data"]["user1_id"]
-                    user2_id = data["data"]["user2_id"]
-                    print(f"[DEBUG] get_mutual_groups for user1_id: {user1_id}, user2_id: {user2_id}")
-                    result = await self.user_profile_handler.get_mutual_groups(user1_id, user2_id)
-                    print(f"[DEBUG] get_mutual_groups result: {result}")
-                    await self.send_response(result, request_id)
-                else:
-                    print("[ERROR] get_mutual_groups action but no user_profile_handler available")
-                    await self.send_response({"status": "error", "message": "User profile handler not available"}, request_id)
-
-            elif action == "update_user_profile" and self.user_profile_handler:
-                user_id = data["data"]["user_id"]
-                profile_data = data["data"]  # All profile data is in data directly
-                result = await self.user_profile_handler.update_user_profile(user_id, profile_data)
-                await self.send_response(result, request_id)
-
-            elif action == "upload_avatar" and self.user_profile_handler:
-                user_id = data["data"]["user_id"]
-                avatar_data = data["data"]["avatar_data"]
-                filename = data["data"]["filename"]
-                result = await self.user_profile_handler.upload_avatar(user_id, avatar_data, filename)
-                await self.send_response(result, request_id)
-
-            elif action == "delete_avatar" and self.user_profile_handler:
-                user_id = data["data"]["user_id"]
-                result = await self.user_profile_handler.delete_avatar(user_id)
-                await self.send_response(result, request_id)
-
-            else:
-                await self.send_response({"success": False, "message": f"Unknown action: {action}"}, request_id)
+            result = await router.dispatch(self, data)
+            if result is not None:
+                # Không đóng kết nối nếu gửi phản hồi logout thất bại
+                await self.send_response(result, request_id, is_logout=(action == "logout"))
 
         except json.JSONDecodeError:
             await self.send_response({"success": False, "message": "Invalid JSON"}, request_id)
         except Exception as e:
             await self.send_response({"success": False, "message": f"Server error: {e}"}, request_id)
 
-                   
-         
\ No newline at end of file
+
+# ---------------------------
+# Action gắn với trạng thái session
+# ---------------------------
+@router.route("ping")
+async def handle_ping(session, payload):
+    print(f"💓 Ping từ {session.client_address} ({payload.get('username')})")
+    session.last_ping_time = time.time()
+    return None  # ping không cần phản hồi
+
+
+@router.route("login", "username", "password")
+async def handle_login(session, payload):
+    username = payload["username"]
+    result = await login.login_user(username, payload["password"])
+
+    if result and result.get("success"):
+        user_id = result.get("user_id")
+        # Đăng nhập lại trên cùng kết nối -> gỡ phiên cũ trước
+        session.unregister_session()
+        session.logged_in_username = username
+        session.logged_in_user_id = str(user_id)
+
+        # Mỗi kết nối là một phiên riêng; user có thể online trên nhiều thiết bị
+        session.session_id = registry.register(
+            user_id, username, session.outbound,
+            device=payload.get("device"), client_address=session.client_address,
+        )
+        # Token để kết nối lại bằng "resume" thay vì gửi lại mật khẩu
+        result["resume_token"] = resume_tokens.issue(user_id, username)
+        # Điểm bắt đầu cho "sync" nếu sau này mất kết nối
+        result["sync_cursor"] = await delta_sync.current_cursors(user_id)
+    return result
+
+
+@router.route("resume", "resume_token")
+async def handle_resume(session, payload):
+    """
+    Nối lại phiên sau khi mất kết nối: kiểm tra token, đăng ký lại vào registry và chỉ trả
+    các cuộc trò chuyện có tin mới hơn last_private_message_id / last_group_message_id
+    (cộng badge hiện tại), client không phải đăng nhập và tải lại toàn bộ.
+    """
+    claims = resume_tokens.verify(payload["resume_token"])
+    if claims is None:
+        return {"success": False, "message": "Resume token không hợp lệ hoặc đã hết hạn"}
+    user_id = claims["uid"]
+    username = await user_directory.get_username(user_id)
+    if username is None:
+        return {"success": False, "message": "Tài khoản không tồn tại."}
+
+    session.unregister_session()
+    session.logged_in_username = username
+    session.logged_in_user_id = str(user_id)
+    session.session_id = registry.register(
+        user_id, username, session.outbound,
+        device=payload.get("device"), client_address=session.client_address,
+    )
+
+    cursors = {
+        "user": int(payload.get("last_private_message_id") or 0),
+        "group": int(payload.get("last_group_message_id") or 0),
+    }
+    inbox, badges = await asyncio.gather(
+        conversation_summaries.get_inbox(user_id), unread_counters.get_badges(user_id)
+    )
+    changed = [entry for entry in inbox if (entry["last_message_id"] or 0) > cursors[entry["type"]]]
+    return {
+        "success": True,
+        "user_id": user_id,
+        "username": username,
+        "resume_token": resume_tokens.issue(user_id, username),
+        "changes": {"inbox": changed, "unread": badges},
+    }
+
+
+@router.route("register", "username", "password", "email")
+async def handle_register(session, payload):
+    result = await register.register_user(payload["username"], payload["password"], payload["email"])
+    session.running = False  # Phiên đăng ký kết thúc sau khi phản hồi
+    return result
+
+
+@router.route("logout")
+async def handle_logout(session, payload):
+    session.unregister_session()
+    if payload.get("resume_token"):
+        resume_tokens.revoke(payload["resume_token"])
+
+    # Clear user session data but keep connection alive for re-login
+    old_username = session.logged_in_username
+    session.logged_in_username = None
+    session.logged_in_user_id = None
+    print(f"[ClientSession] User {old_username} logged out, session cleared but connection maintained")
+    return {"success": True, "message": "Đăng xuất thành công."}
+
+
+@router.route("switch_user")
+async def handle_switch_user(session, payload):
+    session.unregister_session()
+    if payload.get("resume_token"):
+        resume_tokens.revoke(payload["resume_token"])
+    old_username = session.logged_in_username
+    session.logged_in_username = None
+    session.logged_in_user_id = None
+    print(f"[ClientSession] User {old_username} switched user, session cleared")
+    return {"success": True, "message": "Chuyển user thành công."}
+
+
+@router.route("test_connection")
+async def handle_test_connection(session, payload):
+    return {"success": True, "message": "Test connection OK"}
+
+
+@router.route("get_unread_counts")
+async def handle_get_unread_counts(session, payload):
+    """Mọi badge tin chưa đọc của user hiện tại trong một lần gọi"""
+    if not session.logged_in_user_id:
+        return {"success": False, "message": "Cần đăng nhập"}
+    return {"success": True, "data": await unread_counters.get_badges(session.logged_in_user_id)}
+
+
+@router.route("bootstrap")
+async def handle_bootstrap(session, payload):
+    """
+    Snapshot sau đăng nhập trong một round trip: profile, bạn bè, lời mời, nhóm, inbox.
+    Các truy vấn chạy song song trên pool; phần nào lỗi thì chỉ phần đó trả status error.
+    """
+    if not session.logged_in_user_id:
+        return {"success": False, "message": "Cần đăng nhập"}
+    user_id, username = session.logged_in_user_id, session.logged_in_username
+
+    async def inbox():
+        return {"success": True, "data": await conversation_summaries.get_inbox(user_id)}
+
+    sections = {
+        "groups": group_handler.get_user_groups(user_id),
+        "inbox": inbox(),
+        "profile": session.user_profile_handler.get_user_profile(user_id),
+        "friends": session.friend_handler.get_friends(username),
+        "friend_requests": session.friend_handler.get_friend_requests(username),
+        "sent_requests": session.friend_handler.get_sent_friend_requests(username),
+    }
+
+    results = await asyncio.gather(*sections.values(), return_exceptions=True)
+    snapshot = {}
+    for name, result in zip(sections, results):
+        if isinstance(result, Exception):
+            print(f"❌ bootstrap: lỗi phần {name}: {result}")
+            result = {"status": "error", "message": str(result)}
+        snapshot[name] = result
+    return {"success": True, "data": snapshot}
+
+
+@router.route("sync")
+async def handle_sync(session, payload):
+    """
+    Tin mới hơn cursor của client (private_after / group_after) trên mọi cuộc trò chuyện,
+    một chunk mỗi lần gọi; client gọi tiếp với private_cursor / group_cursor khi has_more.
+    Chunk đầu gửi rescan=True để quét lại một đoạn trước cursor (tin commit muộn).
+    """
+    if not session.logged_in_user_id:
+        return {"success": False, "message": "Cần đăng nhập"}
+    data = await delta_sync.fetch(
+        session.logged_in_user_id, payload.get("private_after"), payload.get("group_after"),
+        payload.get("limit", SYNC_CHUNK_SIZE), rescan=bool(payload.get("rescan")),
+    )
+    return {"success": True, "data": data}
+
+
+@router.route("get_inbox")
+async def handle_get_inbox(session, payload):
+    """Mọi cuộc trò chuyện 1-1 và nhóm của user hiện tại: tin cuối, thời gian, số tin chưa đọc"""
+    if not session.logged_in_user_id:
+        return {"success": False, "message": "Cần đăng nhập"}
+    return {"success": True, "data": await conversation_summaries.get_inbox(session.logged_in_user_id)}
+
+
+@router.route("get_server_stats")
+async def handle_get_server_stats(session, payload):
+    """Thống kê count/errors/histogram độ trễ theo action cho ops"""
+    if not session.logged_in_user_id:
+        return {"success": False, "message": "Cần đăng nhập"}
+    return {"success": True, "data": {"actions": router.get_stats(), "fanout": fanout.get_stats(),
+                                       "sessions": registry.get_stats(), "db_pool": db.get_stats(),
+                                       "user_directory": user_directory.get_stats(),
+                                       "group_members": group_members.get_stats(),
+                                       "unread_counters": unread_counters.get_stats(),
+                                       "read_watermarks": read_watermarks.get_stats(),
+                                       "resume_tokens": resume_tokens.get_stats(),
+                                       "uploads": session.upload_manager.get_stats(),
+                                       "media_stream": media_streamer.get_stats(),
+                                       "private_writes": session.chat1v1_handler.get_write_stats(),
+                                       "hot_tail": session.chat1v1_handler.get_hot_tail_stats()}}
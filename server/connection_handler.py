@@ -1,35 +1,62 @@
 # server/connection_handler_async.py
 import asyncio
+import os
 from client_session import ClientSession
+from database.db import db
+from HandleChat1_1.chat_handler import chat_handler
+from image_pipeline import image_pipeline
+from read_watermarks import read_watermarks
 
 
 class ConnectionHandlerAsync:
-    def __init__(self, host="127.0.0.1", port=9000):
+    def __init__(self, host="127.0.0.1", port=9000, concurrent_requests=True, max_inflight_requests=8,
+                 write_behind=False):
         self.host = host
         self.port = port
         self.server = None
+        # Cho phép mỗi session xử lý nhiều request cùng lúc
+        self.concurrent_requests = concurrent_requests
+        self.max_inflight_requests = max_inflight_requests
+        # Group-commit cho INSERT tin nhắn 1-1 (flush theo batch, ack sau khi batch chứa tin commit)
+        self.write_behind = write_behind
 
     async def handle_client(self, reader, writer):
         client_address = writer.get_extra_info("peername")
         print(f"🔗 New connection from {client_address}")
 
         # Tạo ClientSession async
-        client_session = ClientSession(reader, writer, client_address)
+        client_session = ClientSession(
+            reader, writer, client_address,
+            concurrent_requests=self.concurrent_requests,
+            max_inflight_requests=self.max_inflight_requests,
+        )
         await client_session.run()  # giả sử ClientSession cũng được viết async
 
     async def start(self):
+        # Tạo pool MySQL dùng chung ngay khi start, không đợi query đầu tiên
+        await db.connect()
+        if self.write_behind:
+            chat_handler.enable_write_behind()
+
         self.server = await asyncio.start_server(
             self.handle_client, self.host, self.port
         )
         addr = self.server.sockets[0].getsockname()
         print(f"📡 Async Server listening on {addr}")
 
-        async with self.server:
-            await self.server.serve_forever()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            # Flush nốt tin nhắn / read receipt đang chờ trước khi đóng pool
+            await chat_handler.close_write_behind()
+            await read_watermarks.close()
+            await db.disconnect()
+            image_pipeline.shutdown()
 
 
 # Khởi tạo server
-server = ConnectionHandlerAsync()
+server = ConnectionHandlerAsync(write_behind=os.environ.get("PYCTALK_WRITE_BEHIND") == "1")
 
 
 if __name__ == "__main__":
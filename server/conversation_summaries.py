@@ -0,0 +1,108 @@
+# server/conversation_summaries.py
+from database.db import db
+
+
+PREVIEW_LENGTH = 100   # ký tự preview lưu trong bảng tóm tắt
+INBOX_LIMIT = 200      # số cuộc trò chuyện tối đa mỗi lần get_inbox
+
+# Chỉ ghi đè khi tin mới hơn (hai tin cùng giây: tin đến sau thắng)
+UPSERT_SQL = (
+    "INSERT INTO conversation_summaries "
+    "(user_id, peer_type, peer_id, last_message_id, last_sender_id, last_preview, last_message_type, last_time) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE "
+    "last_message_id = IF(VALUES(last_time) >= last_time, VALUES(last_message_id), last_message_id), "
+    "last_sender_id = IF(VALUES(last_time) >= last_time, VALUES(last_sender_id), last_sender_id), "
+    "last_preview = IF(VALUES(last_time) >= last_time, VALUES(last_preview), last_preview), "
+    "last_message_type = IF(VALUES(last_time) >= last_time, VALUES(last_message_type), last_message_type), "
+    "last_time = GREATEST(last_time, VALUES(last_time))"
+)
+
+
+def make_preview(content, message_type="text", file_name=None) -> str:
+    """Nội dung rút gọn cho sidebar: text hoặc caption, không có thì tên file"""
+    text = (content or "").strip() or (file_name or "")
+    if len(text) > PREVIEW_LENGTH:
+        text = text[:PREVIEW_LENGTH - 1] + "…"
+    return text
+
+
+class ConversationSummaries:
+    """
+    Bảng tóm tắt phi chuẩn hóa: mỗi (user, cuộc trò chuyện) một dòng với tin cuối cùng,
+    cập nhật ở mỗi lần ghi tin nhắn. Inbox của user là một truy vấn theo index
+    (user_id, last_time) thay vì một truy vấn cho mỗi bạn/nhóm.
+    """
+
+    @staticmethod
+    def private_rows(sender_id, recipient_id, message_id, preview, message_type, time_send) -> list:
+        """Tin 1-1: dòng của cả người gửi và người nhận"""
+        sender_id, recipient_id = int(sender_id), int(recipient_id)
+        return [
+            (sender_id, "user", recipient_id, message_id, sender_id, preview, message_type, time_send),
+            (recipient_id, "user", sender_id, message_id, sender_id, preview, message_type, time_send),
+        ]
+
+    @staticmethod
+    def group_rows(group_id, member_ids, sender_id, message_id, preview, message_type, time_send) -> list:
+        """Tin nhóm: dòng của mọi thành viên (kể cả người gửi)"""
+        group_id, sender_id = int(group_id), int(sender_id)
+        return [
+            (int(uid), "group", group_id, message_id, sender_id, preview, message_type, time_send)
+            for uid in member_ids
+        ]
+
+    async def write(self, tx, rows):
+        """Upsert các dòng (private_rows / group_rows) bằng một executemany trong transaction của người gọi"""
+        if rows:
+            # Theo khóa rồi theo id tin: thứ tự khóa cố định, tin mới hơn của cùng khóa ghi sau
+            await tx.executemany(UPSERT_SQL, sorted(rows, key=lambda row: (row[0], row[1], row[2], row[3])))
+
+    async def forget(self, user_id, peer_type, peer_id):
+        """Bỏ cuộc trò chuyện khỏi inbox của user (vd. rời nhóm / bị kick)"""
+        await db.execute(
+            "DELETE FROM conversation_summaries WHERE user_id = %s AND peer_type = %s AND peer_id = %s",
+            (user_id, peer_type, peer_id)
+        )
+
+    async def forget_group(self, group_id):
+        """Nhóm bị giải tán. Không có index theo peer nên chỉ dùng cho thao tác hiếm này."""
+        await db.execute(
+            "DELETE FROM conversation_summaries WHERE peer_type = 'group' AND peer_id = %s",
+            (group_id,)
+        )
+
+    async def get_inbox(self, user_id, limit=INBOX_LIMIT) -> list:
+        """Mọi cuộc trò chuyện của user, mới hoạt động nhất trước, kèm preview và số tin chưa đọc"""
+        rows = await db.fetch_all(
+            """SELECT cs.peer_type, cs.peer_id, cs.last_message_id, cs.last_sender_id, cs.last_preview,
+                      cs.last_message_type, cs.last_time, COALESCE(uc.unread, 0) AS unread,
+                      COALESCE(u.username, g.group_name) AS peer_name
+               FROM conversation_summaries cs
+               LEFT JOIN unread_counters uc
+                      ON uc.user_id = cs.user_id AND uc.peer_type = cs.peer_type AND uc.peer_id = cs.peer_id
+               LEFT JOIN users u ON cs.peer_type = 'user' AND u.id = cs.peer_id
+               LEFT JOIN group_chat g ON cs.peer_type = 'group' AND g.group_id = cs.peer_id
+               WHERE cs.user_id = %s
+               ORDER BY cs.last_time DESC
+               LIMIT %s""",
+            (user_id, limit)
+        )
+        return [
+            {
+                "type": row["peer_type"],
+                "peer_id": row["peer_id"],
+                "peer_name": row["peer_name"],
+                "last_message_id": row["last_message_id"],
+                "last_sender_id": row["last_sender_id"],
+                "last_message": row["last_preview"],
+                "last_message_type": row["last_message_type"],
+                "last_message_time": row["last_time"].strftime("%Y-%m-%d %H:%M:%S") if row["last_time"] else None,
+                "unread_count": int(row["unread"]),
+            }
+            for row in rows
+        ]
+
+
+# Dùng chung cho toàn server
+conversation_summaries = ConversationSummaries()
@@ -0,0 +1,144 @@
+# server/delta_sync.py
+import asyncio
+
+from database.db import db
+from pagination import clamp_limit
+
+
+SYNC_CHUNK_SIZE = 200   # tin tối đa mỗi luồng (1-1 / nhóm) trong một lần "sync"
+# id AUTO_INCREMENT được cấp lúc INSERT nhưng chỉ thấy được lúc commit: transaction đồng thời (hoặc batch
+# write-behind) có thể commit id nhỏ hơn sau khi client đã sync/nhận push qua id lớn hơn. Chunk đầu của mỗi
+# lần sync quét lại chừng này id trước cursor; client bỏ tin trùng theo message_id.
+SYNC_OVERLAP_IDS = 1000
+
+
+def private_push_format(row) -> dict:
+    """Dòng private_messages -> cùng dạng với push new_message, client dùng chung handler"""
+    timestamp = row["time_send"].strftime("%Y-%m-%d %H:%M:%S") if row["time_send"] else None
+    return {
+        "id": row["message_private_id"],
+        "message_id": row["message_private_id"],
+        "from": str(row["sender_id"]),
+        "to": str(row["receiver_id"]),
+        "sender_name": row["sender_name"],
+        "message": row["content"],
+        "content": row["content"],
+        "type": row["message_type"] or "text",
+        "message_type": row["message_type"] or "text",
+        "file_path": row["file_path"],
+        "file_name": row["file_name"],
+        "file_size": row["file_size"],
+        "mime_type": row["mime_type"],
+        "thumbnail_path": row["thumbnail_path"],
+        "timestamp": timestamp,
+    }
+
+
+def group_push_format(row) -> dict:
+    """Dòng group_messages -> cùng dạng với push new_group_message"""
+    return {
+        "message_id": row["message_group_id"],
+        "sender_id": row["sender_id"],
+        "group_id": row["group_id"],
+        "content": row["content"],
+        "time_send": row["time_send"].isoformat() if row["time_send"] else None,
+        "sender_name": row["sender_name"],
+    }
+
+
+class DeltaSync:
+    """
+    Đồng bộ tin bị lỡ sau khi mất kết nối theo cursor toàn cục của user: id tin 1-1 và
+    id tin nhóm lớn nhất client đã thấy (id tự tăng nên "mới hơn" = id lớn hơn).
+    Mỗi lần gọi trả một chunk tăng dần theo id; client gọi tiếp với cursor mới tới khi has_more = False.
+    rescan=True (chunk đầu) lùi SYNC_OVERLAP_IDS id để lấy cả tin commit muộn với id nhỏ hơn cursor.
+    """
+
+    async def current_cursors(self, user_id) -> dict:
+        """
+        Cursor khởi đầu lúc đăng nhập: id tin lớn nhất user thấy được (mọi tin trước đó đã được trang
+        lịch sử đầu tiên phủ). Lấy theo user, không lấy MAX toàn bảng: client không biết được lưu lượng
+        tin của cả server, và sync quét lại không lùi vào tin của người khác. Mỗi MAX là một lần đọc
+        cuối index (idx_sender_id / idx_receiver_id kèm PK, khóa group_id của group_messages).
+        """
+        user_id = int(user_id)
+        sent_row, received_row, group_row = await asyncio.gather(
+            db.fetch_one("SELECT MAX(message_private_id) AS last_id FROM private_messages WHERE sender_id = %s",
+                         (user_id,)),
+            db.fetch_one("SELECT MAX(message_private_id) AS last_id FROM private_messages WHERE receiver_id = %s",
+                         (user_id,)),
+            db.fetch_one(
+                """SELECT MAX(gm.message_group_id) AS last_id
+                   FROM group_members mb JOIN group_messages gm ON gm.group_id = mb.group_id
+                   WHERE mb.user_id = %s""",
+                (user_id,)
+            ),
+        )
+
+        def last_id(row):
+            return int(row["last_id"] or 0) if row else 0
+
+        return {
+            "private": max(last_id(sent_row), last_id(received_row)),
+            "group": last_id(group_row),
+        }
+
+    async def fetch(self, user_id, private_after=0, group_after=0, limit=SYNC_CHUNK_SIZE, rescan=False) -> dict:
+        user_id = int(user_id)
+        private_after, group_after = int(private_after or 0), int(group_after or 0)
+        limit = clamp_limit(limit, default=SYNC_CHUNK_SIZE)
+        overlap = SYNC_OVERLAP_IDS if rescan else 0
+
+        private_rows, group_rows = await asyncio.gather(
+            self._private_since(user_id, max(0, private_after - overlap), limit),
+            self._group_since(user_id, max(0, group_after - overlap), limit),
+        )
+        private_more, group_more = len(private_rows) > limit, len(group_rows) > limit
+        private_rows, group_rows = private_rows[:limit], group_rows[:limit]
+        return {
+            "private": [private_push_format(row) for row in private_rows],
+            "groups": [group_push_format(row) for row in group_rows],
+            # Còn tin: đi tiếp từ dòng cuối (kể cả khi vẫn nằm trong đoạn quét lại); hết: không lùi cursor
+            "private_cursor": self._next_cursor(private_rows, "message_private_id", private_after, private_more),
+            "group_cursor": self._next_cursor(group_rows, "message_group_id", group_after, group_more),
+            "has_more": private_more or group_more,
+        }
+
+    @staticmethod
+    def _next_cursor(rows, id_column, after, more):
+        last_id = rows[-1][id_column] if rows else 0
+        return last_id if more else max(after, last_id)
+
+    async def _private_since(self, user_id, after_id, limit):
+        # Hai nhánh theo idx_receiver_id / idx_sender_id (user, id), mỗi nhánh đã dừng ở limit + 1
+        columns = ("pm.message_private_id, pm.sender_id, pm.receiver_id, pm.content, pm.time_send, "
+                   "pm.message_type, pm.file_path, pm.file_name, pm.file_size, pm.mime_type, "
+                   "pm.thumbnail_path, u.username AS sender_name")
+        return await db.fetch_all(
+            f"""(SELECT {columns} FROM private_messages pm JOIN users u ON u.id = pm.sender_id
+                 WHERE pm.receiver_id = %s AND pm.message_private_id > %s
+                 ORDER BY pm.message_private_id LIMIT %s)
+                UNION ALL
+                (SELECT {columns} FROM private_messages pm JOIN users u ON u.id = pm.sender_id
+                 WHERE pm.sender_id = %s AND pm.receiver_id <> pm.sender_id AND pm.message_private_id > %s
+                 ORDER BY pm.message_private_id LIMIT %s)
+                ORDER BY message_private_id LIMIT %s""",
+            (user_id, after_id, limit + 1, user_id, after_id, limit + 1, limit + 1)
+        )
+
+    async def _group_since(self, user_id, after_id, limit):
+        # Khóa group_id của group_messages (kèm PK) cho phép quét theo id trong từng nhóm của user
+        return await db.fetch_all(
+            """SELECT gm.message_group_id, gm.sender_id, gm.group_id, gm.content, gm.time_send,
+                      u.username AS sender_name
+               FROM group_members mb
+               JOIN group_messages gm ON gm.group_id = mb.group_id AND gm.message_group_id > %s
+               JOIN users u ON u.id = gm.sender_id
+               WHERE mb.user_id = %s
+               ORDER BY gm.message_group_id LIMIT %s""",
+            (after_id, user_id, limit + 1)
+        )
+
+
+# Dùng chung cho toàn server
+delta_sync = DeltaSync()
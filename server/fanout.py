@@ -0,0 +1,65 @@
+# server/fanout.py
+import asyncio
+
+
+MAX_CONCURRENT_FANOUTS = 8   # Số job fan-out chạy cùng lúc trên toàn server
+FANOUT_CHUNK_SIZE = 256      # Số người nhận xử lý trước khi nhường event loop
+
+
+class FanOut:
+    """
+    Đẩy một frame đã encode sẵn tới nhiều hàng đợi gửi (OutboundQueue).
+    Frame được encode một lần và dùng chung bytes cho mọi người nhận;
+    mỗi job chạy nền nên không chặn phản hồi cho người gửi.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_FANOUTS, chunk_size=FANOUT_CHUNK_SIZE):
+        self.max_concurrent = max_concurrent
+        self.chunk_size = chunk_size
+        self._slots = None   # Tạo lazy trong event loop đang chạy
+        self._tasks = set()
+
+        # Thống kê
+        self.jobs_started = 0
+        self.frames_enqueued = 0
+        self.frames_dropped = 0
+
+    def publish(self, frame: bytes, resolve_recipients):
+        """
+        Lên lịch fan-out nền. resolve_recipients: coroutine trả về list OutboundQueue
+        (để cả việc tra cứu người nhận cũng không chạy trong request của người gửi).
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        task = asyncio.create_task(self._run(frame, resolve_recipients))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, frame, resolve_recipients):
+        async with self._slots:
+            self.jobs_started += 1
+            try:
+                recipients = await resolve_recipients
+            except Exception as e:
+                print(f"❌ Fan-out: không lấy được danh sách người nhận: {e}")
+                return
+            for index, outbound in enumerate(recipients, 1):
+                if outbound.enqueue(frame):
+                    self.frames_enqueued += 1
+                else:
+                    self.frames_dropped += 1
+                if index % self.chunk_size == 0:
+                    await asyncio.sleep(0)  # Nhường loop cho request khác
+
+    def get_stats(self) -> dict:
+        return {
+            "jobs_started": self.jobs_started,
+            "jobs_running": len(self._tasks),
+            "frames_enqueued": self.frames_enqueued,
+            "frames_dropped": self.frames_dropped,
+        }
+
+
+# Instance dùng chung cho toàn server
+fanout = FanOut()
@@ -0,0 +1,163 @@
+# server/group_membership.py
+import asyncio
+import time
+from collections import OrderedDict
+
+from database.db import db
+
+
+MAX_CACHED_GROUPS = 5000       # LRU theo nhóm
+MAX_CACHED_MEMBERS = 500000    # Tổng số (nhóm, thành viên) giữ trong RAM
+MAX_AGE = 600                  # giây: nạp lại nhóm từ DB sau chừng này, kể cả khi write-through bỏ sót
+
+
+class GroupMembershipCache:
+    """
+    group_id -> {user_id: role}. Nạp từ DB ở lần truy cập đầu, sau đó
+    join/leave/kick/transfer cập nhật write-through (sau khi DB commit).
+    Nhóm chưa có trong cache thì không cần cập nhật: lần đọc sau sẽ nạp lại.
+    Mỗi nhóm được nạp lại sau max_age giây nên một entry sai (ghi bị bỏ sót) tự sửa.
+    """
+
+    def __init__(self, max_groups=MAX_CACHED_GROUPS, max_members=MAX_CACHED_MEMBERS, max_age=MAX_AGE):
+        self.max_groups = max_groups
+        self.max_members = max_members
+        self.max_age = max_age
+        self._groups = OrderedDict()   # {group_id: {user_id: role}}
+        self._loaded_at = {}           # {group_id: time.monotonic() lúc nạp}
+        self._member_count = 0
+        self._loading = {}             # {group_id: Future} - gộp các lần nạp đồng thời
+        self._stale = set()            # nhóm bị ghi trong lúc đang nạp -> không lưu kết quả nạp
+
+        # Thống kê
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------------------------
+    # Đọc
+    # ---------------------------
+    async def get_members(self, group_id) -> dict:
+        """{user_id: role} của nhóm (dict trống nếu nhóm không tồn tại). Không sửa dict trả về."""
+        group_id = int(group_id)
+        members = self._groups.get(group_id)
+        if members is not None and time.monotonic() - self._loaded_at.get(group_id, 0) > self.max_age:
+            self.drop_group(group_id)
+            members = None
+        if members is not None:
+            self.hits += 1
+            self._groups.move_to_end(group_id)
+            return members
+
+        self.misses += 1
+        loading = self._loading.get(group_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[group_id] = loading
+        try:
+            # Lỗi DB phải báo lên: cache {} sẽ từ chối mọi thành viên thật của nhóm
+            rows = await db.fetch_all(
+                "SELECT user_id, role FROM group_members WHERE group_id = %s", (group_id,), raise_errors=True
+            )
+            members = {int(row["user_id"]): row["role"] for row in rows}
+            if group_id in self._stale:
+                self._stale.discard(group_id)   # có ghi chen giữa -> dùng một lần, không cache
+            elif members:                       # nhóm không tồn tại / trống: không cache
+                self._store(group_id, members)
+            loading.set_result(members)
+            return members
+        except Exception as e:
+            loading.set_exception(e)
+            loading.exception()  # tránh cảnh báo "exception was never retrieved"
+            raise
+        finally:
+            self._loading.pop(group_id, None)
+
+    async def get_role(self, group_id, user_id):
+        """role của user trong nhóm, None nếu không phải thành viên"""
+        members = await self.get_members(group_id)
+        try:
+            return members.get(int(user_id))
+        except (TypeError, ValueError):
+            return None
+
+    async def is_member(self, group_id, user_id) -> bool:
+        return await self.get_role(group_id, user_id) is not None
+
+    # ---------------------------
+    # Write-through (gọi sau khi DB đã commit)
+    # ---------------------------
+    def set_group(self, group_id, members: dict):
+        """Nhóm vừa tạo: biết đủ thành viên nên cache luôn"""
+        self._store(int(group_id), {int(uid): role for uid, role in members.items()})
+
+    def add_member(self, group_id, user_id, role="member"):
+        members = self._writable(group_id)
+        if members is not None and int(user_id) not in members:
+            members[int(user_id)] = role
+            self._member_count += 1
+            self._enforce_limits()
+
+    def set_role(self, group_id, user_id, role):
+        members = self._writable(group_id)
+        if members is not None and int(user_id) in members:
+            members[int(user_id)] = role
+
+    def remove_member(self, group_id, user_id):
+        members = self._writable(group_id)
+        if members is not None and members.pop(int(user_id), None) is not None:
+            self._member_count -= 1
+
+    def drop_group(self, group_id):
+        group_id = int(group_id)
+        if group_id in self._loading:
+            self._stale.add(group_id)
+        members = self._groups.pop(group_id, None)
+        self._loaded_at.pop(group_id, None)
+        if members is not None:
+            self._member_count -= len(members)
+
+    # ---------------------------
+    # Nội bộ
+    # ---------------------------
+    def _writable(self, group_id):
+        group_id = int(group_id)
+        if group_id in self._loading:
+            self._stale.add(group_id)
+        return self._groups.get(group_id)
+
+    def _store(self, group_id, members):
+        old = self._groups.pop(group_id, None)
+        if old is not None:
+            self._member_count -= len(old)
+        self._groups[group_id] = members
+        self._loaded_at[group_id] = time.monotonic()
+        self._member_count += len(members)
+        self._enforce_limits()
+
+    def _enforce_limits(self):
+        while self._groups and (len(self._groups) > self.max_groups or self._member_count > self.max_members):
+            group_id, members = self._groups.popitem(last=False)
+            self._loaded_at.pop(group_id, None)
+            self._member_count -= len(members)
+            self.evictions += 1
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "groups": len(self._groups),
+            "members": self._member_count,
+            "max_groups": self.max_groups,
+            "max_members": self.max_members,
+            "max_age": self.max_age,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+        }
+
+
+# Cache dùng chung cho toàn server
+group_members = GroupMembershipCache()
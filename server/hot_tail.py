@@ -0,0 +1,190 @@
+# server/hot_tail.py
+import sys
+from bisect import insort
+from collections import OrderedDict, deque
+
+
+MESSAGES_PER_CONVERSATION = 100     # Ring buffer: N tin mới nhất mỗi cuộc trò chuyện
+MAX_CONVERSATIONS = 20000           # LRU theo cuộc trò chuyện
+MAX_CACHE_BYTES = 64 * 1024 * 1024  # Ngân sách bộ nhớ (ước lượng) cho toàn bộ cache
+
+
+class CachedMessage:
+    """Một dòng private_messages ở dạng gọn (__slots__, không có dict mỗi tin)"""
+
+    __slots__ = ("message_private_id", "sender_id", "receiver_id", "content", "time_send",
+                 "message_type", "file_path", "file_name", "file_size", "mime_type", "thumbnail_path")
+
+    def __init__(self, message_private_id, sender_id, receiver_id, content, time_send, message_type="text",
+                 file_path=None, file_name=None, file_size=None, mime_type=None, thumbnail_path=None):
+        self.message_private_id = int(message_private_id)
+        self.sender_id = int(sender_id)
+        self.receiver_id = int(receiver_id)
+        self.content = content
+        self.time_send = time_send
+        self.message_type = message_type
+        self.file_path = file_path
+        self.file_name = file_name
+        self.file_size = file_size
+        self.mime_type = mime_type
+        self.thumbnail_path = thumbnail_path
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(**{name: row.get(name) for name in cls.__slots__})
+
+    def as_row(self) -> dict:
+        """Dict cùng dạng với dòng SELECT từ DB, để handler dùng chung code dựng response"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @property
+    def key(self):
+        return (self.time_send, self.message_private_id)
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def size_bytes(self) -> int:
+        size = sys.getsizeof(self)
+        for value in (self.content, self.file_path, self.file_name, self.mime_type, self.thumbnail_path):
+            if value is not None:
+                size += sys.getsizeof(value)
+        return size
+
+
+class _ConversationTail:
+    """
+    Các tin mới nhất của một cuộc trò chuyện, tăng dần theo (time_send, id).
+    Bất biến: chứa MỌI tin có key >= floor (floor None = chứa toàn bộ cuộc trò chuyện).
+    """
+
+    __slots__ = ("messages", "floor", "bytes")
+
+    def __init__(self, floor):
+        self.messages = deque()
+        self.floor = floor
+        self.bytes = 0
+
+
+class HotTailCache:
+    """
+    Hot-tail cache cho chat 1-1: ring buffer N tin cuối mỗi cuộc trò chuyện,
+    LRU theo cuộc trò chuyện + ngân sách bộ nhớ. Trang lịch sử đầu tiên đọc từ
+    đây khi đủ tin, không chạm MySQL.
+    """
+
+    def __init__(self, per_conversation=MESSAGES_PER_CONVERSATION, max_conversations=MAX_CONVERSATIONS,
+                 max_bytes=MAX_CACHE_BYTES):
+        self.per_conversation = per_conversation
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self._tails = OrderedDict()   # {(user_low, user_high): _ConversationTail}
+        self._bytes = 0
+
+        # Thống kê
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------------------------
+    # Ghi
+    # ---------------------------
+    def append(self, key, message: CachedMessage):
+        """Tin vừa commit vào DB. Tạo tail mới nếu cuộc trò chuyện chưa được cache."""
+        tail = self._tails.get(key)
+        if tail is None:
+            tail = self._tails[key] = _ConversationTail(floor=message.key)
+        elif tail.floor is not None and message.key < tail.floor:
+            return  # cũ hơn phần đang cache (commit trễ) - bỏ qua để giữ bất biến
+        self._tails.move_to_end(key)
+        self._insert(tail, message)
+        self._trim(tail)
+        self._enforce_limits()
+
+    def seed(self, key, messages, complete=False):
+        """
+        Nạp các tin mới nhất vừa đọc từ DB (thứ tự bất kỳ). complete=True khi DB trả về
+        toàn bộ cuộc trò chuyện. Tin đã có trong cache (append trong lúc query) được giữ.
+        """
+        messages = sorted(messages)
+        tail = self._tails.get(key)
+        if tail is None:
+            tail = self._tails[key] = _ConversationTail(floor=None)
+        else:
+            self._tails.move_to_end(key)
+        known = {m.message_private_id for m in tail.messages}
+        for message in messages:
+            if message.message_private_id not in known:
+                self._insert(tail, message)
+        if complete:
+            tail.floor = None
+        elif messages:
+            tail.floor = messages[0].key if tail.floor is None else min(tail.floor, messages[0].key)
+        self._trim(tail)
+        self._enforce_limits()
+
+    def invalidate(self, key):
+        tail = self._tails.pop(key, None)
+        if tail is not None:
+            self._bytes -= tail.bytes
+
+    # ---------------------------
+    # Đọc
+    # ---------------------------
+    def latest(self, key, limit):
+        """
+        limit + 1 tin mới nhất (mới -> cũ, giống ORDER BY ... DESC LIMIT limit + 1) nếu cache
+        đủ để trả lời chính xác, ngược lại None (cần đọc DB).
+        """
+        tail = self._tails.get(key)
+        if tail is None or (len(tail.messages) <= limit and tail.floor is not None):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._tails.move_to_end(key)
+        count = min(limit + 1, len(tail.messages))
+        return [tail.messages[-i] for i in range(1, count + 1)]
+
+    # ---------------------------
+    # Nội bộ
+    # ---------------------------
+    def _insert(self, tail, message):
+        if tail.messages and message.key < tail.messages[-1].key:
+            insort(tail.messages, message)   # commit không theo thứ tự id, hiếm
+        else:
+            tail.messages.append(message)
+        size = message.size_bytes()
+        tail.bytes += size
+        self._bytes += size
+
+    def _trim(self, tail):
+        while len(tail.messages) > self.per_conversation:
+            self._drop_oldest(tail)
+
+    def _drop_oldest(self, tail):
+        dropped = tail.messages.popleft()
+        size = dropped.size_bytes()
+        tail.bytes -= size
+        self._bytes -= size
+        # Tin cũ nhất còn lại trở thành floor mới
+        tail.floor = tail.messages[0].key if tail.messages else dropped.key
+
+    def _enforce_limits(self):
+        while self._tails and (len(self._tails) > self.max_conversations or self._bytes > self.max_bytes):
+            _, tail = self._tails.popitem(last=False)
+            self._bytes -= tail.bytes
+            self.evictions += 1
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "conversations": len(self._tails),
+            "messages": sum(len(tail.messages) for tail in self._tails.values()),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "per_conversation": self.per_conversation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+        }
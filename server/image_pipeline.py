@@ -0,0 +1,101 @@
+# server/image_pipeline.py
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+THUMBNAIL_WORKERS = int(os.environ.get("PYCTALK_THUMBNAIL_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+MAX_QUEUED = 64   # ảnh chờ tối đa; quá mức thì bỏ qua thumbnail (client hiển thị ảnh gốc)
+
+
+class ImagePipeline:
+    """
+    Tạo thumbnail (decode / resize / encode bằng PIL) trong process pool riêng: event loop chỉ
+    chờ kết quả, một ảnh PNG lớn không làm chậm tin nhắn của các client khác.
+    Tối đa `workers` ảnh chạy cùng lúc, tối đa `max_queued` ảnh chờ phía sau.
+    """
+
+    def __init__(self, workers=THUMBNAIL_WORKERS, max_queued=MAX_QUEUED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._executor = None
+        self._slots = None   # asyncio.Semaphore(workers), tạo khi có event loop
+
+        # Thống kê
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_wait_ms = 0.0
+        self.max_run_ms = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn: không fork process server đang có event loop + thread pool
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def thumbnail(self, image_path, thumbnail_path):
+        """metadata {thumbnail_path, width, height} hoặc None (lỗi / hàng đợi đầy)"""
+        from media_handler import make_thumbnail
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self.queued >= self.max_queued:
+            self.dropped += 1
+            return None
+
+        self.queued += 1
+        waiting = True
+        start = time.perf_counter()
+        try:
+            async with self._slots:
+                self.queued -= 1
+                waiting = False
+                started = time.perf_counter()
+                self.max_wait_ms = max(self.max_wait_ms, (started - start) * 1000)
+                try:
+                    # Đường dẫn tuyệt đối: worker là process riêng, không phụ thuộc cwd
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self._get_executor(), make_thumbnail,
+                        os.path.abspath(image_path), os.path.abspath(thumbnail_path)
+                    )
+                except BrokenProcessPool:
+                    # Worker chết (vd. ảnh làm tràn bộ nhớ): tạo pool mới cho ảnh sau
+                    self._executor = None
+                    raise
+                self.max_run_ms = max(self.max_run_ms, (time.perf_counter() - started) * 1000)
+                self.completed += 1
+                result["thumbnail_path"] = str(thumbnail_path)
+                return result
+        except Exception as e:
+            self.failed += 1
+            print(f"❌ Lỗi tạo thumbnail {image_path}: {e!r}")
+            return None
+        finally:
+            if waiting:
+                self.queued -= 1  # bị hủy khi đang chờ
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+            "max_run_ms": round(self.max_run_ms, 2),
+        }
+
+
+# Dùng chung cho toàn server
+image_pipeline = ImagePipeline()
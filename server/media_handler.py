@@ -6,6 +6,34 @@ from PIL import Image
 import hashlib
 from datetime import datetime
 
+
+THUMBNAIL_SIZE = (200, 200)
+
+
+def make_thumbnail(image_path, thumbnail_path, thumbnail_size=THUMBNAIL_SIZE):
+    """
+    Decode + resize + encode thumbnail JPEG. Hàm cấp module để chạy được trong process pool
+    (xem image_pipeline). Trả về metadata: thumbnail_path, width, height (kích thước ảnh gốc).
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size
+        # JPEG: decoder thu nhỏ 1/2..1/8 ngay lúc giải mã (DCT scaling), không decode đủ độ phân giải
+        img.draft('RGB', thumbnail_size)
+        # Định dạng khác: reduce (trung bình khối, rẻ) về khoảng 2x kích thước đích trước khi LANCZOS
+        factor = min(img.size[0] // (2 * thumbnail_size[0]), img.size[1] // (2 * thumbnail_size[1]))
+        if factor > 1:
+            img = img.reduce(factor)
+        
+        # Convert to RGB if necessary
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        
+        # Create thumbnail
+        img.thumbnail(thumbnail_size, Image.Resampling.LANCZOS)
+        img.save(thumbnail_path, 'JPEG', quality=85)
+    return {'thumbnail_path': str(thumbnail_path), 'width': width, 'height': height}
+
+
 class MediaHandler:
     """Handle file uploads, processing, and storage for chat media"""
     
@@ -14,6 +42,7 @@ class MediaHandler:
         self.images_dir = self.base_dir / "images"
         self.files_dir = self.base_dir / "files"
         self.thumbnails_dir = self.base_dir / "thumbnails"
+        self.store_dir = self.base_dir / "store"  # lưu theo nội dung: store/ab/cd/<sha256>
         
         # Create directories if they don't exist
         self._ensure_directories()
@@ -26,7 +55,7 @@ class MediaHandler:
         
     def _ensure_directories(self):
         """Create upload directories if they don't exist"""
-        for directory in [self.images_dir, self.files_dir, self.thumbnails_dir]:
+        for directory in [self.images_dir, self.files_dir, self.thumbnails_dir, self.store_dir]:
             directory.mkdir(parents=True, exist_ok=True)
             
     def _generate_unique_filename(self, original_filename):
@@ -40,10 +69,17 @@ class MediaHandler:
         """Calculate SHA-256 hash of file for deduplication"""
         hash_sha256 = hashlib.sha256()
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
                 hash_sha256.update(chunk)
         return hash_sha256.hexdigest()
         
+    def content_path(self, file_hash):
+        """
+        Đường dẫn lưu theo nội dung: cùng sha256 -> cùng một file trên đĩa, dù upload với đuôi nào.
+        Kiểu file (message_type, mime_type) lấy từ tên file gốc, đi theo tin nhắn.
+        """
+        return self.store_dir / file_hash[:2] / file_hash[2:4] / file_hash
+        
     def _determine_message_type(self, file_path):
         """Determine message type based on file extension"""
         ext = Path(file_path).suffix.lower()
@@ -56,36 +92,29 @@ class MediaHandler:
         else:
             return 'file'
             
-    def _create_thumbnail(self, image_path, thumbnail_size=(200, 200)):
-        """Create thumbnail for images"""
+    def thumbnail_path_for(self, image_path):
+        """thumb_<tên file gốc>.jpg - file trong store đặt tên theo sha256 nên thumbnail cũng dùng chung"""
+        return self.thumbnails_dir / f"thumb_{Path(image_path).stem}.jpg"
+            
+    def _create_thumbnail(self, image_path, thumbnail_size=THUMBNAIL_SIZE):
+        """Create thumbnail for images (đồng bộ; server dùng image_pipeline để không chặn event loop)"""
         try:
-            with Image.open(image_path) as img:
-                # Convert to RGB if necessary
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    img = img.convert('RGB')
-                
-                # Create thumbnail
-                img.thumbnail(thumbnail_size, Image.Resampling.LANCZOS)
-                
-                # Generate thumbnail filename
-                original_name = Path(image_path).stem
-                thumbnail_name = f"thumb_{original_name}.jpg"
-                thumbnail_path = self.thumbnails_dir / thumbnail_name
-                
-                # Save thumbnail
-                img.save(thumbnail_path, 'JPEG', quality=85)
-                return str(thumbnail_path)
+            return make_thumbnail(image_path, self.thumbnail_path_for(image_path), thumbnail_size)['thumbnail_path']
         except Exception as e:
             print(f"[ERROR][MediaHandler] Failed to create thumbnail: {e}")
             return None
             
-    def save_uploaded_file(self, source_file_path, original_filename):
+    def save_uploaded_file(self, source_file_path, original_filename, file_hash=None, move=False,
+                           create_thumbnail=True):
         """
         Save uploaded file and return metadata
         
         Args:
             source_file_path: Path to the temporary uploaded file
             original_filename: Original name of the file
+            file_hash: SHA-256 already computed while receiving (skip re-reading the file)
+            move: Move source into the store instead of copying (e.g. upload .part file)
+            create_thumbnail: Create missing thumbnail here; False when caller uses image_pipeline
             
         Returns:
             dict: File metadata including paths, type, size, etc.
@@ -96,37 +125,40 @@ class MediaHandler:
             if file_size > self.max_file_size:
                 raise ValueError(f"File size ({file_size} bytes) exceeds maximum allowed size ({self.max_file_size} bytes)")
             
-            # Determine message type and target directory
             message_type = self._determine_message_type(original_filename)
-            if message_type == 'image':
-                target_dir = self.images_dir
-            else:
-                target_dir = self.files_dir
-                
-            # Generate unique filename
-            unique_filename = self._generate_unique_filename(original_filename)
-            target_path = target_dir / unique_filename
+            file_hash = file_hash or self._get_file_hash(source_file_path)
+            target_path = self.content_path(file_hash)
             
-            # Copy file to target location
-            shutil.copy2(source_file_path, target_path)
+            # Cùng nội dung đã có trên đĩa thì dùng lại, không ghi thêm bản nào
+            if target_path.exists():
+                if move:
+                    os.remove(source_file_path)
+            else:
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                if move:
+                    os.replace(source_file_path, target_path)
+                else:
+                    shutil.copy2(source_file_path, target_path)
             
             # Get file info
             file_info = {
                 'message_type': message_type,
                 'file_path': str(target_path),
                 'file_name': original_filename,
-                'unique_filename': unique_filename,
+                'unique_filename': target_path.name,
                 'file_size': file_size,
                 'mime_type': self._get_mime_type(original_filename),
-                'file_hash': self._get_file_hash(target_path),
+                'file_hash': file_hash,
                 'thumbnail_path': None
             }
             
-            # Create thumbnail for images
+            # Create thumbnail for images (thumb_<sha256>.jpg: cũng dùng chung theo nội dung)
             if message_type == 'image':
-                thumbnail_path = self._create_thumbnail(target_path)
-                if thumbnail_path:
-                    file_info['thumbnail_path'] = thumbnail_path
+                existing = self.thumbnail_path_for(target_path)
+                if existing.exists():
+                    file_info['thumbnail_path'] = str(existing)
+                elif create_thumbnail:
+                    file_info['thumbnail_path'] = self._create_thumbnail(target_path)
                     
             return file_info
             
@@ -0,0 +1,160 @@
+# server/media_store.py
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from database.db import db
+
+
+def _remove_files(*paths):
+    for path in paths:
+        try:
+            if path:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class MediaStore:
+    """
+    Bảng media: mỗi nội dung (sha256) một dòng trỏ tới file duy nhất trên đĩa (MediaHandler.content_path).
+    media_grants ghi ai đã thật sự upload nội dung đó; một user chỉ được dùng/tải file mình đã upload
+    hoặc file nằm trong tin nhắn mình xem được - biết sha256 thôi thì không đủ.
+    ref_count = số tin nhắn đính kèm file; nội dung upload xong mà không tin nào dùng (ref_count = 0)
+    quá max_age thì collect_unreferenced xóa cả dòng lẫn file.
+    """
+
+    def __init__(self):
+        self._locks = {}   # {sha256: [asyncio.Lock, số người đang giữ/chờ]}
+        # Thống kê
+        self.hits = 0
+        self.stored = 0
+        self.collected = 0
+        self.denied = 0
+
+    @asynccontextmanager
+    async def locked(self, sha256):
+        """Tuần tự hóa commit upload và collect_unreferenced trên cùng một nội dung (file trên đĩa)"""
+        entry = self._locks.setdefault(sha256, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[sha256]
+
+    async def claim(self, user_id, sha256, size):
+        """
+        Upload trùng nội dung user đã có quyền (đã upload trước đó, hoặc nhận được trong tin nhắn):
+        trả dòng media {file_size, file_path, thumbnail_path}; ngược lại None
+        (client upload bình thường, commit vẫn dùng lại file trên đĩa nếu trùng).
+        """
+        async with db.transaction() as tx:
+            # Khóa dòng: collect_unreferenced không xóa được file giữa lúc kiểm tra và lúc trả về
+            row = await tx.fetch_one(
+                "SELECT file_size, file_path, thumbnail_path FROM media WHERE sha256 = %s FOR UPDATE", (sha256,)
+            )
+            if row is None or int(row["file_size"]) != int(size) or not os.path.exists(row["file_path"]):
+                return None
+            if not await self.can_access(user_id, row["file_path"]):
+                return None
+            # Chưa tin nào dùng: tính lại hạn dọn từ bây giờ (client sắp gửi tin đính kèm)
+            await tx.execute("UPDATE media SET created_at = NOW() WHERE sha256 = %s AND ref_count = 0", (sha256,))
+            await tx.execute("INSERT IGNORE INTO media_grants (sha256, user_id) VALUES (%s, %s)",
+                             (sha256, int(user_id)))
+        self.hits += 1
+        return row
+
+    async def add(self, user_id, file_info) -> dict:
+        """
+        Sau khi lưu file user vừa upload đủ: ghi dòng media (chưa tin nào dùng) + quyền của user.
+        Gọi trong locked(sha256). Trả về {file_path, thumbnail_path} của dòng: nội dung đã có dòng
+        (vd. file cũ đặt tên kèm đuôi) thì đường dẫn của dòng đó thắng.
+        """
+        async with db.transaction() as tx:
+            await tx.execute(
+                """INSERT INTO media (sha256, file_size, file_path, thumbnail_path, ref_count)
+                   VALUES (%s, %s, %s, %s, 0)
+                   ON DUPLICATE KEY UPDATE created_at = IF(ref_count = 0, NOW(), created_at),
+                                           thumbnail_path = COALESCE(thumbnail_path, VALUES(thumbnail_path))""",
+                (file_info["file_hash"], file_info["file_size"], file_info["file_path"], file_info["thumbnail_path"])
+            )
+            await tx.execute("INSERT IGNORE INTO media_grants (sha256, user_id) VALUES (%s, %s)",
+                             (file_info["file_hash"], int(user_id)))
+            row = await tx.fetch_one("SELECT file_path, thumbnail_path FROM media WHERE sha256 = %s",
+                                     (file_info["file_hash"],))
+        self.stored += 1
+        return row
+
+    async def can_access(self, user_id, path) -> bool:
+        """
+        user được đọc/gửi file (hoặc thumbnail) này nếu nó nằm trong tin 1-1 user là người gửi/nhận,
+        trong tin của nhóm user là thành viên, hoặc là nội dung chính user đã upload.
+        """
+        if not path:
+            return False
+        user_id = int(user_id)
+        row = await db.fetch_one(
+            """SELECT 1 AS ok FROM private_messages
+               WHERE file_path = %s AND (sender_id = %s OR receiver_id = %s)
+               UNION ALL
+               SELECT 1 FROM private_messages
+               WHERE thumbnail_path = %s AND (sender_id = %s OR receiver_id = %s)
+               UNION ALL
+               SELECT 1 FROM group_messages gm
+               JOIN group_members mb ON mb.group_id = gm.group_id AND mb.user_id = %s
+               WHERE gm.file_path = %s OR gm.thumbnail_path = %s
+               UNION ALL
+               SELECT 1 FROM media m
+               JOIN media_grants g ON g.sha256 = m.sha256 AND g.user_id = %s
+               WHERE m.file_path = %s OR m.thumbnail_path = %s
+               LIMIT 1""",
+            (path, user_id, user_id, path, user_id, user_id, user_id, path, path, user_id, path, path)
+        )
+        if row is None:
+            self.denied += 1
+            return False
+        return True
+
+    async def add_reference(self, file_path):
+        """Tin nhắn vừa lưu đính kèm file này (file cũ ngoài store không có dòng media -> bỏ qua)"""
+        await db.execute("UPDATE media SET ref_count = ref_count + 1 WHERE file_path = %s", (file_path,))
+
+    async def collect_unreferenced(self, max_age, batch=500) -> int:
+        """Xóa nội dung đã upload nhưng quá max_age giây không tin nhắn nào đính kèm. Trả về số file đã xóa."""
+        candidates = await db.fetch_all(
+            "SELECT sha256 FROM media WHERE ref_count = 0 AND created_at < NOW() - INTERVAL %s SECOND LIMIT %s",
+            (int(max_age), batch)
+        )
+        removed = 0
+        for candidate in candidates:
+            # Không xóa file giữa lúc một commit upload cùng nội dung thấy file đã có và bỏ .part của nó
+            async with self.locked(candidate["sha256"]):
+                async with db.transaction() as tx:
+                    # Kiểm tra lại dưới khóa: có thể vừa được gửi kèm tin / claim lại
+                    row = await tx.fetch_one(
+                        """SELECT file_path, thumbnail_path FROM media
+                           WHERE sha256 = %s AND ref_count = 0 AND created_at < NOW() - INTERVAL %s SECOND
+                           FOR UPDATE""",
+                        (candidate["sha256"], int(max_age))
+                    )
+                    if row is None:
+                        continue
+                    await tx.execute("DELETE FROM media WHERE sha256 = %s", (candidate["sha256"],))
+                    await tx.execute("DELETE FROM media_grants WHERE sha256 = %s", (candidate["sha256"],))
+                await asyncio.get_running_loop().run_in_executor(
+                    None, _remove_files, row["file_path"], row["thumbnail_path"]
+                )
+            removed += 1
+        self.collected += removed
+        return removed
+
+    def get_stats(self) -> dict:
+        return {"dedup_hits": self.hits, "stored": self.stored, "collected": self.collected,
+                "access_denied": self.denied}
+
+
+# Dùng chung cho toàn server
+media_store = MediaStore()
@@ -0,0 +1,147 @@
+# server/media_stream.py
+import asyncio
+import mimetypes
+from pathlib import Path
+
+from media_store import media_store
+from outbound_queue import BINARY_FRAME_FLAG
+
+
+MEDIA_ROOT = "uploads"                # cùng thư mục gốc với MediaHandler
+DOWNLOAD_CHUNK_SIZE = 512 * 1024      # byte mỗi frame: frame khác (tin nhắn, push) chen vào giữa các chunk
+# Payload frame chunk tải xuống: download_id (16 byte) + offset (8 byte big-endian) + dữ liệu
+CHUNK_HEADER_SIZE = 24
+
+
+class MediaStreamer:
+    """
+    Phục vụ file media đã lưu (hoặc một khoảng byte của nó) qua socket chat dưới dạng các frame
+    nhị phân. Thân mỗi chunk được gửi bằng loop.sendfile từ file trên đĩa, không đọc vào buffer Python.
+    Task stream được giữ theo từng outbound, hủy bằng cancel(outbound) khi session đóng.
+    """
+
+    def __init__(self, media_root=MEDIA_ROOT, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        self.root = Path(media_root).resolve()
+        self.incoming = self.root / "incoming"   # file .part của UploadManager, chưa phải media
+        self.chunk_size = chunk_size
+        self._streams = {}   # {outbound: set(task)}
+
+        # Thống kê
+        self.requests = 0
+        self.active = 0
+        self.bytes_served = 0
+
+    def resolve(self, file_path):
+        """
+        Đường dẫn thật của file nếu nằm trong thư mục media, ngược lại None
+        (chặn ../, symlink ra ngoài và upload chưa xong trong incoming/)
+        """
+        try:
+            path = Path(file_path).resolve()
+        except (TypeError, ValueError, OSError):
+            return None
+        if self.root not in path.parents or self.incoming == path or self.incoming in path.parents:
+            return None
+        if not path.is_file():
+            return None
+        return path
+
+    async def start(self, outbound, file_path, download_id, offset=0, length=None) -> dict:
+        path = self.resolve(file_path)
+        if path is None:
+            return {"success": False, "message": "File không tồn tại"}
+        try:
+            id_bytes = bytes.fromhex(download_id)
+        except (TypeError, ValueError):
+            id_bytes = b""
+        if len(id_bytes) != 16:
+            return {"success": False, "message": "download_id không hợp lệ"}
+
+        file_size = path.stat().st_size
+        offset = int(offset or 0)
+        if offset < 0 or offset > file_size:
+            return {"success": False, "message": "offset ngoài phạm vi file", "file_size": file_size}
+        remaining = file_size - offset
+        length = remaining if length is None else max(0, min(int(length), remaining))
+
+        self.requests += 1
+        if length:
+            # Response JSON được xếp hàng trước chunk đầu tiên (task chỉ chạy sau khi handler trả về)
+            task = asyncio.ensure_future(self._stream(outbound, path, id_bytes, offset, length))
+            self._streams.setdefault(outbound, set()).add(task)
+            task.add_done_callback(lambda t, o=outbound: self._forget(o, t))
+        return {
+            "success": True,
+            "download_id": download_id,
+            "file_size": file_size,
+            "offset": offset,
+            "length": length,
+            "mime_type": mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+        }
+
+    def _forget(self, outbound, task):
+        tasks = self._streams.get(outbound)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._streams[outbound]
+
+    async def cancel(self, outbound):
+        """Hủy các download đang stream trên kết nối này (session đóng)"""
+        tasks = list(self._streams.pop(outbound, ()))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _stream(self, outbound, path, id_bytes, offset, length):
+        self.active += 1
+        sent = None
+        f = None
+        try:
+            f = open(path, "rb")
+            end = offset + length
+            while offset < end:
+                count = min(self.chunk_size, end - offset)
+                header = ((CHUNK_HEADER_SIZE + count) | BINARY_FRAME_FLAG).to_bytes(4, "big") \
+                    + id_bytes + offset.to_bytes(8, "big")
+                sent = outbound.enqueue_file(header, f, offset, count)
+                # Chờ chunk này gửi xong rồi mới xếp chunk sau: không chiếm cả hàng đợi.
+                # shield: bị hủy thì segment đã xếp vẫn gửi trọn (không cắt ngang frame)
+                if not await asyncio.shield(sent):
+                    return  # kết nối đã đóng
+                offset += count
+                self.bytes_served += count
+        except Exception as e:
+            print(f"❌ Lỗi stream media {path}: {e}")
+        finally:
+            self.active -= 1
+            if f is not None:
+                if sent is not None and not sent.done():
+                    # Segment còn trong hàng đợi vẫn đọc từ f: đóng khi nó gửi xong / kết nối đóng
+                    sent.add_done_callback(lambda _: f.close())
+                else:
+                    f.close()
+
+    def get_stats(self) -> dict:
+        return {"requests": self.requests, "active": self.active, "bytes_served": self.bytes_served}
+
+
+# Global instance
+media_streamer = MediaStreamer()
+
+
+# Đăng ký action với router của server
+from action_router import router
+
+
+async def _handle_download_media(session, p):
+    if not session.logged_in_user_id:
+        return {"success": False, "message": "Cần đăng nhập"}
+    # Chỉ tải file nằm trong tin nhắn mình xem được hoặc chính mình đã upload
+    if not await media_store.can_access(session.logged_in_user_id, p["file_path"]):
+        return {"success": False, "message": "File không tồn tại"}
+    return await media_streamer.start(session.outbound, p["file_path"], p["download_id"],
+                                      p.get("offset", 0), p.get("length"))
+
+
+router.register("download_media", _handle_download_media, required=("file_path", "download_id"))
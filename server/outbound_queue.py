@@ -0,0 +1,180 @@
+# server/outbound_queue.py
+import json
+import asyncio
+from collections import deque
+
+
+MAX_QUEUED_BYTES = 4 * 1024 * 1024   # Quá ngưỡng này coi là client chậm -> ngắt kết nối
+MAX_BATCH_FRAMES = 64                # Số frame tối đa gộp trong một lần writelines
+BINARY_FRAME_FLAG = 0x80000000       # Bit cao của length prefix: frame nhị phân (chunk upload), không phải JSON
+
+
+def encode_frame(message_dict: dict) -> bytes:
+    """JSON-encode và thêm 4 byte length prefix (big-endian) như client mong đợi"""
+    payload = json.dumps(message_dict, ensure_ascii=False).encode("utf-8")
+    return len(payload).to_bytes(4, "big") + payload
+
+
+class FileSegment:
+    """
+    Một frame nhị phân có phần thân nằm trong file: header (length prefix + metadata) được ghi
+    như frame thường, phần thân gửi bằng loop.sendfile (zero-copy khi transport hỗ trợ).
+    """
+
+    __slots__ = ("header", "file", "offset", "count", "done")
+
+    def __init__(self, header: bytes, file, offset: int, count: int, done: asyncio.Future):
+        self.header = header
+        self.file = file
+        self.offset = offset
+        self.count = count
+        self.done = done
+
+    def __len__(self):
+        # Chỉ header nằm trong bộ nhớ; thân file không tính vào queued_bytes
+        return len(self.header)
+
+
+class OutboundQueue:
+    """
+    Hàng đợi gửi đi của một kết nối. Người gửi chỉ enqueue (không await drain),
+    một writer task riêng gộp các frame đang chờ vào một lần writelines.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, max_bytes=MAX_QUEUED_BYTES,
+                 max_batch_frames=MAX_BATCH_FRAMES, on_overflow=None, name=None):
+        self.writer = writer
+        self.max_bytes = max_bytes
+        self.max_batch_frames = max_batch_frames
+        self.on_overflow = on_overflow   # callback(queue) khi vượt max_bytes
+        self.name = name
+
+        self._frames = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.closed = False
+
+        # Thống kê
+        self.queued_bytes = 0            # byte chưa được transport nhận hết (tính cả đang drain)
+        self.peak_queued_bytes = 0
+        self.frames_sent = 0
+        self.batches_sent = 0
+        self.frames_dropped = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, frame: bytes) -> bool:
+        """Đưa frame đã encode vào hàng đợi. Trả False nếu queue đã đóng hoặc tràn."""
+        if self.closed:
+            self.frames_dropped += 1
+            return False
+        if self.queued_bytes + len(frame) > self.max_bytes:
+            self.frames_dropped += 1
+            print(f"⚠️ Outbound queue overflow ({self.queued_bytes} bytes) for {self.name}")
+            self.closed = True
+            self._wakeup.set()
+            if self.on_overflow:
+                self.on_overflow(self)
+            return False
+        self._frames.append(frame)
+        self.queued_bytes += len(frame)
+        self.peak_queued_bytes = max(self.peak_queued_bytes, self.queued_bytes)
+        self._wakeup.set()
+        return True
+
+    def enqueue_json(self, message_dict: dict) -> bool:
+        return self.enqueue(encode_frame(message_dict))
+
+    def enqueue_file(self, header: bytes, file, offset: int, count: int) -> asyncio.Future:
+        """
+        Xếp một FileSegment sau các frame đang chờ. Future trả True khi đã gửi xong, False nếu
+        kết nối đóng. Người gọi nên chờ future trước khi xếp segment tiếp theo để frame khác chen vào được.
+        """
+        done = asyncio.get_running_loop().create_future()
+        if not self.enqueue(FileSegment(header, file, offset, count, done)):
+            done.set_result(False)
+        return done
+
+    @property
+    def depth(self) -> int:
+        return len(self._frames)
+
+    async def _run(self):
+        try:
+            while True:
+                if not self._frames:
+                    if self.closed:
+                        break
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                if isinstance(self._frames[0], FileSegment):
+                    await self._send_segment(self._frames.popleft())
+                    continue
+
+                batch = []
+                while (self._frames and len(batch) < self.max_batch_frames
+                       and not isinstance(self._frames[0], FileSegment)):
+                    batch.append(self._frames.popleft())
+                batch_bytes = sum(len(frame) for frame in batch)
+
+                self.writer.writelines(batch)
+                await self.writer.drain()
+
+                self.queued_bytes -= batch_bytes
+                self.frames_sent += len(batch)
+                self.batches_sent += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Outbound writer stopped for {self.name}: {e}")
+        finally:
+            self.closed = True
+            self.frames_dropped += len(self._frames)
+            for frame in self._frames:
+                if isinstance(frame, FileSegment) and not frame.done.done():
+                    frame.done.set_result(False)
+            self._frames.clear()
+
+    async def _send_segment(self, segment: FileSegment):
+        try:
+            self.writer.write(segment.header)
+            await self.writer.drain()
+            # fallback=True: transport không hỗ trợ sendfile (vd. TLS) thì asyncio tự đọc/ghi theo khối
+            await asyncio.get_running_loop().sendfile(
+                self.writer.transport, segment.file, segment.offset, segment.count, fallback=True
+            )
+        except BaseException:
+            if not segment.done.done():
+                segment.done.set_result(False)
+            raise
+        self.queued_bytes -= len(segment)
+        self.frames_sent += 1
+        self.batches_sent += 1
+        if not segment.done.done():
+            segment.done.set_result(True)
+
+    async def close(self, timeout=2.0):
+        """Ngừng nhận frame mới, cố gửi nốt phần còn lại trong thời gian timeout"""
+        self.closed = True
+        self._wakeup.set()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout=timeout)
+        except (asyncio.TimeoutError, Exception):
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        return {
+            "queued_frames": len(self._frames),
+            "queued_bytes": self.queued_bytes,
+            "peak_queued_bytes": self.peak_queued_bytes,
+            "frames_sent": self.frames_sent,
+            "batches_sent": self.batches_sent,
+            "frames_dropped": self.frames_dropped,
+        }
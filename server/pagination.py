@@ -0,0 +1,71 @@
+# server/pagination.py
+import base64
+from datetime import datetime
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def clamp_limit(limit, default=DEFAULT_PAGE_SIZE) -> int:
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def encode_cursor(time_send, message_id) -> str:
+    """Cursor mờ (opaque) cho vị trí (time_send, message_id) trong lịch sử"""
+    if isinstance(time_send, datetime):
+        time_send = time_send.strftime("%Y-%m-%d %H:%M:%S.%f")
+    raw = f"{time_send}|{message_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    """Trả về (time_send, message_id). Raise ValueError nếu cursor không hợp lệ."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        time_send, message_id = raw.rsplit("|", 1)
+        datetime.strptime(time_send, "%Y-%m-%d %H:%M:%S.%f")
+        return time_send, int(message_id)
+    except Exception:
+        raise ValueError("Cursor không hợp lệ")
+
+
+def keyset_clause(time_col: str, id_col: str, before=None, after=None):
+    """
+    Điều kiện WHERE + ORDER BY cho keyset pagination trên (time_col, id_col).
+    - before: lấy tin cũ hơn cursor (mặc định: trang mới nhất)
+    - after: lấy tin mới hơn cursor
+    Trả về (where_sql, params, order_sql). Không dùng OFFSET nên mỗi trang là O(page size).
+    """
+    if after:
+        time_send, message_id = decode_cursor(after)
+        return (f"({time_col} > %s OR ({time_col} = %s AND {id_col} > %s))",
+                (time_send, time_send, message_id),
+                f"{time_col} ASC, {id_col} ASC")
+    if before:
+        time_send, message_id = decode_cursor(before)
+        return (f"({time_col} < %s OR ({time_col} = %s AND {id_col} < %s))",
+                (time_send, time_send, message_id),
+                f"{time_col} DESC, {id_col} DESC")
+    return "1 = 1", (), f"{time_col} DESC, {id_col} DESC"
+
+
+def keyset_page(rows, limit, time_key, id_key, after=None):
+    """
+    rows được query với LIMIT limit + 1. Trả về (rows_cũ_đến_mới, next_cursor, has_more).
+    next_cursor tiếp tục cùng chiều: tin cũ hơn với before, tin mới hơn với after.
+    """
+    rows = list(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(last[time_key], last[id_key])
+    if not after:
+        rows.reverse()  # đảo ngược để hiển thị từ cũ đến mới
+    return rows, next_cursor, has_more
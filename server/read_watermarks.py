@@ -0,0 +1,157 @@
+# server/read_watermarks.py
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+
+from database.db import db
+
+
+READ_RECEIPT_INTERVAL = 1.0   # giây: tối đa một lần ghi watermark mỗi cuộc trò chuyện
+MAX_CACHED_WATERMARKS = 100000
+
+UPSERT_SQL = (
+    "INSERT INTO read_watermarks (reader_id, peer_id, last_read_message_id, read_at) VALUES (%s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE last_read_message_id = GREATEST(last_read_message_id, VALUES(last_read_message_id)), "
+    "read_at = VALUES(read_at)"
+)
+
+
+class ReadWatermarks:
+    """
+    Trạng thái đã đọc của chat 1-1 dưới dạng watermark: reader đã đọc mọi tin của peer
+    có message_private_id <= last_read_message_id. Một dòng mỗi (reader, peer) thay vì
+    UPDATE is_read trên từng tin nhắn.
+
+    Receipt được debounce theo cuộc trò chuyện: receipt đầu tiên ghi ngay, các receipt
+    đến trong READ_RECEIPT_INTERVAL sau đó được gộp thành một lần ghi cuối cửa sổ.
+    """
+
+    def __init__(self, interval=READ_RECEIPT_INTERVAL, max_entries=MAX_CACHED_WATERMARKS):
+        self.interval = interval
+        self.max_entries = max_entries
+        self._marks = OrderedDict()   # {(reader_id, peer_id): (last_read_message_id, read_at)}
+        self._cooldown = set()        # cuộc trò chuyện vừa ghi, đang trong cửa sổ debounce
+        self._pending = {}            # {(reader_id, peer_id): (message_id, on_applied)} chờ cuối cửa sổ
+        self._tasks = set()           # task ghi cuối cửa sổ đang chạy (giữ reference tới khi xong)
+
+        # Thống kê
+        self.receipts = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.skipped = 0
+
+    # ---------------------------
+    # Đọc
+    # ---------------------------
+    async def get(self, reader_id, peer_id):
+        """(last_read_message_id, read_at) - (0, None) nếu reader chưa đọc tin nào của peer"""
+        key = (int(reader_id), int(peer_id))
+        mark = self._marks.get(key)
+        if mark is not None:
+            self._marks.move_to_end(key)
+            return mark
+        row = await db.fetch_one(
+            "SELECT last_read_message_id, read_at FROM read_watermarks WHERE reader_id = %s AND peer_id = %s",
+            key
+        )
+        loaded = (int(row["last_read_message_id"]), row["read_at"]) if row else (0, None)
+        return self._store(key, loaded)
+
+    # ---------------------------
+    # Ghi
+    # ---------------------------
+    async def submit(self, reader_id, peer_id, message_id=None, on_applied=None) -> bool:
+        """
+        Receipt "reader đã đọc tới message_id" (None = tin mới nhất của peer).
+        on_applied(last_read_message_id, read_at) là coroutine chạy sau khi watermark tiến lên.
+        Trả về False nếu receipt bị gộp vào lần ghi cuối cửa sổ debounce.
+        """
+        key = (int(reader_id), int(peer_id))
+        message_id = int(message_id) if message_id else None
+        self.receipts += 1
+        if key in self._cooldown:
+            previous = self._pending.get(key)
+            if previous is not None and previous[0] is not None and message_id is not None:
+                message_id = max(previous[0], message_id)
+            elif previous is not None:
+                message_id = None   # một trong hai là "tin mới nhất"
+            self._pending[key] = (message_id, on_applied)
+            self.coalesced += 1
+            return False
+        await self._apply(key, message_id, on_applied)
+        return True
+
+    async def _apply(self, key, message_id, on_applied):
+        self._cooldown.add(key)
+        asyncio.get_running_loop().call_later(self.interval, self._end_cooldown, key)
+
+        if message_id is None:
+            # Tin mới nhất peer gửi cho reader (idx_conversation_time)
+            row = await db.fetch_one(
+                "SELECT MAX(message_private_id) AS last_id FROM private_messages "
+                "WHERE user_low = %s AND user_high = %s AND sender_id = %s",
+                (min(key), max(key), key[1])
+            )
+            message_id = int(row["last_id"]) if row and row["last_id"] else 0
+
+        current_id, _ = await self.get(*key)
+        if message_id <= current_id:
+            self.skipped += 1  # không có gì mới để đánh dấu
+            return
+
+        read_at = datetime.now().replace(microsecond=0)
+        await db.execute(UPSERT_SQL, key + (message_id, read_at))
+        self.writes += 1
+        self._store(key, (message_id, read_at))
+        if on_applied is not None:
+            await on_applied(message_id, read_at)
+
+    def _end_cooldown(self, key):
+        self._cooldown.discard(key)
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            self._spawn(key, *pending)
+
+    def _spawn(self, key, message_id, on_applied):
+        task = asyncio.ensure_future(self._apply_pending(key, message_id, on_applied))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _apply_pending(self, key, message_id, on_applied):
+        try:
+            await self._apply(key, message_id, on_applied)
+        except Exception as e:
+            print(f"❌ Lỗi ghi read watermark {key}: {e}")
+
+    async def close(self):
+        """Server dừng: ghi ngay các receipt đang chờ cuối cửa sổ debounce và chờ mọi lần ghi xong"""
+        pending, self._pending = self._pending, {}
+        for key, (message_id, on_applied) in pending.items():
+            self._spawn(key, message_id, on_applied)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _store(self, key, mark):
+        # Watermark chỉ tăng: giữ giá trị lớn hơn nếu đã có (vd. ghi xen giữa lúc đang nạp)
+        existing = self._marks.get(key)
+        if existing is not None and existing[0] >= mark[0]:
+            mark = existing
+        self._marks[key] = mark
+        self._marks.move_to_end(key)
+        while len(self._marks) > self.max_entries:
+            self._marks.popitem(last=False)
+        return mark
+
+    def get_stats(self) -> dict:
+        return {
+            "cached": len(self._marks),
+            "pending": len(self._pending),
+            "receipts": self.receipts,
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+        }
+
+
+# Watermark dùng chung cho toàn server
+read_watermarks = ReadWatermarks()
@@ -0,0 +1,113 @@
+# server/resume_tokens.py
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+
+RESUME_TOKEN_TTL = int(os.environ.get("PYCTALK_RESUME_TTL", 12 * 3600))   # giây
+SECRET_FILE = os.environ.get(
+    "PYCTALK_RESUME_SECRET_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".resume_secret")
+)
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _load_secret() -> bytes:
+    """
+    Khóa HMAC phải sống qua lần restart server (nếu không mọi token đều hỏng đúng lúc cần).
+    Ưu tiên biến môi trường, sau đó file khóa; chưa có thì tạo file mới (chỉ owner đọc được).
+    """
+    secret = os.environ.get("PYCTALK_RESUME_SECRET")
+    if secret:
+        return secret.encode()
+    try:
+        with open(SECRET_FILE, "rb") as f:
+            secret = f.read().strip()
+        if secret:
+            return secret
+    except FileNotFoundError:
+        pass
+    secret = secrets.token_hex(32).encode()
+    try:
+        fd = os.open(SECRET_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secret)
+    except OSError as e:
+        print(f"⚠️ Không ghi được {SECRET_FILE} ({e}) - resume token sẽ hết hiệu lực khi restart server")
+    return secret
+
+
+class ResumeTokens:
+    """
+    Token nối lại phiên: "<payload base64>.<HMAC-SHA256>" với payload {uid, name, exp}.
+    Kiểm tra chỉ là một HMAC + so thời hạn, không chạm bảng users / không băm mật khẩu,
+    nên sau khi server restart cả loạt client kết nối lại không thành một loạt login đầy đủ.
+    """
+
+    def __init__(self, secret=None, ttl=RESUME_TOKEN_TTL):
+        self._secret = secret if secret is not None else _load_secret()
+        self.ttl = ttl
+        self._revoked = {}   # {signature: exp} - token đã logout, giữ tới khi hết hạn
+
+        # Thống kê
+        self.issued = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    def _sign(self, body: str) -> str:
+        return _b64encode(hmac.new(self._secret, body.encode(), hashlib.sha256).digest())
+
+    def issue(self, user_id, username) -> str:
+        payload = {"uid": int(user_id), "name": username, "exp": int(time.time()) + self.ttl}
+        body = _b64encode(json.dumps(payload, separators=(",", ":")).encode())
+        self.issued += 1
+        return f"{body}.{self._sign(body)}"
+
+    def verify(self, token):
+        """payload {uid, name, exp} nếu token hợp lệ và còn hạn, ngược lại None"""
+        payload = None
+        try:
+            body, signature = token.split(".", 1)
+            if hmac.compare_digest(signature, self._sign(body)) and signature not in self._revoked:
+                payload = json.loads(_b64decode(body))
+                if payload.get("exp", 0) < time.time():
+                    payload = None
+        except (AttributeError, ValueError):
+            payload = None
+        if payload is None:
+            self.rejected += 1
+        else:
+            self.accepted += 1
+        return payload
+
+    def revoke(self, token):
+        """Logout: token không dùng được nữa (chỉ trong process này; sau restart hết hạn theo TTL)"""
+        payload = self.verify(token)
+        if payload is None:
+            return
+        now = time.time()
+        self._revoked = {sig: exp for sig, exp in self._revoked.items() if exp >= now}
+        self._revoked[token.split(".", 1)[1]] = payload["exp"]
+
+    def get_stats(self) -> dict:
+        return {
+            "ttl": self.ttl,
+            "issued": self.issued,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "revoked": len(self._revoked),
+        }
+
+
+# Dùng chung cho toàn server
+resume_tokens = ResumeTokens()
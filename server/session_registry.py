@@ -0,0 +1,95 @@
+# server/session_registry.py
+import time
+import uuid
+
+
+class SessionInfo:
+    """Metadata của một phiên đăng nhập (một thiết bị)"""
+
+    __slots__ = ("session_id", "user_id", "username", "outbound", "device", "client_address", "connected_at")
+
+    def __init__(self, session_id, user_id, username, outbound, device=None, client_address=None):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.username = username
+        self.outbound = outbound
+        self.device = device
+        self.client_address = client_address
+        self.connected_at = time.time()
+
+    @property
+    def queue_depth(self) -> int:
+        return self.outbound.depth if self.outbound is not None else 0
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "username": self.username,
+            "device": self.device,
+            "client_address": str(self.client_address) if self.client_address else None,
+            "connected_at": self.connected_at,
+            "queue_depth": self.queue_depth,
+        }
+
+
+class SessionRegistry:
+    """
+    user_id -> tập các phiên đang sống. Thêm/xóa O(1), push tới mọi thiết bị
+    của một user là O(số thiết bị), không còn entry trùng theo username/user_id.
+    """
+
+    def __init__(self):
+        self._sessions = {}   # {session_id: SessionInfo}
+        self._by_user = {}    # {user_id (str): {session_id, ...}}
+
+    def register(self, user_id, username, outbound, device=None, client_address=None) -> str:
+        session_id = uuid.uuid4().hex
+        user_key = str(user_id)
+        info = SessionInfo(session_id, user_key, username, outbound, device, client_address)
+        self._sessions[session_id] = info
+        self._by_user.setdefault(user_key, set()).add(session_id)
+        print(f"✅ User {username} (ID: {user_key}) online - session {session_id} "
+              f"({len(self._by_user[user_key])} thiết bị)")
+        return session_id
+
+    def unregister(self, session_id):
+        info = self._sessions.pop(session_id, None)
+        if info is None:
+            return None
+        user_sessions = self._by_user.get(info.user_id)
+        if user_sessions is not None:
+            user_sessions.discard(session_id)
+            if not user_sessions:
+                del self._by_user[info.user_id]
+        print(f"❌ Session {session_id} của {info.username} đã gỡ khỏi registry")
+        return info
+
+    def get_session(self, session_id):
+        return self._sessions.get(session_id)
+
+    def get_user_sessions(self, user_id) -> list:
+        return [self._sessions[sid] for sid in self._by_user.get(str(user_id), ())]
+
+    def get_user_outbounds(self, user_id) -> list:
+        """Hàng đợi gửi của mọi thiết bị đang online của user"""
+        return [self._sessions[sid].outbound for sid in self._by_user.get(str(user_id), ())]
+
+    def is_online(self, user_id) -> bool:
+        return str(user_id) in self._by_user
+
+    def online_user_ids(self) -> list:
+        return list(self._by_user.keys())
+
+    def get_stats(self) -> dict:
+        depths = [info.queue_depth for info in self._sessions.values()]
+        return {
+            "users_online": len(self._by_user),
+            "sessions": len(self._sessions),
+            "max_queue_depth": max(depths) if depths else 0,
+            "total_queue_depth": sum(depths),
+        }
+
+
+# Registry dùng chung cho toàn server
+registry = SessionRegistry()
@@ -0,0 +1,165 @@
+# server/unread_counters.py
+import asyncio
+from collections import OrderedDict
+
+from database.db import db
+
+
+MAX_CACHED_USERS = 50000   # LRU: số user giữ bộ đếm trong RAM
+
+PEER_USER = "user"
+PEER_GROUP = "group"
+
+INCREMENT_SQL = (
+    "INSERT INTO unread_counters (user_id, peer_type, peer_id, unread) VALUES (%s, %s, %s, 1) "
+    "ON DUPLICATE KEY UPDATE unread = unread + 1"
+)
+
+
+class UnreadCounters:
+    """
+    Bộ đếm tin chưa đọc theo (user, peer) với peer là user (chat 1-1) hoặc group.
+    Tăng khi gửi, về 0 khi đọc; lưu ở bảng unread_counters và cache trong RAM
+    theo user (nạp lần đầu, LRU), nên badge là O(số cuộc trò chuyện) thay vì quét tin nhắn.
+    """
+
+    def __init__(self, max_users=MAX_CACHED_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()   # {user_id: {(peer_type, peer_id): unread}}
+        self._loading = {}            # {user_id: Future}
+        self._stale = set()           # user có ghi trong lúc đang nạp -> không lưu kết quả nạp
+
+        # Thống kê
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.increments = 0
+        self.resets = 0
+
+    # ---------------------------
+    # Đọc
+    # ---------------------------
+    async def get_counts(self, user_id) -> dict:
+        """{(peer_type, peer_id): unread} - chỉ các cuộc trò chuyện còn tin chưa đọc"""
+        user_id = int(user_id)
+        counts = self._users.get(user_id)
+        if counts is not None:
+            self.hits += 1
+            self._users.move_to_end(user_id)
+            return counts
+
+        self.misses += 1
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = loading
+        try:
+            # Lỗi DB phải báo lên: cache {} sẽ xóa badge của user tới khi bị LRU đẩy ra
+            rows = await db.fetch_all(
+                "SELECT peer_type, peer_id, unread FROM unread_counters WHERE user_id = %s AND unread > 0",
+                (user_id,), raise_errors=True
+            )
+            counts = {(row["peer_type"], int(row["peer_id"])): int(row["unread"]) for row in rows}
+            if user_id in self._stale:
+                self._stale.discard(user_id)
+            else:
+                self._users[user_id] = counts
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+                    self.evictions += 1
+            loading.set_result(counts)
+            return counts
+        except Exception as e:
+            loading.set_exception(e)
+            loading.exception()
+            raise
+        finally:
+            self._loading.pop(user_id, None)
+
+    async def get_badges(self, user_id) -> dict:
+        """Dạng trả cho client: {"users": {peer_id: n}, "groups": {group_id: n}, "total": n}"""
+        counts = await self.get_counts(user_id)
+        badges = {"users": {}, "groups": {}, "total": 0}
+        for (peer_type, peer_id), unread in counts.items():
+            badges["users" if peer_type == PEER_USER else "groups"][str(peer_id)] = unread
+            badges["total"] += unread
+        return badges
+
+    # ---------------------------
+    # Ghi
+    # ---------------------------
+    async def write_increments(self, tx, entries):
+        """
+        +1 cho mỗi (user_id, peer_type, peer_id) bằng một executemany trong transaction của người gọi
+        (cùng commit với INSERT tin nhắn). Gọi apply_increments sau khi transaction commit.
+        """
+        if entries:
+            # Thứ tự khóa cố định giữa các transaction đồng thời -> tránh deadlock
+            await tx.executemany(INCREMENT_SQL, sorted(entries))
+
+    def apply_increments(self, entries):
+        """Cập nhật bộ đếm trong RAM cho các dòng write_increments đã commit"""
+        for user_id, peer_type, peer_id in entries:
+            counts = self._writable(user_id)
+            if counts is not None:
+                counts[(peer_type, peer_id)] = counts.get((peer_type, peer_id), 0) + 1
+        self.increments += len(entries)
+
+    async def reset(self, user_id, peer_type, peer_id):
+        """Về 0 khi user đã đọc cuộc trò chuyện; bỏ qua câu UPDATE nếu RAM biết đã là 0"""
+        user_id, peer_id = int(user_id), int(peer_id)
+        counts = self._users.get(user_id)
+        if counts is not None and (peer_type, peer_id) not in counts:
+            return
+        await db.execute(
+            "UPDATE unread_counters SET unread = 0 WHERE user_id = %s AND peer_type = %s AND peer_id = %s",
+            (user_id, peer_type, peer_id)
+        )
+        counts = self._writable(user_id)
+        if counts is not None:
+            counts.pop((peer_type, peer_id), None)
+        self.resets += 1
+
+    async def lower_to(self, user_id, peer_type, peer_id, unread):
+        """Đọc tới giữa cuộc trò chuyện: badge còn tối đa `unread` (số tin mới hơn watermark)"""
+        if unread <= 0:
+            await self.reset(user_id, peer_type, peer_id)
+            return
+        user_id, peer_id = int(user_id), int(peer_id)
+        counts = self._users.get(user_id)
+        if counts is not None and counts.get((peer_type, peer_id), 0) <= unread:
+            return
+        # LEAST: không đè mất tin vừa đến sau lúc đếm
+        await db.execute(
+            "UPDATE unread_counters SET unread = LEAST(unread, %s) "
+            "WHERE user_id = %s AND peer_type = %s AND peer_id = %s",
+            (int(unread), user_id, peer_type, peer_id)
+        )
+        counts = self._writable(user_id)
+        if counts is not None and (peer_type, peer_id) in counts:
+            counts[(peer_type, peer_id)] = min(counts[(peer_type, peer_id)], int(unread))
+        self.resets += 1
+
+    def _writable(self, user_id):
+        if user_id in self._loading:
+            self._stale.add(user_id)
+        return self._users.get(user_id)
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._users),
+            "max_users": self.max_users,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+            "increments": self.increments,
+            "resets": self.resets,
+        }
+
+
+# Bộ đếm dùng chung cho toàn server
+unread_counters = UnreadCounters()
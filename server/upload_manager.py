@@ -0,0 +1,297 @@
+# server/upload_manager.py
+import asyncio
+import functools
+import hashlib
+import os
+import time
+
+from media_handler import MediaHandler
+from image_pipeline import image_pipeline
+from media_store import media_store
+
+
+# Payload frame chunk (frame nhị phân, xem BINARY_FRAME_FLAG trong outbound_queue):
+# upload_id (16 byte) + offset (8 byte big-endian) + dữ liệu
+CHUNK_HEADER_SIZE = 24
+UPLOAD_CHUNK_SIZE = 256 * 1024   # client gửi tối đa chừng này byte mỗi frame
+UPLOAD_TTL = 24 * 3600           # giây: file .part bỏ dở quá hạn thì xóa
+
+
+class UploadError(Exception):
+    pass
+
+
+class _Upload:
+    """Trạng thái một upload đang dở: dữ liệu nằm trong file .part, hash tính dần theo chunk"""
+
+    __slots__ = ("upload_id", "user_id", "file_name", "size", "sha256", "path", "offset", "hasher",
+                 "lock", "updated_at")
+
+    def __init__(self, upload_id, user_id, file_name, size, sha256, path):
+        self.upload_id = upload_id
+        self.user_id = int(user_id)
+        self.file_name = file_name
+        self.size = size
+        self.sha256 = sha256
+        self.path = path
+        self.offset = 0
+        self.hasher = hashlib.sha256()
+        self.lock = asyncio.Lock()
+        self.updated_at = time.time()
+
+
+def _write_at(path, offset, data, hasher):
+    """Chạy trong thread: ghi chunk vào cuối file .part và cập nhật hash"""
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+        f.truncate()
+    hasher.update(data)
+
+
+def _rehash_prefix(path, length, hasher):
+    """Chạy trong thread: nối lại upload sau restart - băm lại phần đã nhận trên đĩa"""
+    with open(path, "r+b") as f:
+        f.truncate(length)
+        remaining = length
+        while remaining:
+            block = f.read(min(1024 * 1024, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+
+
+class UploadManager:
+    """
+    Upload file theo chunk qua chính socket chat:
+    upload_begin (tên, size, sha256) -> các frame nhị phân (upload_id, offset, bytes) -> upload_commit.
+    Chunk được ghi thẳng xuống file .part (không giữ cả file trong RAM); upload_id suy ra từ
+    (user, sha256, size) nên gọi lại upload_begin sau khi mất kết nối sẽ trả offset đã nhận để gửi tiếp.
+    Nội dung (sha256) server đã có và user đã có quyền với nó thì upload_begin trả luôn metadata,
+    client không gửi byte nào.
+    """
+
+    def __init__(self, media_handler=None, chunk_size=UPLOAD_CHUNK_SIZE, ttl=UPLOAD_TTL, store=None,
+                 pipeline=None):
+        self.media = media_handler or MediaHandler()
+        self.store = store or media_store
+        self.pipeline = pipeline or image_pipeline
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.incoming_dir = self.media.base_dir / "incoming"
+        self.incoming_dir.mkdir(parents=True, exist_ok=True)
+        self._uploads = {}   # {upload_id: _Upload}
+        self._last_cleanup = 0.0
+        self._gc_task = None  # dọn nội dung không tin nào dùng (MediaStore.collect_unreferenced)
+
+        # Thống kê
+        self.started = 0
+        self.resumed = 0
+        self.completed = 0
+        self.deduplicated = 0
+        self.bytes_received = 0
+
+    # ---------------------------
+    # Action
+    # ---------------------------
+    async def begin(self, user_id, file_name, size, sha256) -> dict:
+        size = int(size)
+        sha256 = str(sha256).lower()
+        if size <= 0 or size > self.media.max_file_size:
+            return {"success": False, "message": f"Kích thước file không hợp lệ (tối đa {self.media.max_file_size} bytes)"}
+        if len(sha256) != 64:
+            return {"success": False, "message": "sha256 không hợp lệ"}
+        self._cleanup_stale()
+
+        stored = await self.store.claim(user_id, sha256, size)
+        if stored is not None:
+            self.deduplicated += 1
+            return {"success": True, "exists": True,
+                    "data": self._stored_file_info(stored, sha256, os.path.basename(file_name))}
+
+        upload_id = hashlib.sha256(f"{int(user_id)}:{sha256}:{size}".encode()).hexdigest()[:32]
+        upload = self._uploads.get(upload_id)
+        if upload is None:
+            path = self.incoming_dir / f"{upload_id}.part"
+            upload = _Upload(upload_id, user_id, os.path.basename(file_name), size, sha256, path)
+            if path.exists():
+                # Server đã restart giữa chừng: tiếp tục từ phần đã có trên đĩa
+                upload.offset = min(path.stat().st_size, size)
+                await asyncio.get_running_loop().run_in_executor(
+                    None, _rehash_prefix, path, upload.offset, upload.hasher
+                )
+            else:
+                path.touch()
+            self._uploads[upload_id] = upload
+            self.started += 1
+        if upload.offset:
+            self.resumed += 1
+        upload.updated_at = time.time()
+        return {"success": True, "upload_id": upload_id, "offset": upload.offset, "chunk_size": self.chunk_size}
+
+    async def write_chunk(self, user_id, payload: bytes) -> dict:
+        """Frame nhị phân từ client. Trả về ack (push upload_ack) với offset server đã nhận."""
+        if len(payload) < CHUNK_HEADER_SIZE:
+            raise UploadError("Chunk frame quá ngắn")
+        upload_id = payload[:16].hex()
+        offset = int.from_bytes(payload[16:CHUNK_HEADER_SIZE], "big")
+        data = memoryview(payload)[CHUNK_HEADER_SIZE:]
+
+        upload = self._uploads.get(upload_id)
+        if upload is None or upload.user_id != int(user_id):
+            return {"upload_id": upload_id, "success": False, "message": "Upload không tồn tại"}
+        async with upload.lock:
+            if offset != upload.offset:
+                # Chunk lặp/nhảy cóc (vd. gửi lại sau reconnect): báo offset đúng để client gửi từ đó
+                return {"upload_id": upload_id, "success": False, "offset": upload.offset, "resync": True,
+                        "message": "Sai offset"}
+            if offset + len(data) > upload.size:
+                return {"upload_id": upload_id, "success": False, "offset": upload.offset,
+                        "message": "Vượt quá kích thước đã khai báo"}
+            await asyncio.get_running_loop().run_in_executor(
+                None, _write_at, upload.path, offset, data, upload.hasher
+            )
+            upload.offset += len(data)
+            upload.updated_at = time.time()
+            self.bytes_received += len(data)
+        return {"upload_id": upload_id, "success": True, "offset": upload.offset}
+
+    async def commit(self, user_id, upload_id) -> dict:
+        upload = self._uploads.get(upload_id)
+        if upload is None or upload.user_id != int(user_id):
+            return {"success": False, "message": "Upload không tồn tại"}
+        async with upload.lock:
+            if upload.offset != upload.size:
+                return {"success": False, "offset": upload.offset,
+                        "message": f"Upload chưa đủ dữ liệu ({upload.offset}/{upload.size} bytes)"}
+            if upload.hasher.hexdigest() != upload.sha256:
+                self._discard(upload)
+                return {"success": False, "message": "sha256 không khớp, hãy upload lại"}
+            try:
+                async with self.store.locked(upload.sha256):
+                    file_info = await self._store_upload(upload)
+            finally:
+                self._discard(upload)
+        self.completed += 1
+        return {"success": True, "data": file_info}
+
+    async def abort(self, user_id, upload_id) -> dict:
+        upload = self._uploads.get(upload_id)
+        if upload is not None and upload.user_id == int(user_id):
+            self._discard(upload)
+        return {"success": True}
+
+    # ---------------------------
+    # Nội bộ
+    # ---------------------------
+    async def _store_upload(self, upload) -> dict:
+        """Chuyển .part vào store theo sha256 (hash đã tính lúc nhận) và ghi dòng media"""
+        loop = asyncio.get_running_loop()
+        file_info = await loop.run_in_executor(
+            None, functools.partial(self.media.save_uploaded_file, str(upload.path), upload.file_name,
+                                    file_hash=upload.sha256, move=True, create_thumbnail=False)
+        )
+        if file_info["message_type"] == "image" and not file_info["thumbnail_path"]:
+            # Decode/resize ảnh là CPU nặng -> process pool (không giữ GIL của event loop)
+            thumbnail = await self.pipeline.thumbnail(file_info["file_path"],
+                                                      self.media.thumbnail_path_for(file_info["file_path"]))
+            if thumbnail:
+                file_info.update(thumbnail)
+        row = await self.store.add(upload.user_id, file_info)
+        if row and row["file_path"] != file_info["file_path"]:
+            # Nội dung đã có dòng trỏ tới file khác (đặt tên kiểu cũ): dùng file đó, bỏ bản vừa ghi
+            try:
+                await loop.run_in_executor(None, os.remove, file_info["file_path"])
+            except OSError:
+                pass
+            file_info["file_path"] = row["file_path"]
+            file_info["unique_filename"] = os.path.basename(row["file_path"])
+        if row and row["thumbnail_path"]:
+            file_info["thumbnail_path"] = row["thumbnail_path"]
+        return file_info
+
+    def _stored_file_info(self, row, sha256, file_name) -> dict:
+        """Metadata như save_uploaded_file cho nội dung đã có trong store (tên/kiểu theo file_name mới)"""
+        return {
+            "message_type": self.media._determine_message_type(file_name),
+            "file_path": row["file_path"],
+            "file_name": file_name,
+            "unique_filename": os.path.basename(row["file_path"]),
+            "file_size": int(row["file_size"]),
+            "mime_type": self.media._get_mime_type(file_name),
+            "file_hash": sha256,
+            "thumbnail_path": row["thumbnail_path"],
+        }
+
+    def _discard(self, upload):
+        self._uploads.pop(upload.upload_id, None)
+        try:
+            os.remove(upload.path)
+        except OSError:
+            pass
+
+    def _cleanup_stale(self):
+        """Xóa upload bỏ dở và nội dung upload xong nhưng không được gửi, quá ttl (tối đa một lần mỗi giờ)"""
+        now = time.time()
+        if now - self._last_cleanup < 3600:
+            return
+        self._last_cleanup = now
+        if self._gc_task is None or self._gc_task.done():
+            self._gc_task = asyncio.ensure_future(self._collect_unreferenced())
+        for upload in [u for u in self._uploads.values() if now - u.updated_at > self.ttl]:
+            self._discard(upload)
+        for path in self.incoming_dir.glob("*.part"):
+            try:
+                if path.stem not in self._uploads and now - path.stat().st_mtime > self.ttl:
+                    path.unlink()
+            except OSError:
+                pass
+
+    async def _collect_unreferenced(self):
+        try:
+            removed = await self.store.collect_unreferenced(self.ttl)
+            if removed:
+                print(f"🧹 Đã xóa {removed} file upload không được gửi kèm tin nhắn nào")
+        except Exception as e:
+            print(f"❌ Lỗi dọn media không dùng: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "in_progress": len(self._uploads),
+            "started": self.started,
+            "resumed": self.resumed,
+            "completed": self.completed,
+            "deduplicated": self.deduplicated,
+            "bytes_received": self.bytes_received,
+            "store": self.store.get_stats(),
+            "thumbnails": self.pipeline.get_stats(),
+        }
+
+
+# Global instance
+upload_manager = UploadManager()
+
+
+# Đăng ký action với router của server
+from action_router import router
+
+
+def _require_login(handler):
+    async def wrapper(session, payload):
+        if not session.logged_in_user_id:
+            return {"success": False, "message": "Cần đăng nhập"}
+        return await handler(session, payload)
+    return wrapper
+
+
+router.register("upload_begin",
+                _require_login(lambda session, p: upload_manager.begin(session.logged_in_user_id, p["file_name"],
+                                                                       p["size"], p["sha256"])),
+                required=("file_name", "size", "sha256"))
+router.register("upload_commit",
+                _require_login(lambda session, p: upload_manager.commit(session.logged_in_user_id, p["upload_id"])),
+                required=("upload_id",))
+router.register("upload_abort",
+                _require_login(lambda session, p: upload_manager.abort(session.logged_in_user_id, p["upload_id"])),
+                required=("upload_id",))
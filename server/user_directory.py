@@ -0,0 +1,161 @@
+# server/user_directory.py
+import time
+from collections import OrderedDict
+
+from database.db import db
+
+
+MAX_CACHED_USERS = 50000   # LRU: quá số này thì bỏ user ít dùng nhất
+USER_TTL = 300             # giây; sau đó tra lại DB
+
+
+class UserDirectory:
+    """
+    Cache username <-> id trong process (LRU + TTL) để khỏi
+    SELECT id FROM users ... ở đầu hầu hết mọi request.
+    Chỉ cache user tồn tại; username so khớp không phân biệt hoa thường
+    như collation utf8mb4_general_ci của bảng users.
+    """
+
+    def __init__(self, max_size=MAX_CACHED_USERS, ttl=USER_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._by_id = OrderedDict()   # {user_id: (username, expires_at)}
+        self._by_name = {}            # {username.lower(): user_id}
+
+        # Thống kê
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------------------------
+    # Cache nội bộ
+    # ---------------------------
+    def prime(self, user_id, username):
+        """Ghi (id, username) vào cache, vd. sau login/register"""
+        user_id = int(user_id)
+        old = self._by_id.pop(user_id, None)
+        if old is not None:
+            self._by_name.pop(old[0].lower(), None)
+        self._by_id[user_id] = (username, time.monotonic() + self.ttl)
+        self._by_name[username.lower()] = user_id
+        while len(self._by_id) > self.max_size:
+            _, (evicted_name, _) = self._by_id.popitem(last=False)
+            self._by_name.pop(evicted_name.lower(), None)
+            self.evictions += 1
+
+    def invalidate(self, user_id=None, username=None):
+        if username is not None and user_id is None:
+            user_id = self._by_name.get(username.lower())
+        if user_id is None:
+            return
+        entry = self._by_id.pop(int(user_id), None)
+        if entry is not None:
+            self._by_name.pop(entry[0].lower(), None)
+
+    def _lookup_id(self, user_id):
+        entry = self._by_id.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            self.invalidate(user_id=user_id)
+            return None
+        self._by_id.move_to_end(user_id)
+        return entry[0]
+
+    # ---------------------------
+    # API cho handler
+    # ---------------------------
+    async def get_username(self, user_id):
+        """Username của user_id, None nếu không tồn tại"""
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        username = self._lookup_id(user_id)
+        if username is not None:
+            self.hits += 1
+            return username
+        self.misses += 1
+        row = await db.fetch_one("SELECT id, username FROM users WHERE id = %s", (user_id,))
+        if not row:
+            return None
+        self.prime(row["id"], row["username"])
+        return row["username"]
+
+    async def exists(self, user_id) -> bool:
+        return await self.get_username(user_id) is not None
+
+    async def get_id(self, username):
+        """user_id của username, None nếu không tồn tại"""
+        ids = await self.get_ids(username)
+        return ids.get(username)
+
+    async def get_ids(self, *usernames) -> dict:
+        """{username: user_id} cho các username tồn tại; các username chưa cache tra bằng một truy vấn"""
+        result, missing = {}, []
+        for username in usernames:
+            if not username:
+                continue
+            user_id = self._by_name.get(username.lower())
+            if user_id is not None and self._lookup_id(user_id) is not None:
+                self.hits += 1
+                result[username] = user_id
+            else:
+                self.misses += 1
+                missing.append(username)
+        if missing:
+            placeholders = ", ".join(["%s"] * len(missing))
+            rows = await db.fetch_all(
+                f"SELECT id, username FROM users WHERE username IN ({placeholders})", tuple(missing)
+            )
+            found = {}
+            for row in rows:
+                self.prime(row["id"], row["username"])
+                found[row["username"].lower()] = row["id"]
+            for username in missing:
+                if username.lower() in found:
+                    result[username] = found[username.lower()]
+        return result
+
+    async def filter_existing(self, user_ids) -> list:
+        """Giữ lại các user_id tồn tại (giữ thứ tự); id chưa cache tra bằng một truy vấn"""
+        ids = []
+        for user_id in user_ids:
+            try:
+                ids.append(int(user_id))
+            except (TypeError, ValueError):
+                continue
+        existing, missing = set(), []
+        for user_id in ids:
+            if self._lookup_id(user_id) is not None:
+                self.hits += 1
+                existing.add(user_id)
+            else:
+                self.misses += 1
+                missing.append(user_id)
+        if missing:
+            placeholders = ", ".join(["%s"] * len(missing))
+            rows = await db.fetch_all(
+                f"SELECT id, username FROM users WHERE id IN ({placeholders})", tuple(missing)
+            )
+            for row in rows:
+                self.prime(row["id"], row["username"])
+                existing.add(row["id"])
+        return [user_id for user_id in ids if user_id in existing]
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._by_id),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+        }
+
+
+# Cache dùng chung cho toàn server
+user_directory = UserDirectory()
@@ -0,0 +1,216 @@
+# server/write_behind.py
+import asyncio
+import time
+
+from database.db import db
+
+
+MAX_BATCH_ROWS = 200       # Flush khi đủ N dòng...
+FLUSH_INTERVAL = 0.005     # ...hoặc sau N giây kể từ dòng đầu tiên của batch, tùy cái nào đến trước
+MAX_QUEUED_ROWS = 10000    # Queue đầy -> submit() phải chờ (backpressure lên request)
+FLUSH_RETRIES = 1
+# aiomysql tự tách executemany thành nhiều câu khi vượt max_stmt_length (~1 MB); khi đó lastrowid chỉ là
+# id đầu của câu cuối. Tự chia dưới ngưỡng này để mỗi câu biết id dòng đầu của chính nó.
+MAX_STATEMENT_BYTES = 512 * 1024
+
+# Id của từng dòng = lastrowid + index * auto_increment_increment. Giả định: một multi-row INSERT ... VALUES
+# ("simple insert", biết trước số dòng) được InnoDB cấp một dải id liên tiếp trong một lần, đúng với
+# innodb_autoinc_lock_mode 0 và 1. Với mode 2 (mặc định từ MySQL 8.0) tài liệu không bảo đảm dải liên tiếp khi
+# có INSERT đồng thời vào cùng bảng -> cảnh báo ở lần flush đầu; bảng chỉ nên được ghi qua inserter này.
+
+
+def _statement_chunks(rows, limit=MAX_STATEMENT_BYTES):
+    """Chia rows thành các đoạn mà multi-row INSERT của mỗi đoạn chắc chắn không bị aiomysql tách"""
+    chunk, size = [], 0
+    for row in rows:
+        # Cận trên: escape nhiều nhất gấp đôi số byte, cộng dấu phẩy/nháy mỗi giá trị
+        row_size = sum(2 * len(str(value).encode()) + 4 for value in row) + 4
+        if chunk and size + row_size > limit:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+class WriteBehindInserter:
+    """
+    Gom các INSERT một dòng thành multi-row INSERT (group commit).
+    Mỗi batch là một transaction / một commit; người gọi await future để nhận id sau khi commit.
+    after_insert(tx, rows, ids): ghi kèm (vd. bộ đếm, bảng tóm tắt) trong cùng transaction với batch.
+    """
+
+    def __init__(self, insert_sql: str, max_batch_rows=MAX_BATCH_ROWS, flush_interval=FLUSH_INTERVAL,
+                 max_queued_rows=MAX_QUEUED_ROWS, name="write_behind", after_insert=None):
+        self.insert_sql = insert_sql   # "INSERT INTO t (a, b) VALUES (%s, %s)"
+        self.after_insert = after_insert
+        self.max_batch_rows = max_batch_rows
+        self.flush_interval = flush_interval
+        self.max_queued_rows = max_queued_rows
+        self.name = name
+        self._queue = None   # Tạo trong event loop đang chạy (start)
+        self._task = None
+        self._id_step = None  # @@auto_increment_increment, đọc ở lần flush đầu
+        self.closed = False
+
+        # Thống kê
+        self.rows_submitted = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.batches = 0
+        self.max_batch_size = 0
+        self.backpressure_waits = 0
+        self.total_flush_latency_ms = 0.0   # enqueue -> commit, cộng theo dòng
+        self.max_flush_latency_ms = 0.0
+        self.started_at = None
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queued_rows)
+            self.started_at = time.time()
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, params: tuple) -> asyncio.Future:
+        """
+        Đưa một dòng vào queue. Trả về future nhận id AUTO_INCREMENT sau khi batch commit
+        (None nếu ghi thất bại).
+        """
+        if self._task is None or self.closed:
+            raise RuntimeError(f"{self.name} chưa start hoặc đã đóng")
+        future = asyncio.get_running_loop().create_future()
+        if self._queue.full():
+            self.backpressure_waits += 1
+        await self._queue.put((params, future, time.perf_counter()))
+        self.rows_submitted += 1
+        if self._task.done():
+            # Chờ chỗ trong queue trong lúc close() hủy task flush: không còn ai ghi dòng này
+            self._fail_queued()
+        return future
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.perf_counter() + self.flush_interval
+            stop = False
+            while len(batch) < self.max_batch_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stop:
+                break
+
+    async def _flush(self, batch):
+        try:
+            await self._write_batch(batch)
+        except asyncio.CancelledError:
+            # close() hết thời gian: không biết batch đã commit hay chưa -> báo thất bại, không để handler chờ mãi
+            self._resolve_failed(batch)
+            raise
+
+    async def _write_batch(self, batch):
+        rows = [params for params, _, _ in batch]
+        for attempt in range(FLUSH_RETRIES + 1):
+            try:
+                ids = []
+                async with db.transaction() as tx:
+                    if self._id_step is None:
+                        await self._read_autoinc_settings(tx)
+                    for chunk in _statement_chunks(rows):
+                        # lastrowid là id dòng đầu của câu; các dòng sau cách nhau _id_step (xem ghi chú đầu file)
+                        result = await tx.executemany(self.insert_sql, chunk)
+                        first_id = result.lastrowid
+                        ids.extend(first_id + index * self._id_step if first_id else None
+                                   for index in range(len(chunk)))
+                    if self.after_insert is not None:
+                        await self.after_insert(tx, rows, ids)
+                break
+            except Exception as e:
+                print(f"❌ {self.name}: flush {len(rows)} dòng thất bại (lần {attempt + 1}): {e}")
+                if attempt < FLUSH_RETRIES:
+                    await asyncio.sleep(0.05)
+        else:
+            self._resolve_failed(batch)
+            return
+
+        now = time.perf_counter()
+        for message_id, (_, future, enqueued_at) in zip(ids, batch):
+            latency_ms = (now - enqueued_at) * 1000
+            self.total_flush_latency_ms += latency_ms
+            self.max_flush_latency_ms = max(self.max_flush_latency_ms, latency_ms)
+            if not future.done():
+                future.set_result(message_id)
+        self.rows_written += len(rows)
+        self.batches += 1
+        self.max_batch_size = max(self.max_batch_size, len(rows))
+
+    async def _read_autoinc_settings(self, tx):
+        row = await tx.fetch_one(
+            "SELECT @@auto_increment_increment AS step, @@innodb_autoinc_lock_mode AS lock_mode"
+        )
+        self._id_step = int(row["step"] or 1) if row else 1
+        if row and int(row["lock_mode"]) == 2:
+            print(f"⚠️ {self.name}: innodb_autoinc_lock_mode = 2, id suy từ lastrowid giả định dải id liên tiếp "
+                  f"cho mỗi multi-row INSERT (đặt 1 để được bảo đảm)")
+
+    def _resolve_failed(self, batch):
+        """future của các dòng không ghi được nhận None (handler báo lỗi cho client)"""
+        for item in batch:
+            if item is None:
+                continue
+            self.rows_failed += 1
+            if not item[1].done():
+                item[1].set_result(None)
+
+    def _fail_queued(self):
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        self._resolve_failed(batch)
+
+    async def close(self, timeout=5.0):
+        """Ngừng nhận dòng mới và flush nốt phần còn trong queue; hết thời gian thì báo thất bại phần còn lại"""
+        if self._task is None or self.closed:
+            return
+        self.closed = True
+
+        async def drain():
+            await self._queue.put(None)   # queue đầy thì chờ chỗ, cũng tính vào timeout
+            # shield: hết giờ thì tự hủy bên dưới và chờ task dọn xong batch đang ghi
+            await asyncio.shield(self._task)
+
+        try:
+            await asyncio.wait_for(drain(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ {self.name}: hết thời gian flush, còn {self._queue.qsize()} dòng chưa ghi")
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._fail_queued()
+
+    def get_stats(self) -> dict:
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        return {
+            "queued_rows": self._queue.qsize() if self._queue else 0,
+            "rows_submitted": self.rows_submitted,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "rows_per_sec": round(self.rows_written / elapsed, 2) if elapsed else 0,
+            "batches": self.batches,
+            "avg_batch_size": round(self.rows_written / self.batches, 2) if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "avg_flush_latency_ms": round(self.total_flush_latency_ms / self.rows_written, 2) if self.rows_written else 0,
+            "max_flush_latency_ms": round(self.max_flush_latency_ms, 2),
+            "backpressure_waits": self.backpressure_waits,
+        }